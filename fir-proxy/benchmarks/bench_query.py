@@ -0,0 +1,86 @@
+# benchmarks/bench_query.py
+"""
+代理池查询基准: 比较 ProxyRotator.query (多维索引) 与遍历 all_proxies 后排序 (原界面列表的做法) 的耗时.
+
+用法: python benchmarks/bench_query.py [--size 100000] [--limit 100]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.query import anonymity_level
+from modules.rotator import ProxyRotator
+
+REGIONS = ('United States', 'Germany', 'Japan', 'Singapore', 'France', 'United Kingdom', 'Netherlands', 'Brazil')
+PROTOCOLS = ('HTTP', 'SOCKS4', 'SOCKS5')
+ANONYMITY = ('Elite', 'Anonymous', 'Transparent')
+
+QUERIES = (
+    ('不限', {}),
+    ('地区', {'region': 'Japan'}),
+    ('协议', {'protocol': 'socks5'}),
+    ('匿名度>=Anonymous', {'min_anonymity': 'Anonymous'}),
+    ('延迟<2000ms', {'max_latency_ms': 2000}),
+    ('延迟<750ms', {'max_latency_ms': 750}),
+    ('地区+协议+匿名+延迟', {'region': 'Germany', 'protocol': 'http', 'min_anonymity': 'Elite', 'max_latency_ms': 1200}),
+)
+
+
+def build(count):
+    random.seed(1)
+    rotator = ProxyRotator()
+    rotator.add_many({
+        'proxy': f"{i >> 24 & 255 or 1}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{1080 + i % 50000}",
+        'protocol': random.choice(PROTOCOLS), 'status': 'Working', 'latency': random.uniform(0.05, 6.0),
+        'speed': random.uniform(0.1, 20.0), 'anonymity': random.choice(ANONYMITY),
+        'location': random.choice(REGIONS), 'score': random.uniform(0, 200),
+    } for i in range(count))
+    return rotator
+
+
+def scan(rotator, region=None, protocol=None, min_anonymity=None, max_latency_ms=None, limit=None):
+    level = anonymity_level(min_anonymity) if min_anonymity else -1
+    result = [
+        p for p in sorted(rotator.all_proxies, key=lambda p: p.get('score', 0), reverse=True)
+        if (region is None or p.get('location') == region)
+        and (protocol is None or p.get('protocol') == protocol.upper())
+        and anonymity_level(p.get('anonymity')) >= level
+        and (max_latency_ms is None or p.get('latency') * 1000 < max_latency_ms)
+    ]
+    return result[:limit] if limit is not None else result
+
+
+def timed(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--size', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=100)
+    args = parser.parse_args()
+
+    rotator = build(args.size)
+    start = time.perf_counter()
+    rotator.query(limit=1)
+    print(f"{args.size} 个代理, 首次查询建立索引 {(time.perf_counter() - start) * 1000:.0f} ms")
+    print(f"{'条件':<24}{'结果数':>8}{'query (ms)':>12}{'遍历+排序 (ms)':>16}")
+    for name, conditions in QUERIES:
+        elapsed, result = timed(lambda: rotator.query(limit=args.limit, **conditions), 20)
+        baseline, expected = timed(lambda: scan(rotator, limit=args.limit, **conditions), 2)
+        assert [p.get('score') for p in result] == [p.get('score') for p in expected], name
+        print(f"{name:<24}{len(result):>8}{elapsed * 1000:>12.3f}{baseline * 1000:>16.1f}")
+
+
+if __name__ == '__main__':
+    main()
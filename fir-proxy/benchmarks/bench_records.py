@@ -0,0 +1,86 @@
+# benchmarks/bench_records.py
+"""
+代理记录内存基准: 比较每个代理一个 dict 与 ProxyRecord 的内存占用和完整 GC 耗时.
+记录按验证器的方式构造 (协议经 upper() 生成, 地区来自查询接口的 JSON 解析), 可选同时加入轮换器.
+
+用法: python benchmarks/bench_records.py [--sizes 10000 100000 1000000] [--rotator]
+"""
+
+import argparse
+import gc
+import json
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.record import ProxyRecord
+from modules.rotator import ProxyRotator
+
+REGIONS = ('United States', 'Germany', 'Japan', 'Singapore', 'France', 'United Kingdom', 'Netherlands', 'Brazil')
+PROTOCOLS = ('http', 'socks4', 'socks5')
+ANONYMITY = ('Elite', 'Anonymous', 'Transparent')
+
+
+def make_fields(i):
+    return dict(
+        proxy=f"{i >> 24 & 255 or 1}.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{1080 + i % 50000}",
+        protocol=PROTOCOLS[i % len(PROTOCOLS)].upper(),
+        status='Working',
+        latency=random.uniform(0.05, 5.0),
+        speed=random.uniform(0.1, 20.0),
+        anonymity=ANONYMITY[i % len(ANONYMITY)],
+        # 地区名来自查询接口的 JSON 应答, 每个代理都是新的字符串对象
+        location=json.loads(f'"{REGIONS[i % len(REGIONS)]}"'),
+        score=random.uniform(0, 200),
+    )
+
+
+def build_dicts(count):
+    return [make_fields(i) for i in range(count)]
+
+
+def build_records(count):
+    return [ProxyRecord(make_fields(i)) for i in range(count)]
+
+
+def measure(builder, count, with_rotator):
+    gc.collect()
+    random.seed(1)
+    tracemalloc.start()
+    start = time.perf_counter()
+    proxies = builder(count)
+    rotator = None
+    if with_rotator:
+        rotator = ProxyRotator()
+        rotator.add_many(proxies)
+    build_time = time.perf_counter() - start
+    memory = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    start = time.perf_counter()
+    gc.collect()
+    gc_time = time.perf_counter() - start
+    del proxies, rotator
+    gc.collect()
+    return memory, build_time, gc_time
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000])
+    parser.add_argument('--rotator', action='store_true', help="同时加入轮换器 (包含各索引的开销)")
+    args = parser.parse_args()
+
+    print(f"{'数量':>9} {'记录类型':<12}{'内存 (MB)':>11}{'字节/代理':>11}{'构造 (s)':>10}{'完整GC (ms)':>13}")
+    for count in args.sizes:
+        for name, builder in (('dict', build_dicts), ('ProxyRecord', build_records)):
+            memory, build_time, gc_time = measure(builder, count, args.rotator)
+            print(f"{count:>9} {name:<12}{memory / 2 ** 20:>11.1f}{memory / count:>11.0f}"
+                  f"{build_time:>10.2f}{gc_time * 1000:>13.1f}")
+
+
+if __name__ == '__main__':
+    main()
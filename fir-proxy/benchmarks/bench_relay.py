@@ -0,0 +1,102 @@
+# benchmarks/bench_relay.py
+"""
+隧道转发吞吐基准: 比较 copy / buffer / splice 三种转发模式.
+
+用法: python benchmarks/bench_relay.py [--size-mb 512]
+"""
+
+import argparse
+import asyncio
+import os
+import socket
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.relay import SPLICE_AVAILABLE, relay_async, relay_blocking
+
+
+def _tcp_pair():
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.bind(('127.0.0.1', 0))
+    listener.listen(1)
+    client = socket.create_connection(listener.getsockname())
+    server, _ = listener.accept()
+    listener.close()
+    return client, server
+
+
+def _produce(sock, total):
+    chunk = os.urandom(1 << 16)
+    sent = 0
+    while sent < total:
+        sock.sendall(chunk)
+        sent += len(chunk)
+    sock.close()
+
+
+def _consume(sock, result):
+    buffer = bytearray(1 << 16)
+    received = 0
+    while True:
+        n = sock.recv_into(buffer)
+        if not n:
+            break
+        received += n
+    result['bytes'] = received
+    sock.close()
+
+
+def run_case(engine, mode, total):
+    producer, relay_in = _tcp_pair()
+    relay_out, consumer = _tcp_pair()
+    result = {}
+    threads = [
+        threading.Thread(target=_produce, args=(producer, total)),
+        threading.Thread(target=_consume, args=(consumer, result)),
+    ]
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    for t in threads:
+        t.start()
+
+    if engine == 'thread':
+        relay_blocking(relay_in, relay_out, mode)
+    else:
+        relay_in.setblocking(False)
+        relay_out.setblocking(False)
+        asyncio.run(_run_async(relay_in, relay_out, mode))
+    relay_out.close()
+    relay_in.close()
+    for t in threads:
+        t.join()
+
+    wall = time.perf_counter() - start_wall
+    cpu = time.process_time() - start_cpu
+    return result.get('bytes', 0), wall, cpu
+
+
+async def _run_async(sock1, sock2, mode):
+    await relay_async(asyncio.get_running_loop(), sock1, sock2, mode)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--size-mb', type=int, default=512, help="每个用例传输的数据量 (MB)")
+    args = parser.parse_args()
+    total = args.size_mb * (1 << 20)
+
+    modes = ['copy', 'buffer'] + (['splice'] if SPLICE_AVAILABLE else [])
+    print(f"{'engine':<8}{'mode':<8}{'MB/s':>10}{'cpu s/GB':>12}")
+    for engine in ('thread', 'asyncio'):
+        for mode in modes:
+            received, wall, cpu = run_case(engine, mode, total)
+            mb = received / (1 << 20)
+            print(f"{engine:<8}{mode:<8}{mb / wall:>10.1f}{cpu / (mb / 1024):>12.2f}")
+    if not SPLICE_AVAILABLE:
+        print("(当前平台不支持 os.splice, 已跳过 splice 模式)")
+
+
+if __name__ == '__main__':
+    main()
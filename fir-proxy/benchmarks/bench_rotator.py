@@ -0,0 +1,122 @@
+# benchmarks/bench_rotator.py
+"""
+轮换器读写竞争基准: 验证线程持续批量导入/更新/删除代理时, 代理服务侧读取操作的吞吐和尾延迟.
+比较无锁读取 (当前实现) 与每次读取都获取 self.lock 的旧方式.
+
+用法: python benchmarks/bench_rotator.py [--proxies 100000] [--readers 4] [--seconds 3]
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules.rotator import ProxyRotator
+
+REGIONS = ('US', 'DE', 'JP', 'SG', 'FR', 'GB', 'NL', 'BR', 'IN', 'RU')
+PROTOCOLS = ('http', 'socks4', 'socks5')
+
+
+class LockedReadRotator(ProxyRotator):
+    """旧方式: 每次读取都获取锁."""
+    def get_current_proxy(self):
+        with self.lock:
+            return self.current_proxy
+
+    def get_proxy(self, proxy_address):
+        with self.lock:
+            return self._by_address.get(proxy_address)
+
+    def get_working_proxies_count(self):
+        with self.lock:
+            return len(self.all_proxies)
+
+    def count(self, region="All", premium_only=False, protocol=None):
+        with self.lock:
+            return super().count(region, premium_only, protocol)
+
+
+def make_proxy(i):
+    return {
+        'proxy': f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:{1080 + i % 1000}",
+        'protocol': PROTOCOLS[i % len(PROTOCOLS)],
+        'latency': random.uniform(0.1, 4.0),
+        'speed': random.uniform(0.1, 5.0),
+        'anonymity': 'Elite',
+        'location': REGIONS[i % len(REGIONS)],
+        'score': random.uniform(0, 100),
+    }
+
+
+def _writer(rotator, total, stop):
+    """模拟验证线程: 反复批量导入、逐个更新和批量删除."""
+    batch = 0
+    while not stop.is_set():
+        base = total + batch * 5000
+        rotator.add_many(make_proxy(i) for i in range(base, base + 5000))
+        for i in range(base, base + 5000, 5):
+            rotator.update_proxy(make_proxy(i)['proxy'], {'latency': random.uniform(0.1, 4.0)})
+        for i in range(base, base + 5000):
+            rotator.add_proxy(make_proxy(i))
+        rotator.remove_many([make_proxy(i)['proxy'] for i in range(base, base + 5000)])
+        batch += 1
+
+
+def _reader(rotator, addresses, stop, samples):
+    ops = 0
+    worst = []
+    while not stop.is_set():
+        start = time.perf_counter()
+        rotator.get_current_proxy()
+        rotator.get_proxy(random.choice(addresses))
+        rotator.count('US', False, 'socks5')
+        rotator.get_working_proxies_count()
+        elapsed = time.perf_counter() - start
+        ops += 1
+        if ops % 16 == 0:
+            worst.append(elapsed)
+    samples.append((ops, worst))
+
+
+def run_case(cls, total, readers, seconds):
+    rotator = cls()
+    rotator.add_many(make_proxy(i) for i in range(total))
+    rotator.get_next_proxy()
+    addresses = [p['proxy'] for p in rotator.get_candidates("All", False)]
+    stop = threading.Event()
+    samples = []
+    threads = [threading.Thread(target=_writer, args=(rotator, total, stop))]
+    threads += [threading.Thread(target=_reader, args=(rotator, addresses, stop, samples)) for _ in range(readers)]
+    for thread in threads:
+        thread.start()
+    time.sleep(seconds)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    ops = sum(count for count, _ in samples)
+    latencies = sorted(value for _, worst in samples for value in worst)
+    if not latencies:
+        return ops / seconds, 0, 0
+    return ops / seconds, latencies[int(len(latencies) * 0.99)], latencies[int(len(latencies) * 0.999)]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--proxies', type=int, default=100000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=3.0)
+    args = parser.parse_args()
+
+    print(f"{args.proxies} 个代理, {args.readers} 个读取线程, 1 个写入线程, 每项 {args.seconds:.0f} 秒")
+    print(f"{'读取方式':<12}{'读取次数/秒':>14}{'p99 (us)':>12}{'p99.9 (us)':>12}")
+    for name, cls in (('加锁读取', LockedReadRotator), ('无锁读取', ProxyRotator)):
+        rate, p99, p999 = run_case(cls, args.proxies, args.readers, args.seconds)
+        print(f"{name:<12}{rate:>14,.0f}{p99 * 1e6:>12.1f}{p999 * 1e6:>12.1f}")
+
+
+if __name__ == '__main__':
+    main()
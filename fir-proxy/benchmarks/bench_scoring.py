@@ -0,0 +1,64 @@
+# benchmarks/bench_scoring.py
+"""
+评分引擎基准: 全量重新评分 (rescore) 和排序 (rank) 的耗时, 比较 numpy 与纯 Python 实现.
+
+用法: python benchmarks/bench_scoring.py [--sizes 10000 100000] [--samples 8]
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from modules import scoring
+from modules.scoring import ScoringEngine
+
+ANONYMITY = ('Elite', 'Anonymous', 'Transparent')
+
+
+def build(count, samples):
+    random.seed(1)
+    engine = ScoringEngine(window=samples)
+    now = time.time()
+    for i in range(count):
+        address = f"10.{i >> 16 & 255}.{i >> 8 & 255}.{i & 255}:8080"
+        for _ in range(samples):
+            engine.observe(address, random.random() < 0.9, random.uniform(0.05, 5.0), random.uniform(0.1, 10.0),
+                           random.choice(ANONYMITY), now - random.uniform(0, 86400))
+    return engine, now
+
+
+def timed(func, repeat=3):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--samples', type=int, default=8)
+    args = parser.parse_args()
+
+    numpy = scoring.np
+    engines = [('numpy', numpy)] if numpy is not None else []
+    engines.append(('python', None))
+    print(f"{'数量':>9} {'实现':<8}{'rescore (ms)':>14}{'rank top100 (ms)':>18}")
+    for count in args.sizes:
+        for name, module in engines:
+            scoring.np = module
+            engine, now = build(count, args.samples)
+            rescore = timed(lambda: engine.rescore(now, changed_only=False))
+            rank = timed(lambda: engine.rank(100, now))
+            print(f"{count:>9} {name:<8}{rescore * 1000:>14.1f}{rank * 1000:>18.1f}")
+    scoring.np = numpy
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+# proxy_pool/daemon.py
+"""
+无界面的代理池服务: 获取 -> 验证 -> 提供代理服务 -> 定期重新验证.
+启动时只导入代理服务所需的模块, 端口开始监听后再在后台加载获取器和验证器 (requests/bs4).
+
+    python daemon.py --config daemon.json --socks5-port 1080 --balance latency
+"""
+
+import argparse
+import json
+import queue
+import re
+import signal
+import sys
+import threading
+from collections import defaultdict
+
+DEFAULTS = {
+    'http_host': '127.0.0.1',
+    'http_port': 1801,
+    'socks5_host': '127.0.0.1',
+    'socks5_port': 1800,
+    'workers': 1,
+    'balance': None,
+    'dns_mode': 'remote',
+    'affinity': None,
+    'socks5_auth': None,            # {账号: 密码}
+    'metrics_host': '127.0.0.1',
+    'metrics_port': 1802,           # 0 表示不提供指标接口
+    'fetch': True,                  # 是否获取在线代理
+    'proxy_files': [],              # 额外导入的代理列表文件
+    'validation_mode': 'online',
+    'revalidate_interval': 1800,    # 重新验证间隔 (秒), 0 表示不重新验证
+    'min_proxies': 20,              # 重新验证后可用代理少于该数量时重新获取
+    'store': None,                  # 代理池持久化文件 (SQLite), 启动时恢复上次的代理
+    'freshness': 1800,              # 最近验证距今不超过该值 (秒) 的代理无需重新验证
+    'rotate_interval': 0,           # 自动轮换当前代理的间隔 (秒), 以下四项均为 0 表示不自动轮换
+    'rotate_requests': 0,           # 经当前代理建立该数量的连接后轮换
+    'rotate_bytes': 0,              # 经当前代理转发该字节数后轮换
+    'rotate_failures': 0,           # 经当前代理连接失败该次数后轮换
+    'log_file': None,               # JSONL 日志文件
+    'log_level': 'INFO',
+    'log_rate_limits': {'tunnel': [20, 50], 'upstream': [10, 20]},
+    'quiet': False,                 # 不在标准输出打印日志
+}
+
+# 传给代理服务的配置项
+SERVER_OPTIONS = ('http_host', 'http_port', 'socks5_host', 'socks5_port', 'balance', 'dns_mode', 'affinity',
+                  'socks5_auth')
+
+VALID_PROTOCOLS = {'http', 'https', 'socks4', 'socks5'}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="高可用代理池 (无界面模式)")
+    parser.add_argument('-c', '--config', help="JSON 配置文件, 命令行参数优先")
+    parser.add_argument('--http-host')
+    parser.add_argument('--http-port', type=int)
+    parser.add_argument('--socks5-host')
+    parser.add_argument('--socks5-port', type=int)
+    parser.add_argument('--workers', type=int, help="代理服务进程数 (需要 SO_REUSEPORT)")
+    parser.add_argument('--balance', choices=('round_robin', 'least_conn', 'latency', 'weighted', 'p2c', 'best'))
+    parser.add_argument('--dns-mode', choices=('remote', 'local'))
+    parser.add_argument('--affinity', choices=('client', 'user', 'target'))
+    parser.add_argument('--socks5-user', action='append', metavar='USER:PASS', help="SOCKS5 账号, 可重复")
+    parser.add_argument('--metrics-port', type=int, help="指标接口端口, 0 表示关闭")
+    parser.add_argument('--no-fetch', dest='fetch', action='store_const', const=False, help="不获取在线代理")
+    parser.add_argument('--proxy-file', dest='proxy_files', action='append', metavar='FILE',
+                        help="导入代理列表文件 (每行 ip:port 或 协议://ip:port), 可重复")
+    parser.add_argument('--revalidate-interval', type=float)
+    parser.add_argument('--min-proxies', type=int)
+    parser.add_argument('--store', metavar='FILE', help="代理池持久化文件 (SQLite)")
+    parser.add_argument('--freshness', type=float, help="验证结果的有效期 (秒), 过期的代理才重新验证")
+    parser.add_argument('--rotate-interval', type=float, help="自动轮换当前代理的间隔 (秒)")
+    parser.add_argument('--rotate-requests', type=int, help="经当前代理建立该数量的连接后轮换")
+    parser.add_argument('--rotate-bytes', type=int, help="经当前代理转发该字节数后轮换")
+    parser.add_argument('--rotate-failures', type=int, help="经当前代理连接失败该次数后轮换")
+    parser.add_argument('--log-file')
+    parser.add_argument('--log-level', choices=('DEBUG', 'INFO', 'WARNING', 'ERROR'))
+    parser.add_argument('-q', '--quiet', action='store_const', const=True)
+    return parser.parse_args(argv)
+
+
+def load_config(args) -> dict:
+    """合并默认配置、配置文件和命令行参数."""
+    config = dict(DEFAULTS)
+    if args.config:
+        with open(args.config, 'r', encoding='utf-8') as f:
+            data = json.load(f)
+        unknown = set(data) - set(DEFAULTS)
+        if unknown:
+            raise ValueError(f"未知的配置项: {', '.join(sorted(unknown))}")
+        config.update(data)
+    for key, value in vars(args).items():
+        if key in ('config', 'socks5_user') or value is None:
+            continue
+        config[key] = value
+    if args.socks5_user:
+        auth = dict(config['socks5_auth'] or {})
+        for entry in args.socks5_user:
+            user, _, password = entry.partition(':')
+            auth[user] = password
+        config['socks5_auth'] = auth
+    return config
+
+
+def load_proxy_file(path) -> dict:
+    """读取代理列表文件, 返回 {协议: [地址]}."""
+    proxies_by_protocol = defaultdict(list)
+    with open(path, 'r', encoding='utf-8') as f:
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith('#'):
+                continue
+            protocol, proxy_address = 'http', line
+            match = re.match(r'(\w+)://(.+)', line)
+            if match and match.group(1).lower() in VALID_PROTOCOLS:
+                protocol, proxy_address = match.group(1).lower(), match.group(2)
+            elif ',' in line:
+                parts = [p.strip() for p in line.split(',', 1)]
+                if parts[0].lower() in VALID_PROTOCOLS:
+                    protocol, proxy_address = parts[0].lower(), parts[1]
+            if protocol == 'https':
+                protocol = 'http'
+            if re.match(r'^\d{1,3}(?:\.\d{1,3}){3}:\d+$', proxy_address):
+                proxies_by_protocol[protocol].append(proxy_address)
+    return proxies_by_protocol
+
+
+class ProxyDaemon:
+    """无界面的代理池服务."""
+    def __init__(self, config: dict):
+        self.config = config
+        self._stop = threading.Event()
+        self._closed = threading.Event()    # 服务已全部停止, 日志输出线程打印剩余日志后退出
+        self._threads = []
+        self.store = None
+        self.restored = 0
+        self.rotation = None
+
+    def log(self, message):
+        self.log_hub.put(f"[Daemon] {message}")
+
+    def start(self):
+        from modules.loghub import LEVEL_NAMES, LogHub
+        from modules.metrics import MetricsRegistry, MetricsServer
+        from modules.rotator import ProxyRotator, RotationScheduler
+        from modules.store import PoolStore
+        from modules.workers import create_proxy_server
+
+        config = self.config
+        levels = {name: level for level, name in LEVEL_NAMES.items()}
+        self.log_hub = LogHub(level=levels[config['log_level'].upper()], path=config['log_file'])
+        for category, (rate, burst) in (config['log_rate_limits'] or {}).items():
+            self.log_hub.set_rate_limit(category, rate, burst)
+        if not config['quiet']:
+            self._spawn(self._print_logs)
+
+        self.metrics = MetricsRegistry()
+        self.rotator = ProxyRotator()
+        if config['store']:
+            # 先恢复上次保存的代理池, 服务启动后即可使用, 过期的代理由后台任务重新验证
+            self.store = PoolStore(config['store'], self.log_hub)
+            self.restored = self.store.attach(self.rotator)
+            self._ensure_current()
+        self.proxy_server = create_proxy_server(
+            workers=config['workers'], rotator=self.rotator, log_queue=self.log_hub, metrics=self.metrics,
+            **{key: config[key] for key in SERVER_OPTIONS}
+        )
+        self.proxy_server.start_all()
+        if any(config[key] for key in ('rotate_interval', 'rotate_requests', 'rotate_bytes', 'rotate_failures')):
+            self.rotation = RotationScheduler(
+                self.rotator, interval=config['rotate_interval'], requests=config['rotate_requests'],
+                nbytes=config['rotate_bytes'], failures=config['rotate_failures'],
+            )
+            self.rotation.subscribe(self._on_rotation)
+            self.rotation.start()
+        self.metrics_server = None
+        if config['metrics_port']:
+            self.metrics_server = MetricsServer(self.metrics, config['metrics_host'], config['metrics_port'],
+                                                self.log_hub)
+            self.metrics_server.start()
+        self._spawn(self._pipeline)
+
+    def run(self):
+        """启动并阻塞直到收到 SIGINT/SIGTERM."""
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, lambda *_: self._stop.set())
+        self.start()
+        while not self._stop.wait(1.0):
+            pass
+        self.stop()
+
+    def stop(self):
+        self._stop.set()
+        if self.rotation:
+            self.rotation.stop()
+        self.proxy_server.stop_all()
+        if self.metrics_server:
+            self.metrics_server.stop()
+        if self.store:
+            self.store.close()
+        self._closed.set()
+        for thread in self._threads:
+            thread.join(timeout=1.0)
+        self.log_hub.close()
+
+    def _spawn(self, target):
+        thread = threading.Thread(target=target, daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _print_logs(self):
+        from modules.loghub import LogHub
+        seq = 0
+        while True:
+            closed = self._closed.wait(0.2)
+            records = self.log_hub.since(seq)
+            for record in records:
+                print(LogHub.format(record))
+            if records:
+                seq = records[-1]['seq']
+                sys.stdout.flush()
+            if closed:
+                break
+
+    def _pipeline(self):
+        """后台任务: 加载验证器, 导入/获取并验证代理, 之后定期重新验证."""
+        try:
+            self._run_pipeline()
+        except Exception as e:
+            self.log(f"[!] 后台任务异常退出, 代理服务继续运行: {e!r}")
+
+    def _run_pipeline(self):
+        from modules.checker import ProxyChecker
+        from modules.scoring import ScoringEngine
+
+        config = self.config
+        self.scoring = ScoringEngine()
+        self.scoring.attach(self.rotator)
+        if self.store and self.restored:
+            # 用保存的验证历史恢复评分样本
+            self.scoring.seed(self.store.load_history(), self._anonymity)
+            self.rotator.update_scores(self.scoring.rescore())
+        self.checker = ProxyChecker(metrics=self.metrics)
+        self.checker.initialize_public_ip(self.log_hub)
+        if self.restored:
+            self._revalidate()
+        for path in config['proxy_files']:
+            try:
+                proxies_by_protocol = load_proxy_file(path)
+            except OSError as e:
+                self.log(f"[!] 读取代理列表 {path} 失败: {e}")
+                continue
+            self.log(f"从 {path} 导入 {sum(len(v) for v in proxies_by_protocol.values())} 个代理, 开始验证...")
+            self._validate(proxies_by_protocol, 'import')
+        # 从持久化文件恢复了代理池时, 只在可用代理不足时获取
+        if config['fetch'] and (not self.restored or self.rotator.get_working_proxies_count() < config['min_proxies']):
+            self._fetch_and_validate()
+
+        interval = config['revalidate_interval']
+        while interval and not self._stop.wait(interval):
+            self.rotator.update_scores(self.scoring.rescore())
+            self._revalidate()
+            if config['fetch'] and self.rotator.get_working_proxies_count() < config['min_proxies']:
+                self._fetch_and_validate()
+
+    def _fetch_and_validate(self):
+        from modules.fetcher import ProxyFetcher
+
+        self.log("开始获取在线代理...")
+        proxies_by_protocol = ProxyFetcher().fetch_all(self.log_hub)
+        self._validate(proxies_by_protocol, self.config['validation_mode'])
+
+    def _revalidate(self):
+        """重新验证验证结果已过期的代理."""
+        from modules.store import stale_proxies
+
+        proxies = stale_proxies(self.rotator.get_candidates("All", False), self.config['freshness'])
+        if not proxies:
+            return
+        self.log(f"开始重新验证 {len(proxies)} 个代理...")
+        proxies_by_protocol = defaultdict(list)
+        for p_info in proxies:
+            proxies_by_protocol[p_info.get('protocol', 'http').lower()].append(p_info['proxy'])
+        self._validate(proxies_by_protocol, 'online', revalidate=True)
+
+    def _validate(self, proxies_by_protocol, validation_mode, revalidate=False):
+        """验证代理并更新轮换器, 阻塞直到验证完成."""
+        if not any(proxies_by_protocol.values()):
+            return
+        results = queue.Queue()
+        threading.Thread(
+            target=self.checker.validate_all,
+            args=(proxies_by_protocol, results, self.log_hub, validation_mode), daemon=True,
+        ).start()
+        added = removed = 0
+        while True:
+            result = results.get()
+            if result is None:
+                break
+            proxy_address = result['proxy']
+            if result.get('status') == 'Working':
+                result['score'] = self.scoring.observe_result(result)
+                if self.rotator.update_proxy(proxy_address, result) is None:
+                    self.rotator.add_proxy(result)
+                    added += 1
+                self._ensure_current()
+            elif revalidate and self.rotator.remove_proxy(proxy_address):
+                removed += 1
+        self._ensure_current()
+        self.log(f"验证完成: 新增 {added}, 移除 {removed}, 可用 {self.rotator.get_working_proxies_count()}")
+
+    def _anonymity(self, proxy_address):
+        proxy_info = self.rotator.get_proxy(proxy_address)
+        return proxy_info.get('anonymity') if proxy_info is not None else None
+
+    def _on_rotation(self, proxy_info, reason):
+        if proxy_info is None:
+            self.log(f"自动轮换 ({reason}): 没有可用代理")
+        else:
+            self.log(f"自动轮换 ({reason}): {proxy_info.get('protocol', 'http').lower()}://{proxy_info['proxy']}")
+
+    def _ensure_current(self):
+        """当前代理为空时选择实时分数最高的代理."""
+        if self.rotator.get_current_proxy() is not None:
+            return
+        best = max(self.rotator.get_candidates("All", False), key=self.rotator.effective_score, default=None)
+        if best is not None:
+            self.rotator.set_current_proxy_by_address(best['proxy'])
+
+
+def main(argv=None):
+    try:
+        config = load_config(parse_args(argv))
+    except (OSError, ValueError) as e:
+        print(f"配置错误: {e}", file=sys.stderr)
+        return 2
+    ProxyDaemon(config).run()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
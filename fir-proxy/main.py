@@ -1,7 +1,7 @@
 # proxy_pool/main.py
 
 import tkinter as tk
-from tkinter import ttk, scrolledtext, messagebox, TclError
+from tkinter import ttk, scrolledtext, messagebox
 from tkinter import filedialog
 import ttkbootstrap as bs
 import queue
@@ -14,8 +14,13 @@ import os
 # 导入核心模块
 from modules.fetcher import ProxyFetcher
 from modules.checker import ProxyChecker 
-from modules.rotator import ProxyRotator
-from modules.server import ProxyServer 
+from modules.record import ProxyRecord
+from modules.rotator import PREMIUM_LATENCY, ProxyRotator, RotationScheduler
+from modules.scoring import ScoringEngine
+from modules.store import PoolStore, stale_proxies
+from modules.loghub import LogHub
+from modules.metrics import MetricsRegistry, MetricsServer
+from modules.workers import create_proxy_server
 
 class ProxyPoolApp:
     """
@@ -23,6 +28,24 @@ class ProxyPoolApp:
     - 交互优化与bug修复
     - 启动时自动校验内置代理
     """
+    # 负载均衡选项: 显示名称 -> ProxyServer 策略
+    BALANCE_OPTIONS = {"单一代理": None, "轮询": 'round_robin', "最少连接": 'least_conn', "延迟加权": 'latency',
+                       "分数加权": 'weighted', "两选一": 'p2c', "高分优先": 'best'}
+    # 代理服务进程数, 大于1时以 SO_REUSEPORT 启动多进程 (平台不支持时自动退回单进程)
+    SERVER_WORKERS = 1
+    # 本地指标接口端口 (http://127.0.0.1:1802/metrics)
+    METRICS_PORT = 1802
+    # 日志: 内存中保留的条数、可选的 JSONL 日志文件、界面每次最多追加的条数和日志框保留的行数
+    LOG_CAPACITY = 5000
+    LOG_FILE = None
+    LOG_BATCH = 200
+    LOG_DISPLAY_LINES = 2000
+    # 每个连接都会产生的日志分类的速率限制 (条/秒, 突发条数)
+    LOG_RATE_LIMITS = {'tunnel': (20, 50), 'upstream': (10, 20)}
+    # 代理池持久化文件 (None 表示不保存), 启动时恢复; 最近验证距今超过 STORE_FRESHNESS 秒的代理在后台重新验证
+    STORE_FILE = 'proxy_pool.db'
+    STORE_FRESHNESS = 1800
+
     def __init__(self, root):
         self.root = root
         self.root.title("高可用代理池 1.0 版本 by firefly")
@@ -31,36 +54,59 @@ class ProxyPoolApp:
 
         # 线程与状态
         self.result_queue = queue.Queue()
-        self.log_queue = queue.Queue()
+        # 各模块仍通过 log_queue.put() 写日志, 界面按序号从日志中心拉取需要显示的部分
+        self.log_queue = LogHub(capacity=self.LOG_CAPACITY, path=self.LOG_FILE)
+        for category, (rate, burst) in self.LOG_RATE_LIMITS.items():
+            self.log_queue.set_rate_limit(category, rate, burst)
+        self._log_seq = 0
         self.is_running_task = False
 
         # 核心模块
+        self.metrics = MetricsRegistry()
         self.fetcher = ProxyFetcher()
-        self.checker = ProxyChecker() 
+        self.checker = ProxyChecker(metrics=self.metrics)
         self.rotator = ProxyRotator()
-        self.displayed_proxies = set()
+        # 按历史验证结果评分, 分数随时间衰减, 验证结束时重新计算
+        self.scoring = ScoringEngine()
+        self.scoring.attach(self.rotator)
+        self.store = PoolStore(self.STORE_FILE, self.log_queue) if self.STORE_FILE else None
         self.proxy_to_tree_item_map = {}
         
         # 代理服务
-        self.proxy_server = ProxyServer(
+        self.proxy_server = create_proxy_server(
+            workers=self.SERVER_WORKERS,
             http_host='127.0.0.1', http_port=1801,
             socks5_host='127.0.0.1', socks5_port=1800,
-            rotator=self.rotator, log_queue=self.log_queue
+            rotator=self.rotator, log_queue=self.log_queue, metrics=self.metrics
         )
         self.is_server_running = False
+        self.metrics_server = MetricsServer(self.metrics, port=self.METRICS_PORT, log_queue=self.log_queue)
 
-        # 自动轮换
+        # 自动轮换: 由后台线程按间隔轮换, 沿用轮换器当前的地区/质量筛选条件
         self.is_auto_rotating = False
-        self.auto_rotate_job_id = None
+        self.rotation = RotationScheduler(self.rotator)
+        self.rotation.subscribe(self._on_scheduled_rotation)
         self.use_high_quality_var = tk.BooleanVar(value=False)
 
         # UI
         self._create_widgets()
         self.root.protocol("WM_DELETE_WINDOW", self._on_closing)
         
+        # 恢复上次保存的代理池, 之后增量保存
+        restored = self.store.attach(self.rotator) if self.store else 0
+        if restored:
+            self.scoring.seed(self.store.load_history(), lambda address: (self.rotator.get_proxy(address) or {}).get('anonymity'))
+            self.rotator.update_scores(self.scoring.rescore())
+
         # 启动后台任务
-        threading.Thread(target=self.checker.initialize_public_ip, args=(self.log_queue,), daemon=True).start()
-        threading.Thread(target=self._run_builtin_check, daemon=True).start()
+        if restored:
+            self._refresh_treeview()
+            self.sort_treeview_column('score', True)
+            threading.Thread(target=self._revalidate_restored, daemon=True).start()
+        else:
+            threading.Thread(target=self.checker.initialize_public_ip, args=(self.log_queue,), daemon=True).start()
+            threading.Thread(target=self._run_builtin_check, daemon=True).start()
+        self.metrics_server.start()
         self.process_log_queue()
 
     def _create_widgets(self):
@@ -105,8 +151,11 @@ class ProxyPoolApp:
         self.auto_rotate_button = ttk.Button(region_panel, text="自动", command=self.toggle_auto_rotate, state=tk.DISABLED, style='info.TButton', width=6)
         self.auto_rotate_button.pack(side=tk.LEFT, padx=5, pady=5)
 
-        self.interval_spinbox = ttk.Spinbox(region_panel, from_=1, to=300, width=4)
+        self.interval_spinbox = ttk.Spinbox(region_panel, from_=1, to=300, width=4, command=self._on_interval_changed)
         self.interval_spinbox.set("10")
+        # 自动轮换运行中修改间隔时立即生效 (上下箭头、回车或离开输入框)
+        self.interval_spinbox.bind("<Return>", self._on_interval_changed)
+        self.interval_spinbox.bind("<FocusOut>", self._on_interval_changed)
         self.interval_spinbox.pack(side=tk.LEFT, padx=(0, 5), pady=5)
         ttk.Label(region_panel, text="秒").pack(side=tk.LEFT, padx=(0,5), pady=5)
 
@@ -115,6 +164,11 @@ class ProxyPoolApp:
 
         self.server_button = ttk.Button(server_panel, text="启动服务", command=self.toggle_server, state=tk.DISABLED, style='info.TButton', width=12)
         self.server_button.pack(side=tk.LEFT, padx=5, pady=5)
+
+        self.balance_combobox = ttk.Combobox(server_panel, state="readonly", width=9, values=list(self.BALANCE_OPTIONS))
+        self.balance_combobox.pack(side=tk.LEFT, padx=5, pady=5)
+        self.balance_combobox.bind('<<ComboboxSelected>>', self._on_balance_changed)
+        self.balance_combobox.set("单一代理")
         
         self.current_proxy_var = tk.StringVar(value="当前使用: N/A")
         proxy_entry = ttk.Entry(top_frame, textvariable=self.current_proxy_var, state='readonly', width=30)
@@ -161,7 +215,7 @@ class ProxyPoolApp:
         """在后台线程中校验内置代理。"""
         proxy_str = '222.66.69.78:23344'
         self.log_queue.put(f"正在校验内置代理: http://{proxy_str}")
-        builtin_proxy_info = {'proxy': proxy_str, 'protocol': 'http'}
+        builtin_proxy_info = ProxyRecord(proxy=proxy_str, protocol='http')
         
         if not self.checker._pre_check_proxy(builtin_proxy_info['proxy']):
             self.log_queue.put(f"内置代理 {proxy_str} TCP 连接失败。")
@@ -171,23 +225,23 @@ class ProxyPoolApp:
         if self.root.winfo_exists():
             self.root.after(0, self._process_builtin_result, result)
 
+    def _revalidate_restored(self):
+        """在后台线程中获取公网IP, 然后重新验证恢复的代理池中已过期的代理。"""
+        self.checker.initialize_public_ip(self.log_queue)
+        if self.root.winfo_exists():
+            self.root.after(0, self.start_revalidate_thread, True)
+
     def _process_builtin_result(self, result_dict):
         """在UI线程中处理内置代理的校验结果。"""
         if result_dict.get('status') == 'Working':
             proxy_address = result_dict['proxy']
-            if proxy_address in self.displayed_proxies:
+            if self.rotator.get_proxy(proxy_address) is not None:
                 return 
-            self.displayed_proxies.add(proxy_address)
             
             is_first_proxy = self.rotator.get_working_proxies_count() == 0
             
             latency, speed, anonymity = result_dict['latency'], result_dict['speed'], result_dict['anonymity']
-            score = 0
-            if latency != float('inf'): score += (1 / latency) * 50
-            score += speed * 10
-            if anonymity == 'Elite': score += 50
-            elif anonymity == 'Anonymous': score += 20
-            result_dict['score'] = score
+            score = result_dict['score'] = self.scoring.observe_result(result_dict)
             
             self.rotator.add_proxy(result_dict)
             
@@ -223,19 +277,14 @@ class ProxyPoolApp:
             if match:
                 region_key = match.group(1).strip()
         
-        all_proxies = sorted(self.rotator.all_proxies, key=lambda p: p.get('score', 0), reverse=True)
+        self.rotator.set_selection("All" if region_key == "全部地区" else region_key, is_high_quality_mode)
+
+        # 由轮换器的多维索引按分数降序给出, 无需遍历和排序全部代理
+        proxies_to_display = self.rotator.query(
+            region=None if region_key == "全部地区" else region_key,
+            max_latency_ms=PREMIUM_LATENCY * 1000 if is_high_quality_mode else None,
+        )
 
-        proxies_to_display = []
-        for p_info in all_proxies:
-            region_match = (region_key == "全部地区" or p_info.get('location') == region_key)
-            if not region_match:
-                continue
-            
-            if is_high_quality_mode and p_info.get('latency', float('inf')) > 2.0:
-                continue
-            
-            proxies_to_display.append(p_info)
-            
         self.tree.delete(*self.tree.get_children())
         for p_info in proxies_to_display:
             score = p_info.get('score', 0)
@@ -261,19 +310,13 @@ class ProxyPoolApp:
 
             if result_dict.get('status') == 'Working':
                 proxy_address = result_dict['proxy']
-                if proxy_address in self.displayed_proxies:
+                if self.rotator.get_proxy(proxy_address) is not None:
                     return 
 
-                self.displayed_proxies.add(proxy_address)
                 is_first_proxy = self.rotator.get_working_proxies_count() == 0
                 
                 latency, speed, anonymity = result_dict['latency'], result_dict['speed'], result_dict['anonymity']
-                score = 0
-                if latency != float('inf'): score += (1 / latency) * 50
-                score += speed * 10
-                if anonymity == 'Elite': score += 50
-                elif anonymity == 'Anonymous': score += 20
-                result_dict['score'] = score
+                score = result_dict['score'] = self.scoring.observe_result(result_dict)
                 
                 self.rotator.add_proxy(result_dict)
                 
@@ -286,7 +329,7 @@ class ProxyPoolApp:
                 is_high_quality_mode = self.use_high_quality_var.get()
                 
                 region_match = (region_key == "全部地区" or result_dict.get('location') == region_key)
-                quality_match = (not is_high_quality_mode or latency <= 2.0)
+                quality_match = (not is_high_quality_mode or latency < PREMIUM_LATENCY)
 
                 if region_match and quality_match:
                     display_values = (
@@ -375,6 +418,7 @@ class ProxyPoolApp:
 
     def finalize_validation(self):
         self.is_running_task = False
+        self.rotator.update_scores(self.scoring.rescore())
         self.fetch_button.config(state=tk.NORMAL, text="获取在线代理")
         self.import_button.config(state=tk.NORMAL)
         self.clear_button.config(state=tk.NORMAL)
@@ -387,6 +431,7 @@ class ProxyPoolApp:
 
     def finalize_revalidation(self):
         self.is_running_task = False
+        self.rotator.update_scores(self.scoring.rescore())
         self.fetch_button.config(state=tk.NORMAL, text="获取在线代理")
         self.import_button.config(state=tk.NORMAL)
         self.clear_button.config(state=tk.NORMAL)
@@ -409,9 +454,6 @@ class ProxyPoolApp:
         proxy_address = self.tree.item(item_id, 'values')[3]
         
         if self.rotator.remove_proxy(proxy_address):
-            if proxy_address in self.displayed_proxies:
-                self.displayed_proxies.remove(proxy_address)
-            
             self.log(f"已手动删除代理: {proxy_address}")
             self._refresh_treeview()
         else:
@@ -429,9 +471,16 @@ class ProxyPoolApp:
         is_high_quality_mode = self.use_high_quality_var.get()
         
         proxy_info = self.rotator.get_next_proxy(region=region_key, premium_only=is_high_quality_mode)
-        
+        self._show_rotation(proxy_info)
+
+    def _on_scheduled_rotation(self, proxy_info, reason):
+        # 在调度线程中调用, 交给界面线程显示
+        if self.root.winfo_exists(): self.root.after(0, self._show_rotation, proxy_info)
+
+    def _show_rotation(self, proxy_info):
+        region_key, is_high_quality_mode = self.rotator.get_selection()
         mode_str = "优质" if is_high_quality_mode else "常规"
-        
+
         if proxy_info:
             self.current_proxy_var.set(f"当前使用: {proxy_info['proxy']}")
             self.log(f"已轮换代理 ({region_key} | {mode_str}模式): {proxy_info['protocol'].lower()}://{proxy_info['proxy']}")
@@ -441,9 +490,14 @@ class ProxyPoolApp:
 
 
     def log(self, message):
+        self._append_log_lines([f"[{datetime.now().strftime('%H:%M:%S')}] {message}"])
+
+    def _append_log_lines(self, lines):
         if not self.root.winfo_exists(): return
         self.log_text.config(state='normal')
-        self.log_text.insert(tk.END, f"[{datetime.now().strftime('%H:%M:%S')}] {message}\n")
+        self.log_text.insert(tk.END, "\n".join(lines) + "\n")
+        # 只保留最近的若干行, 避免文本框无限增长
+        self.log_text.delete('1.0', f'end-{self.LOG_DISPLAY_LINES + 1}lines')
         self.log_text.see(tk.END)
         self.log_text.config(state='disabled')
 
@@ -454,7 +508,6 @@ class ProxyPoolApp:
         if messagebox.askyesno("确认操作", "您确定要清空所有已发现的代理吗？此操作不可逆。"):
             self.log("正在清空所有代理...")
             self.rotator.clear()
-            self.displayed_proxies.clear()
             self.log("所有代理已清空。")
             self._refresh_treeview()
 
@@ -543,23 +596,31 @@ class ProxyPoolApp:
             self.result_queue.put(None)
 
     def process_log_queue(self):
-        try:
-            while True: self.log(self.log_queue.get_nowait())
-        except queue.Empty: pass
+        records = self.log_queue.since(self._log_seq, limit=self.LOG_BATCH)
+        if records:
+            lines = [LogHub.format(record) for record in records]
+            skipped = records[0]['seq'] - self._log_seq - 1
+            if skipped > 0:
+                lines.insert(0, f"... 日志过多, 界面略过 {skipped} 条 ...")
+            self._log_seq = records[-1]['seq']
+            self._append_log_lines(lines)
         if self.root.winfo_exists(): self.root.after(100, self.process_log_queue)
 
-    def start_revalidate_thread(self):
+    def start_revalidate_thread(self, stale_only=False):
         if self._reset_ui_for_task("测试中..."): return
         self.test_all_button.config(text="测试中...")
         self.proxy_to_tree_item_map = {self.tree.item(iid, 'values')[3]: iid for iid in self.tree.get_children('')}
-        threading.Thread(target=self.revalidate_all, daemon=True).start()
+        threading.Thread(target=self.revalidate_all, args=(stale_only,), daemon=True).start()
         self.process_revalidate_queue()
 
-    def revalidate_all(self):
-        self.log_queue.put("="*20 + " 开始重新验证所有代理 " + "="*20)
+    def revalidate_all(self, stale_only=False):
+        """重新验证代理池, stale_only 时只验证验证结果已过期的代理。"""
+        self.log_queue.put("="*20 + (" 开始重新验证过期的代理 " if stale_only else " 开始重新验证所有代理 ") + "="*20)
         all_current_proxies_info = self.rotator.all_proxies[:]
+        if stale_only:
+            all_current_proxies_info = stale_proxies(all_current_proxies_info, self.STORE_FRESHNESS)
         if not all_current_proxies_info:
-            self.log_queue.put("代理池为空，无需测试。")
+            self.log_queue.put("没有需要重新验证的代理。" if stale_only else "代理池为空，无需测试。")
             self.result_queue.put(None)
             return
         
@@ -582,7 +643,7 @@ class ProxyPoolApp:
             self.progress_bar['value'] += 1
             proxy_address = result_dict['proxy']
             
-            original_proxy_info = next((p for p in self.rotator.all_proxies if p['proxy'] == proxy_address), None)
+            original_proxy_info = self.rotator.get_proxy(proxy_address)
             if not original_proxy_info:
                 self.log(f"更新跳过: 代理 {proxy_address} 在测试完成时已不存在。")
                 return
@@ -591,14 +652,8 @@ class ProxyPoolApp:
 
             if result_dict.get('status') == 'Working':
                 latency, speed, anonymity = result_dict['latency'], result_dict['speed'], result_dict['anonymity']
-                score = 0
-                if latency != float('inf'): score += (1 / latency) * 50
-                score += speed * 10
-                if anonymity == 'Elite': score += 50
-                elif anonymity == 'Anonymous': score += 20
-                
-                result_dict['score'] = score
-                original_proxy_info.update(result_dict)
+                score = result_dict['score'] = self.scoring.observe_result(result_dict)
+                self.rotator.update_proxy(proxy_address, result_dict)
 
                 if tree_item_id and self.tree.exists(tree_item_id):
                     display_values = (
@@ -610,8 +665,6 @@ class ProxyPoolApp:
             else:
                 self.log(f"测试失败，正在移除: {proxy_address}")
                 if self.rotator.remove_proxy(proxy_address):
-                    if proxy_address in self.displayed_proxies:
-                        self.displayed_proxies.remove(proxy_address)
                     if tree_item_id and self.tree.exists(tree_item_id):
                         self.tree.delete(tree_item_id)
             
@@ -698,6 +751,11 @@ class ProxyPoolApp:
         else:
             self.log(f"错误: 尝试设置的代理 {proxy_address} 在轮换器中未找到。")
             
+    def _on_balance_changed(self, event=None):
+        label = self.balance_combobox.get()
+        self.proxy_server.set_balance(self.BALANCE_OPTIONS.get(label))
+        self.log(f"负载均衡模式: {label}")
+
     def toggle_server(self):
         if self.is_server_running:
             self.proxy_server.stop_all()
@@ -713,13 +771,17 @@ class ProxyPoolApp:
             self.is_server_running = True
 
     def _on_closing(self):
+        self.rotation.stop()
         if self.is_server_running: self.proxy_server.stop_all()
+        self.metrics_server.stop()
+        if self.store: self.store.close()
+        self.log_queue.close()
         self.root.destroy()
         
     def toggle_auto_rotate(self):
         if self.is_auto_rotating:
             self.is_auto_rotating = False
-            if self.auto_rotate_job_id: self.root.after_cancel(self.auto_rotate_job_id)
+            self.rotation.stop()
             self.auto_rotate_button.config(text="自动", style='info.TButton')
             self.log("自动轮换已停止。")
         else:
@@ -732,16 +794,20 @@ class ProxyPoolApp:
             self.is_auto_rotating = True
             self.auto_rotate_button.config(text="停止", style='danger.TButton')
             self.log(f"自动轮换已启动，间隔 {interval_sec} 秒。")
-            self._perform_auto_rotation()
-            
-    def _perform_auto_rotation(self):
-        if not self.is_auto_rotating: return
-        self.rotate_proxy()
+            self.rotate_proxy()
+            self.rotation.configure(interval=interval_sec)
+            self.rotation.start()
+
+    def _on_interval_changed(self, event=None):
+        if not self.is_auto_rotating:
+            return
         try:
-            interval_ms = int(self.interval_spinbox.get()) * 1000
-            self.auto_rotate_job_id = self.root.after(interval_ms, self._perform_auto_rotation)
-        except (ValueError, TclError):
-            if self.is_auto_rotating: self.toggle_auto_rotate()
+            interval_sec = int(self.interval_spinbox.get())
+        except ValueError:
+            return
+        if interval_sec > 0 and interval_sec != self.rotation.interval:
+            self.rotation.configure(interval=interval_sec)
+            self.log(f"自动轮换间隔已改为 {interval_sec} 秒。")
 
 if __name__ == "__main__":
     root = bs.Window(themename="superhero")
@@ -0,0 +1,123 @@
+# modules/admission.py
+
+import asyncio
+import threading
+from collections import deque
+
+# acquire 的结果
+ADMITTED = 'admitted'
+QUEUE_FULL = 'queue_full'      # 并发已满且等待队列已满, 立即拒绝
+TIMEOUT = 'timeout'            # 在等待队列中超时
+
+
+class _Waiter:
+    __slots__ = ('granted', 'abandoned', 'wake')
+
+    def __init__(self, wake):
+        self.granted = False
+        self.abandoned = False
+        self.wake = wake
+
+
+class AdmissionLimiter:
+    """
+    并发准入控制.
+    并发数达到 limit 后, 新请求进入长度为 queue_size 的等待队列, 按先后顺序获得释放的名额;
+    队列已满或等待超过 queue_timeout 时拒绝. limit <= 0 表示不限制.
+    同一个实例可同时被线程 (acquire) 和事件循环 (acquire_async) 使用.
+    """
+    def __init__(self, limit=0, queue_size=0, queue_timeout=5.0):
+        self.limit = limit
+        self.queue_size = queue_size
+        self.queue_timeout = queue_timeout
+        self._active = 0
+        self._waiters = deque()
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self.stats = {'admitted': 0, 'queued': 0, QUEUE_FULL: 0, TIMEOUT: 0}
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    def saturated(self) -> bool:
+        """并发和等待队列是否都已满 (新请求将被立即拒绝)."""
+        return 0 < self.limit <= self._active and self._waiting >= self.queue_size
+
+    def _try_enter(self, wake):
+        """尝试立即获得名额, 否则排队. 返回 ADMITTED / QUEUE_FULL 或排队的 _Waiter."""
+        with self._lock:
+            if self.limit <= 0 or self._active < self.limit:
+                self._active += 1
+                self.stats['admitted'] += 1
+                return ADMITTED
+            if self._waiting >= self.queue_size:
+                self.stats[QUEUE_FULL] += 1
+                return QUEUE_FULL
+            waiter = _Waiter(wake)
+            self._waiters.append(waiter)
+            self._waiting += 1
+            self.stats['queued'] += 1
+            return waiter
+
+    def _give_up(self, waiter):
+        """等待超时或被取消. 若名额已在此刻转交给该等待者, 返回 ADMITTED."""
+        with self._lock:
+            if waiter.granted:
+                self.stats['admitted'] += 1
+                return ADMITTED
+            waiter.abandoned = True
+            self._waiting -= 1
+            self.stats[TIMEOUT] += 1
+            return TIMEOUT
+
+    def acquire(self, timeout=None) -> str:
+        """阻塞地获取名额, 返回 ADMITTED / QUEUE_FULL / TIMEOUT."""
+        event = threading.Event()
+        waiter = self._try_enter(event.set)
+        if not isinstance(waiter, _Waiter):
+            return waiter
+        event.wait(self.queue_timeout if timeout is None else timeout)
+        return self._give_up(waiter)
+
+    async def acquire_async(self, timeout=None) -> str:
+        """在事件循环中获取名额, 返回 ADMITTED / QUEUE_FULL / TIMEOUT."""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._try_enter(wake)
+        if not isinstance(waiter, _Waiter):
+            return waiter
+        try:
+            await asyncio.wait_for(future, self.queue_timeout if timeout is None else timeout)
+        except asyncio.TimeoutError:
+            pass
+        except asyncio.CancelledError:
+            if self._give_up(waiter) == ADMITTED:
+                self.release()
+            raise
+        return self._give_up(waiter)
+
+    def release(self):
+        """释放名额, 有等待者时直接转交给最早的等待者."""
+        with self._lock:
+            while self._waiters:
+                waiter = self._waiters.popleft()
+                if waiter.abandoned:
+                    continue
+                waiter.granted = True
+                self._waiting -= 1
+                waiter.wake()
+                return
+            self._active -= 1
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, active=self._active, waiting=self._waiting, limit=self.limit)
@@ -0,0 +1,86 @@
+# modules/affinity.py
+
+import threading
+import time
+from collections import OrderedDict, defaultdict
+
+# 亲和键的来源:
+#   client - 客户端IP
+#   user   - SOCKS5 用户名 (未提供用户名时退回客户端IP)
+#   target - 目标主机
+AFFINITY_MODES = ('client', 'user', 'target')
+
+
+class AffinityTable:
+    """
+    会话亲和表: 亲和键 -> 上游代理 (地址, 协议).
+    条目在 ttl 秒内未被再次使用即过期; 超出 max_entries 时淘汰最久未使用的条目.
+    """
+    def __init__(self, max_entries=10000, ttl=600.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()               # 键 -> ((地址, 协议), 过期时间)
+        self._by_upstream = defaultdict(set)        # 地址 -> 键集合, 用于按上游失效
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'evicted': 0, 'invalidated': 0}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        """查找亲和的上游代理, 返回 (地址, 协议) 或 None."""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.stats['misses'] += 1
+                return None
+            upstream, expires = entry
+            if expires <= now:
+                self._drop(key, upstream[0])
+                self.stats['expired'] += 1
+                self.stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats['hits'] += 1
+            return upstream
+
+    def set(self, key, upstream):
+        """记录 (或刷新) 亲和关系, upstream 为 (地址, 协议)."""
+        expires = time.monotonic() + self.ttl
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is not None and previous[0][0] != upstream[0]:
+                self._unlink(key, previous[0][0])
+            self._entries[key] = (upstream, expires)
+            self._entries.move_to_end(key)
+            self._by_upstream[upstream[0]].add(key)
+            while len(self._entries) > self.max_entries:
+                old_key, (old_upstream, _) = self._entries.popitem(last=False)
+                self._unlink(old_key, old_upstream[0])
+                self.stats['evicted'] += 1
+
+    def forget_upstream(self, address: str):
+        """上游代理被移除时删除所有指向它的条目."""
+        with self._lock:
+            keys = self._by_upstream.pop(address, ())
+            for key in keys:
+                self._entries.pop(key, None)
+            self.stats['invalidated'] += len(keys)
+
+    def clear(self):
+        with self._lock:
+            self.stats['invalidated'] += len(self._entries)
+            self._entries.clear()
+            self._by_upstream.clear()
+
+    def _drop(self, key, address):
+        del self._entries[key]
+        self._unlink(key, address)
+
+    def _unlink(self, key, address):
+        keys = self._by_upstream.get(address)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_upstream[address]
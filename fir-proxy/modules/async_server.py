@@ -0,0 +1,386 @@
+# modules/async_server.py
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .admission import ADMITTED, QUEUE_FULL
+from .httpproxy import http_proxy_session
+from .loghub import WARNING
+from .relay import relay_async
+from .resolver import DnsError, is_ip_address
+from .server import ProxyServer
+from .socks5 import (
+    CMD_CONNECT, CMD_UDP_ASSOCIATE, REP_COMMAND_NOT_SUPPORTED, REP_GENERAL_FAILURE, REP_SUCCEEDED,
+    Socks5Error, build_reply, run_socks5_handshake_async, socks5_handshake,
+)
+from .upstream import TargetUnreachable, connect_proxy_async, negotiate, run_handshake_async
+
+
+class AsyncProxyServer(ProxyServer):
+    """
+    基于 asyncio 事件循环的 HTTP/SOCKS5 代理服务.
+    所有连接在单个事件循环线程中处理, 不再为每个连接创建线程.
+    """
+    IDLE_TIMEOUT = 5
+    UDP_WORKERS = 64        # UDP ASSOCIATE 在线程中中继, 同时进行的关联数上限
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._loop = None
+        self._loop_thread = None
+        self._stop_event = None
+        self._started = threading.Event()
+        self._tasks = set()
+        self._udp_executor = None
+
+    def start_all(self):
+        """在后台线程中启动事件循环及HTTP和SOCKS5服务."""
+        if self._running:
+            return
+        self._running = True
+        self._pool.start()
+        self._started.clear()
+        self._loop_thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._loop_thread.start()
+        self._started.wait(5)
+
+    def stop_all(self):
+        """停止事件循环及所有服务."""
+        if not self._running:
+            return
+        self._running = False
+
+        if self._loop and self._stop_event:
+            self._loop.call_soon_threadsafe(self._stop_event.set)
+        if self._loop_thread and self._loop_thread.is_alive():
+            self._loop_thread.join()
+
+        self._pool.close()
+        self.log("所有代理服务已停止。")
+
+    def _run_loop(self):
+        try:
+            asyncio.run(self._serve())
+        except Exception as e:
+            self.log(f"[!] 事件循环异常退出: {e}")
+        finally:
+            self._loop = None
+            self._started.set()
+
+    async def _serve(self):
+        """事件循环主协程."""
+        self._loop = asyncio.get_running_loop()
+        self._stop_event = asyncio.Event()
+        self._udp_executor = ThreadPoolExecutor(max_workers=self.UDP_WORKERS)
+
+        listeners = []
+        for name, host, port, handler in (
+            ("HTTP", self._http_host, self._http_port, self._handle_http_client_async),
+            ("SOCKS5", self._socks5_host, self._socks5_port, self._handle_socks5_client_async),
+        ):
+            try:
+                server_socket = self._create_listener(host, port)
+            except Exception as e:
+                self.log(f"[!] 启动 {name} 服务失败: {e}")
+                continue
+            server_socket.setblocking(False)
+            listeners.append(server_socket)
+            self._spawn(self._accept_loop(server_socket, handler, name.lower()))
+            self.log(f"{name} 代理服务接口已启动于 {host}:{port} (asyncio)")
+        self._started.set()
+
+        try:
+            await self._stop_event.wait()
+        finally:
+            for server_socket in listeners:
+                server_socket.close()
+            tasks = list(self._tasks)
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            # 中继线程会在 _running 变为 False 后的一秒内退出
+            self._udp_executor.shutdown(wait=False)
+
+    def _spawn(self, coro):
+        task = self._loop.create_task(coro)
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+        return task
+
+    async def _accept_loop(self, server_socket, handler, listener):
+        while self._running:
+            try:
+                client_socket, _ = await self._loop.sock_accept(server_socket)
+            except OSError:
+                break
+            self._m_clients.inc(labels=(listener,))
+            client_socket.setblocking(False)
+            if self._tunnel_limiter.saturated():
+                self._reject_client(client_socket, listener, QUEUE_FULL)
+                continue
+            self._spawn(self._admit_client_async(handler, client_socket, listener))
+
+    async def _admit_client_async(self, handler, client_socket, listener):
+        """在准入控制下处理客户端连接, 超出并发上限时排队等待, 队列满或超时则拒绝."""
+        result = await self._tunnel_limiter.acquire_async()
+        if result != ADMITTED:
+            self._reject_client(client_socket, listener, result)
+            return
+        try:
+            await handler(client_socket)
+        finally:
+            self._tunnel_limiter.release()
+
+    async def _race_tunnels_async(self, batch, target_host, target_port, timeout):
+        """
+        同时经多个上游建立隧道, 保留最先完成握手的一个并取消其余尝试.
+        返回 (上游地址, socket, 多读数据, 握手耗时) 或 None.
+        """
+        tasks = {
+            self._loop.create_task(asyncio.wait_for(
+                self._open_tunnel_async(addr, proto, target_host, target_port), timeout
+            )): (rank, addr)
+            for rank, (addr, proto) in enumerate(batch)
+        }
+        pending = set(tasks)
+        winner = None
+        target_error = None
+        cancelled = 0
+        try:
+            while pending and not winner:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    rank, addr = tasks[task]
+                    error = task.exception()
+                    if error is None:
+                        if winner:
+                            task.result()[0].close()
+                            cancelled += 1
+                        else:
+                            winner = (rank, addr) + task.result()
+                    elif isinstance(error, TargetUnreachable):
+                        target_error = error
+                    elif isinstance(error, asyncio.TimeoutError):
+                        self._on_connect_failure(addr, "连接超时")
+                    else:
+                        self._on_connect_failure(addr, error)
+        finally:
+            cancelled += len(pending)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+        if winner:
+            self._record_race(winner[0], cancelled)
+            return winner[1:]
+        self._record_race(None)
+        if target_error:
+            raise target_error
+        return None
+
+    async def _get_upstream_connection_async(self, target_host, target_port, route=None, affinity_key=None):
+        """
+        通过上游代理异步连接目标, 返回 (socket, 多读数据, 上游地址) 或 None.
+        正在建立的上游连接数超出上限时先排队等待.
+        """
+        if self._dns_mode == 'local' and not is_ip_address(target_host):
+            try:
+                target_host = await self._resolver.resolve_async(target_host)
+            except DnsError as e:
+                self.log(f"[!] {e}", WARNING, 'tunnel', target=f"{target_host}:{target_port}")
+                return None
+        deadline = time.monotonic() + self._connect_deadline
+        result = await self._connect_limiter.acquire_async(
+            min(self._connect_limiter.queue_timeout, self._connect_deadline)
+        )
+        if result != ADMITTED:
+            self._m_rejected.inc(labels=('connect', result))
+            return None
+        try:
+            return await self._try_upstreams_async(target_host, target_port, deadline, route, affinity_key)
+        finally:
+            self._connect_limiter.release()
+
+    async def _try_upstreams_async(self, target_host, target_port, deadline, route=None, affinity_key=None):
+        """失败时在 deadline 前依次尝试其他候选代理; race > 1 时每轮同时尝试多个代理."""
+        limit = max(self._max_attempts, self._race)
+        tried = []
+        while len(tried) < limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            batch = self._next_batch(tried, min(self._race, limit - len(tried)), route, affinity_key)
+            if not batch:
+                break
+            tried.extend(addr for addr, _ in batch)
+            timeout = min(self.CONNECT_TIMEOUT, remaining)
+            try:
+                if len(batch) == 1:
+                    addr, proto = batch[0]
+                    try:
+                        remote_socket, leftover, latency = await asyncio.wait_for(
+                            self._open_tunnel_async(addr, proto, target_host, target_port), timeout
+                        )
+                    except TargetUnreachable:
+                        raise
+                    except asyncio.TimeoutError:
+                        self._on_connect_failure(addr, "连接超时")
+                        continue
+                    except Exception as e:
+                        self._on_connect_failure(addr, e)
+                        continue
+                else:
+                    winner = await self._race_tunnels_async(batch, target_host, target_port, timeout)
+                    if not winner:
+                        continue
+                    addr, remote_socket, leftover, latency = winner
+            except TargetUnreachable as e:
+                self.log(f"[!] 目标 {target_host}:{target_port} 不可达: {e}", WARNING, 'tunnel',
+                         target=f"{target_host}:{target_port}")
+                return None
+            self._on_connect_success(addr, target_host, target_port, latency)
+            if affinity_key is not None:
+                self._affinity.set(affinity_key, (addr, dict(batch)[addr]))
+            return remote_socket, leftover, addr
+        if tried:
+            self.log(f"[!] 已尝试 {len(tried)} 个上游代理, 均无法连接 {target_host}:{target_port}", WARNING,
+                     'tunnel', target=f"{target_host}:{target_port}")
+        return None
+
+    async def _open_tunnel_async(self, addr, proto, target_host, target_port):
+        """优先使用连接池中的预建连接, 仅需完成最后的 CONNECT 步骤. 返回 (socket, 多读数据, 握手耗时)."""
+        pooled = self._pool.take(addr, proto)
+        if pooled:
+            remote_socket, greeted = pooled
+            remote_socket.setblocking(False)
+        else:
+            start = time.monotonic()
+            remote_socket, greeted = await connect_proxy_async(self._loop, addr), False
+            elapsed = time.monotonic() - start
+            self._pool.record_connect_latency(addr, elapsed)
+            self._m_connect.observe(elapsed, (proto,))
+        try:
+            start = time.monotonic()
+            leftover = await run_handshake_async(
+                self._loop, remote_socket, negotiate(proto, target_host, target_port, greeted)
+            )
+            elapsed = time.monotonic() - start
+            self._m_handshake.observe(elapsed, (proto,))
+        except BaseException:
+            remote_socket.close()
+            raise
+        return remote_socket, leftover, elapsed
+
+    async def _handle_http_client_async(self, client_socket):
+        """处理HTTP客户端连接, 支持持久连接上的多个请求."""
+        remote_socket = upstream_addr = None
+        session = http_proxy_session()
+        reply = None
+        try:
+            client_address = client_socket.getpeername()[0]
+            while True:
+                op = session.send(reply)
+                reply = None
+                kind = op[0]
+                if kind == 'client_recv':
+                    reply = await asyncio.wait_for(self._loop.sock_recv(client_socket, 65536), self.KEEPALIVE_TIMEOUT)
+                elif kind == 'client_send':
+                    await self._loop.sock_sendall(client_socket, op[1])
+                elif kind == 'upstream_recv':
+                    # 连接被上游重置时视为关闭, 由会话决定是否在新连接上重发
+                    try:
+                        reply = await asyncio.wait_for(self._loop.sock_recv(remote_socket, 65536),
+                                                       self.KEEPALIVE_TIMEOUT)
+                    except ConnectionError:
+                        reply = b''
+                    self._record_bytes(upstream_addr, 0, len(reply))
+                elif kind == 'upstream_send':
+                    try:
+                        await self._loop.sock_sendall(remote_socket, op[1])
+                        reply = True
+                    except ConnectionError:
+                        reply = False
+                    else:
+                        self._record_bytes(upstream_addr, len(op[1]), 0)
+                elif kind in ('open', 'close_upstream'):
+                    if remote_socket:
+                        remote_socket.close()
+                        self._release_upstream(upstream_addr)
+                        remote_socket = upstream_addr = None
+                    if kind == 'open':
+                        upstream = await self._get_upstream_connection_async(
+                            op[1], op[2], affinity_key=self._affinity_key(client_address, op[1])
+                        )
+                        if upstream:
+                            remote_socket, reply, upstream_addr = upstream
+                else:
+                    await self._forward_data_async(client_socket, remote_socket, upstream_addr)
+        except StopIteration:
+            pass
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError, asyncio.TimeoutError)):
+                self.log(f"处理 HTTP 请求时出错: {e}")
+        finally:
+            if remote_socket:
+                remote_socket.close()
+                self._release_upstream(upstream_addr)
+            client_socket.close()
+
+    async def _handle_socks5_client_async(self, client_socket):
+        """处理SOCKS5客户端请求."""
+        remote_socket = upstream_addr = None
+        try:
+            request = await asyncio.wait_for(
+                run_socks5_handshake_async(self._loop, client_socket, socks5_handshake(self._socks5_auth)),
+                self.CONNECT_TIMEOUT,
+            )
+            if not request:
+                return
+            if request.command == CMD_UDP_ASSOCIATE:
+                # UDP 中继使用阻塞IO, 交给线程池执行; 控制连接切换为阻塞模式 (与同步服务相同的超时)
+                client_socket.settimeout(self.CONNECT_TIMEOUT)
+                await self._loop.run_in_executor(self._udp_executor, self._udp_associate, client_socket, request)
+                return
+            if request.command != CMD_CONNECT:
+                await self._loop.sock_sendall(client_socket, build_reply(REP_COMMAND_NOT_SUPPORTED))
+                return
+
+            affinity_key = self._affinity_key(
+                client_socket.getpeername()[0], request.host, request.username, request.route
+            )
+            upstream = await self._get_upstream_connection_async(
+                request.host, request.port, request.route, affinity_key
+            )
+            if not upstream:
+                await self._loop.sock_sendall(client_socket, build_reply(REP_GENERAL_FAILURE))
+                return
+            remote_socket, leftover, upstream_addr = upstream
+
+            await self._loop.sock_sendall(client_socket, build_reply(REP_SUCCEEDED))
+            if request.leftover:
+                await self._loop.sock_sendall(remote_socket, request.leftover)
+                self._record_bytes(upstream_addr, len(request.leftover), 0)
+            if leftover:
+                await self._loop.sock_sendall(client_socket, leftover)
+
+            await self._forward_data_async(client_socket, remote_socket, upstream_addr)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError, asyncio.TimeoutError, Socks5Error)):
+                self.log(f"处理 SOCKS5 请求时出错: {e}")
+        finally:
+            if remote_socket:
+                remote_socket.close()
+                self._release_upstream(upstream_addr)
+            client_socket.close()
+
+    async def _forward_data_async(self, client_socket, remote_socket, upstream_addr=None):
+        """双向转发数据, 两个方向均空闲超过 IDLE_TIMEOUT 时断开."""
+        start = time.monotonic()
+        sent, received = await relay_async(self._loop, client_socket, remote_socket, self._relay_mode, self.IDLE_TIMEOUT)
+        self._record_tunnel(upstream_addr, sent, received, time.monotonic() - start)
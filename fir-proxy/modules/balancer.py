@@ -0,0 +1,61 @@
+# modules/balancer.py
+
+import threading
+from collections import defaultdict
+
+from .strategies import make_strategy
+
+# 负载均衡策略, 均由轮换器的子集索引选择 (见 modules/strategies.py), 不复制候选列表:
+#   round_robin - 依次轮询
+#   least_conn  - 选择活动隧道数最少的代理 (相同时取延迟最低者)
+#   latency     - 按延迟倒数 (乘以健康系数) 加权随机
+#   weighted    - 按分数 (乘以健康系数) 加权随机
+#   p2c         - 随机取两个代理, 选择活动隧道较少的一个
+#   best        - 在分数 (乘以健康系数) 最高的几个代理中随机选择
+BALANCE_STRATEGIES = ('round_robin', 'least_conn', 'latency', 'weighted', 'p2c', 'best')
+
+
+class LoadBalancer:
+    """按连接将隧道分散到代理池中所有符合筛选条件的代理上."""
+    def __init__(self, rotator, strategy='round_robin'):
+        self._rotator = rotator
+        self._active = defaultdict(int)
+        self._lock = threading.Lock()
+        self.set_strategy(strategy)
+
+    def set_strategy(self, strategy):
+        if strategy not in BALANCE_STRATEGIES:
+            raise ValueError(f"未知的负载均衡策略: {strategy}")
+        self._selector = make_strategy(strategy)
+        self.strategy = strategy
+
+    def pick(self, exclude=(), allow=None, region=None, premium_only=None):
+        """
+        为新连接选择一个上游代理, 无可用代理时返回 None.
+        exclude 为需跳过的代理地址, allow 为可选的地址过滤函数 (如熔断器).
+        region/premium_only 未指定时使用轮换器的当前筛选条件; 指定的地区不存在时没有候选, 返回 None.
+        根据实际流量降级的代理只在没有其他代理可选时使用.
+        """
+        return self._rotator.select(region, premium_only, exclude=exclude, allow=allow,
+                                    strategy=self._selector, load=self._load)
+
+    def _load(self, proxy_address):
+        return self._active.get(proxy_address, 0)
+
+    def acquire(self, proxy_address: str):
+        """记录一条经该代理建立的隧道."""
+        with self._lock:
+            self._active[proxy_address] += 1
+
+    def release(self, proxy_address: str):
+        """隧道关闭时调用."""
+        with self._lock:
+            remaining = self._active.get(proxy_address, 0) - 1
+            if remaining > 0:
+                self._active[proxy_address] = remaining
+            else:
+                self._active.pop(proxy_address, None)
+
+    def active_connections(self) -> dict:
+        with self._lock:
+            return dict(self._active)
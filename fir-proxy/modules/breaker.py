@@ -0,0 +1,92 @@
+# modules/breaker.py
+
+import threading
+import time
+
+# 退避时间按 2 的熔断次数次幂增长, 指数超过该值后已远大于 max_backoff, 不再增长 (避免大整数转浮点数溢出)
+MAX_BACKOFF_EXPONENT = 16
+
+
+class CircuitBreaker:
+    """
+    上游代理熔断器.
+    连续失败达到阈值后熔断 (open), 在退避时间内不再尝试该代理;
+    退避结束后允许试探 (half-open), 试探成功则恢复, 失败则以指数增长的退避时间再次熔断.
+    半开状态下同一时间只放行一个试探连接: 发起连接前调用 acquire 占用试探, 结果上报 (或超过 probe_timeout) 后释放.
+    """
+    def __init__(self, failure_threshold=3, base_backoff=5.0, max_backoff=300.0, probe_timeout=15.0):
+        self.failure_threshold = failure_threshold
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.probe_timeout = probe_timeout
+        self._states = {}   # 地址 -> {'failures', 'trips', 'open_until', 'probing_until'}
+        self._lock = threading.Lock()
+
+    def allow(self, proxy_address: str) -> bool:
+        """代理当前是否允许尝试连接 (未熔断, 且不是正在试探的半开代理)."""
+        state = self._states.get(proxy_address)
+        if state is None:
+            return True
+        now = time.monotonic()
+        return state['open_until'] <= now and state['probing_until'] <= now
+
+    def acquire(self, proxy_address: str) -> bool:
+        """
+        即将经该代理发起连接时调用, 返回是否可以连接.
+        半开状态的代理只有第一个调用方得到试探机会, 其余调用方在试探结束前返回 False.
+        """
+        if proxy_address not in self._states:
+            return True
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.get(proxy_address)
+            if state is None:
+                return True
+            if state['open_until'] > now or state['probing_until'] > now:
+                return False
+            if state['trips']:
+                state['probing_until'] = now + self.probe_timeout
+            return True
+
+    def record_success(self, proxy_address: str):
+        """连接成功, 重置该代理的失败记录."""
+        if proxy_address in self._states:
+            with self._lock:
+                self._states.pop(proxy_address, None)
+
+    def record_failure(self, proxy_address: str):
+        """
+        记录一次连接失败.
+        若因此触发熔断, 返回本次的退避秒数, 否则返回 None.
+        """
+        now = time.monotonic()
+        with self._lock:
+            state = self._states.setdefault(
+                proxy_address, {'failures': 0, 'trips': 0, 'open_until': 0.0, 'probing_until': 0.0}
+            )
+            if state['open_until'] > now:
+                return None
+            state['failures'] += 1
+            state['probing_until'] = 0.0
+            # 试探失败 (曾熔断过) 或连续失败达到阈值时熔断
+            if state['trips'] or state['failures'] >= self.failure_threshold:
+                backoff = min(self.max_backoff, self.base_backoff * (2 ** min(state['trips'], MAX_BACKOFF_EXPONENT)))
+                state['trips'] += 1
+                state['failures'] = 0
+                state['open_until'] = now + backoff
+                return backoff
+            return None
+
+    def forget(self, proxy_address: str):
+        with self._lock:
+            self._states.pop(proxy_address, None)
+
+    def open_circuits(self) -> dict:
+        """返回当前处于熔断状态的代理及剩余退避秒数."""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                addr: state['open_until'] - now
+                for addr, state in self._states.items()
+                if state['open_until'] > now
+            }
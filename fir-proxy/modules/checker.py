@@ -7,12 +7,18 @@ import time
 from concurrent.futures import ThreadPoolExecutor, as_completed
 import subprocess # [!] 新增导入
 
+from .metrics import MetricsRegistry
+from .record import ProxyRecord
+
+# 验证耗时分桶 (秒), 完整验证包含测速, 耗时远大于连接耗时
+CHECK_BUCKETS = (0.1, 0.25, 0.5, 1, 1.5, 2.5, 5, 10, 20, 30)
+
 class ProxyChecker:
     """
     一个优化的、多阶段的代理验证器。
     [!] 优化: 公网IP通过调用系统curl获取，并只为低延迟代理测速。
     """
-    def __init__(self, timeout: int = 5):
+    def __init__(self, timeout: int = 5, metrics=None):
         self.timeout = timeout
         self.session = requests.Session()
         self.session.headers.update({
@@ -28,6 +34,16 @@ class ProxyChecker:
         self.location_cache = {}
         self.public_ip = None # [!] 优化: 初始化时设为None，异步获取
 
+        registry = metrics if metrics is not None else MetricsRegistry()
+        self._m_checks = registry.counter('fir_checker_checks_total', '各验证阶段完成的检查数', ('stage', 'result'))
+        self._m_duration = registry.histogram(
+            'fir_checker_check_seconds', '各验证阶段单个代理的检查耗时', ('stage',), buckets=CHECK_BUCKETS)
+        self._m_in_progress = registry.gauge('fir_checker_in_progress', '各验证阶段正在进行的检查数', ('stage',))
+
+    def _record_check(self, stage, passed, start):
+        self._m_checks.inc(labels=(stage, 'passed' if passed else 'failed'))
+        self._m_duration.observe(time.monotonic() - start, (stage,))
+
     def initialize_public_ip(self, log_queue=None):
         """[!] 优化: 使用subprocess模块异步调用系统的curl命令获取IP。"""
         try:
@@ -146,22 +162,38 @@ class ProxyChecker:
     # --- 代理验证核心逻辑 ---
     
     def _pre_check_proxy(self, proxy: str):
+        start = time.monotonic()
+        self._m_in_progress.inc(labels=('precheck',))
         try:
             ip, port_str = proxy.split(':')
             with socket.create_connection((ip, int(port_str)), timeout=1.5):
-                return True
+                passed = True
         except Exception:
-            return False
+            passed = False
+        finally:
+            self._m_in_progress.dec(labels=('precheck',))
+        self._record_check('precheck', passed, start)
+        return passed
 
     def _full_check_proxy(self, proxy_info: dict, validation_mode: str = 'online'):
+        start = time.monotonic()
+        self._m_in_progress.inc(labels=('full',))
+        try:
+            result = self._run_full_check(proxy_info, validation_mode)
+        finally:
+            self._m_in_progress.dec(labels=('full',))
+        self._record_check('full', result['status'] == 'Working', start)
+        return result
+
+    def _run_full_check(self, proxy_info: dict, validation_mode: str):
         proxy = proxy_info['proxy']
         protocol = proxy_info['protocol']
         proxy_url = f"{protocol.lower()}://{proxy}"
         proxies_dict = {'http': proxy_url, 'https': proxy_url}
-        result = {
-            'proxy': proxy, 'protocol': protocol.upper(), 'status': 'Failed',
-            'latency': float('inf'), 'speed': 0, 'anonymity': 'Unknown', 'location': 'N/A'
-        }
+        result = ProxyRecord(
+            proxy=proxy, protocol=protocol.upper(), status='Failed',
+            latency=float('inf'), speed=0, anonymity='Unknown', location='N/A', checked=time.time()
+        )
         try:
             start_time = time.time()
             self.session.head(self.validation_targets['latency_check'], proxies=proxies_dict, timeout=self.timeout).raise_for_status()
@@ -207,7 +239,7 @@ class ProxyChecker:
             return result
 
     def validate_all(self, proxies_by_protocol: dict, result_queue, log_queue, validation_mode='online'):
-        all_proxies_flat = [{'proxy': p, 'protocol': proto} for proto, proxies in proxies_by_protocol.items() for p in proxies]
+        all_proxies_flat = [ProxyRecord(proxy=p, protocol=proto) for proto, proxies in proxies_by_protocol.items() for p in proxies]
         total_proxies = len(all_proxies_flat)
         
         survivors = []
@@ -0,0 +1,124 @@
+# modules/health.py
+
+import threading
+import time
+
+# 健康系数低于该值的代理视为降级, 负载均衡时仅在没有其他代理可选时使用
+DEMOTE_THRESHOLD = 0.5
+# 成功率恢复到该值以上视为已恢复
+RECOVERED_SUCCESS = 0.99
+
+
+class _Health:
+    __slots__ = ('success', 'latency', 'throughput', 'updated', 'samples')
+
+    def __init__(self):
+        self.success = 1.0          # 连接成功率的 EWMA
+        self.latency = None         # 握手耗时的 EWMA (秒)
+        self.throughput = None      # 隧道下行速率的 EWMA (字节/秒)
+        self.updated = time.monotonic()
+        self.samples = 0
+
+
+class HealthTracker:
+    """
+    根据实际流量被动评估上游代理的健康状况.
+    每次观测以权重 alpha 计入 EWMA, 几次连续失败即可明显降级; 没有新观测时,
+    成功率以 recovery_half_life 为半衰期向 1 恢复, 使降级的代理过一段时间后重新获得流量.
+    """
+    def __init__(self, alpha=0.3, recovery_half_life=60.0, latency_target=1.0, min_throughput=32 * 1024):
+        self.alpha = alpha
+        self.recovery_half_life = recovery_half_life
+        self.latency_target = latency_target        # 握手耗时超过该值 (秒) 时按比例降低系数
+        self.min_throughput = min_throughput        # 隧道速率低于该值 (字节/秒) 时按比例降低系数
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, address):
+        entry = self._entries.get(address)
+        if entry is None:
+            entry = self._entries[address] = _Health()
+        return entry
+
+    def _success_at(self, entry, now):
+        idle = now - entry.updated
+        if idle <= 0 or entry.success >= 1.0:
+            return entry.success
+        return 1.0 - (1.0 - entry.success) * 0.5 ** (idle / self.recovery_half_life)
+
+    def _observe_success(self, address, value):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entry(address)
+            success = self._success_at(entry, now)
+            entry.success = success + self.alpha * (value - success)
+            entry.updated = now
+            entry.samples += 1
+
+    def record_success(self, address, latency=None):
+        """记录一次成功的连接, latency 为握手耗时 (秒)."""
+        self._observe_success(address, 1.0)
+        if latency is not None:
+            self.record_latency(address, latency)
+
+    def record_failure(self, address):
+        self._observe_success(address, 0.0)
+
+    def record_latency(self, address, latency):
+        with self._lock:
+            entry = self._entry(address)
+            if entry.latency is None:
+                entry.latency = latency
+            else:
+                entry.latency += self.alpha * (latency - entry.latency)
+
+    def record_throughput(self, address, nbytes, seconds):
+        """记录一条隧道的下行速率."""
+        if seconds <= 0:
+            return
+        rate = nbytes / seconds
+        with self._lock:
+            entry = self._entry(address)
+            if entry.throughput is None:
+                entry.throughput = rate
+            else:
+                entry.throughput += self.alpha * (rate - entry.throughput)
+
+    def factor(self, address) -> float:
+        """健康系数 (0, 1], 没有观测数据时为 1."""
+        with self._lock:
+            entry = self._entries.get(address)
+            if entry is None:
+                return 1.0
+            factor = self._success_at(entry, time.monotonic()) ** 2
+            if entry.latency is not None and entry.latency > self.latency_target:
+                factor *= self.latency_target / entry.latency
+            if entry.throughput is not None and entry.throughput < self.min_throughput:
+                factor *= max(0.25, entry.throughput / self.min_throughput)
+            return factor
+
+    def recovering(self) -> list:
+        """成功率仍在向 1 恢复 (低于 RECOVERED_SUCCESS) 的代理地址, 它们的健康系数会随时间变化."""
+        now = time.monotonic()
+        with self._lock:
+            return [address for address, entry in self._entries.items()
+                    if self._success_at(entry, now) < RECOVERED_SUCCESS]
+
+    def get(self, address):
+        """返回该代理的观测数据 {success, latency, throughput, samples}, 没有时返回 None."""
+        with self._lock:
+            entry = self._entries.get(address)
+            if entry is None:
+                return None
+            return {
+                'success': self._success_at(entry, time.monotonic()), 'latency': entry.latency,
+                'throughput': entry.throughput, 'samples': entry.samples,
+            }
+
+    def forget(self, address):
+        with self._lock:
+            self._entries.pop(address, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
@@ -0,0 +1,425 @@
+# modules/httpproxy.py
+
+from urllib.parse import urlsplit
+
+MAX_HEAD_SIZE = 65536
+MAX_LINE_SIZE = 8192
+# 复用的持久连接被上游关闭时可以在新连接上重发的请求 (幂等方法), 及为重发缓存的请求体上限
+IDEMPOTENT_METHODS = frozenset(('GET', 'HEAD', 'OPTIONS', 'TRACE', 'PUT', 'DELETE'))
+MAX_REPLAY_BODY = 65536
+
+# 解析器事件
+NEED_DATA = object()    # 需要更多数据
+END = object()          # 当前报文结束
+EOF = object()          # 对端在报文边界处关闭了连接
+
+
+class HttpParseError(Exception):
+    """HTTP 报文格式错误."""
+
+
+class HttpHead:
+    """HTTP 报文头 (请求行/状态行 + 头部字段)."""
+    def __init__(self, raw: bytes):
+        self.raw = raw
+        lines = raw.decode('latin-1').split('\r\n')
+        self.start = lines[0].split(' ', 2)
+        if len(self.start) < 2:
+            raise HttpParseError(f"无效的起始行: {lines[0]!r}")
+        self.headers = []
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, sep, value = line.partition(':')
+            if not sep or not name.strip():
+                raise HttpParseError(f"无效的头部字段: {line!r}")
+            self.headers.append((name.strip(), value.strip()))
+
+    def get(self, name, default=None):
+        name = name.lower()
+        for key, value in self.headers:
+            if key.lower() == name:
+                return value
+        return default
+
+    def has_token(self, name, token) -> bool:
+        """逗号分隔的头部字段中是否包含指定值 (如 Connection: close)."""
+        token = token.lower()
+        return any(
+            part.strip().lower() == token
+            for key, value in self.headers if key.lower() == name.lower()
+            for part in value.split(',')
+        )
+
+    def remove(self, *names):
+        names = {n.lower() for n in names}
+        self.headers = [(k, v) for k, v in self.headers if k.lower() not in names]
+
+    def to_bytes(self) -> bytes:
+        lines = [' '.join(self.start)] + [f"{k}: {v}" for k, v in self.headers]
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    # --- 请求 ---
+    @property
+    def method(self):
+        return self.start[0].upper()
+
+    @property
+    def target(self):
+        return self.start[1]
+
+    @property
+    def version(self):
+        return self.start[2] if len(self.start) > 2 else 'HTTP/1.0'
+
+    # --- 响应 ---
+    @property
+    def status(self) -> int:
+        try:
+            return int(self.start[1])
+        except ValueError:
+            raise HttpParseError(f"无效的状态码: {self.start[1]!r}")
+
+    def wants_keep_alive(self, version) -> bool:
+        if self.has_token('Connection', 'close'):
+            return False
+        if version.upper() == 'HTTP/1.0':
+            return self.has_token('Connection', 'keep-alive') or self.has_token('Proxy-Connection', 'keep-alive')
+        return True
+
+
+class HttpParser:
+    """
+    增量 HTTP/1.1 报文解析器 (不涉及IO).
+    只负责定位报文边界, 报文体按原始字节 (含 chunked 分块格式) 原样输出, 便于直接转发.
+    """
+    def __init__(self, response=False):
+        self.response = response
+        self.request_method = None      # 解析响应时由调用方设置, 用于判断 HEAD 等无报文体的情况
+        self._buffer = bytearray()
+        self._eof = False
+        self._state = 'head'
+        self._remaining = 0
+
+    def feed(self, data: bytes):
+        self._buffer += data
+
+    def feed_eof(self):
+        self._eof = True
+
+    def take_buffered(self) -> bytes:
+        """取出尚未解析的缓冲数据 (如 CONNECT 之后的隧道数据)."""
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    @property
+    def until_eof(self) -> bool:
+        """当前报文是否以关闭连接作为结束."""
+        return self._state == 'until_eof'
+
+    def next_event(self):
+        """返回下一个事件: HttpHead / bytes(报文体片段) / END / EOF / NEED_DATA."""
+        state = self._state
+        if state == 'head':
+            return self._parse_head()
+        if state == 'length':
+            if not self._remaining:
+                return self._finish()
+            return self._take()
+        if state == 'chunk_data':
+            if not self._remaining:
+                self._state = 'chunk_size'
+                return self.next_event()
+            return self._take()
+        if state in ('chunk_size', 'trailer'):
+            return self._parse_chunk_line()
+        # until_eof
+        if self._buffer:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+            return data
+        return self._finish() if self._eof else NEED_DATA
+
+    def _finish(self):
+        self._state = 'head'
+        return END
+
+    def _take(self):
+        if not self._buffer:
+            if self._eof:
+                raise HttpParseError("连接在报文中途关闭")
+            return NEED_DATA
+        size = min(self._remaining, len(self._buffer))
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        self._remaining -= size
+        return data
+
+    def _parse_head(self):
+        # 跳过报文之间多余的空行
+        while self._buffer[:2] == b'\r\n':
+            del self._buffer[:2]
+        end = self._buffer.find(b'\r\n\r\n')
+        if end < 0:
+            if len(self._buffer) > MAX_HEAD_SIZE:
+                raise HttpParseError("报文头过长")
+            if self._eof:
+                if self._buffer:
+                    raise HttpParseError("连接在报文头中途关闭")
+                return EOF
+            return NEED_DATA
+        raw = bytes(self._buffer[:end + 4])
+        del self._buffer[:end + 4]
+        head = HttpHead(raw[:-4])
+        self._state, self._remaining = self._body_framing(head)
+        return head
+
+    def _body_framing(self, head):
+        if self.response:
+            status = head.status
+            if (self.request_method == 'HEAD' or 100 <= status < 200 or status in (204, 304)
+                    or (self.request_method == 'CONNECT' and 200 <= status < 300)):
+                return 'length', 0
+        elif head.method == 'CONNECT':
+            return 'length', 0
+        if head.get('Transfer-Encoding') is not None:
+            if not head.has_token('Transfer-Encoding', 'chunked'):
+                if self.response:
+                    return 'until_eof', 0
+                raise HttpParseError("不支持的 Transfer-Encoding")
+            return 'chunk_size', 0
+        length = head.get('Content-Length')
+        if length is not None:
+            try:
+                length = int(length)
+                if length < 0:
+                    raise ValueError
+            except ValueError:
+                raise HttpParseError(f"无效的 Content-Length: {length!r}")
+            return 'length', length
+        return ('until_eof', 0) if self.response else ('length', 0)
+
+    def _parse_chunk_line(self):
+        end = self._buffer.find(b'\r\n')
+        if end < 0:
+            if len(self._buffer) > MAX_LINE_SIZE:
+                raise HttpParseError("chunk 行过长")
+            if self._eof:
+                raise HttpParseError("连接在报文中途关闭")
+            return NEED_DATA
+        line = bytes(self._buffer[:end + 2])
+        del self._buffer[:end + 2]
+        if self._state == 'trailer':
+            if line == b'\r\n':
+                # 先返回最后的空行, 下次调用时由 length 状态给出 END
+                self._state, self._remaining = 'length', 0
+            return line
+        try:
+            size = int(line.split(b';', 1)[0].strip(), 16)
+        except ValueError:
+            raise HttpParseError(f"无效的 chunk 大小: {line!r}")
+        if size == 0:
+            self._state = 'trailer'
+        else:
+            self._state, self._remaining = 'chunk_data', size + 2
+        return line
+
+
+def parse_request_target(head: HttpHead):
+    """
+    解析普通(非CONNECT)代理请求的目标, 返回 (主机, 端口, origin-form路径).
+    无法解析时返回 None.
+    """
+    target = head.target
+    if target.startswith('/'):
+        host_header = head.get('Host')
+        if not host_header:
+            return None
+        parts = urlsplit(f"http://{host_header}")
+        return parts.hostname, parts.port or 80, target
+    parts = urlsplit(target)
+    if parts.scheme.lower() != 'http' or not parts.hostname:
+        return None
+    path = parts.path or '/'
+    if parts.query:
+        path += '?' + parts.query
+    return parts.hostname, parts.port or 80, path
+
+
+def split_connect_target(target: str):
+    """解析 CONNECT 请求的 host:port."""
+    host, _, port = target.rpartition(':')
+    return host.strip('[]'), int(port)
+
+
+def error_response(status: int, reason: str) -> bytes:
+    body = f"{status} {reason}\n".encode('ascii')
+    return (f"HTTP/1.1 {status} {reason}\r\nContent-Type: text/plain\r\n"
+            f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n").encode('ascii') + body
+
+
+def _next_event(parser, recv_op):
+    while True:
+        event = parser.next_event()
+        if event is not NEED_DATA:
+            return event
+        data = yield (recv_op,)
+        if data:
+            parser.feed(data)
+        else:
+            parser.feed_eof()
+
+
+def http_proxy_session(initial=b''):
+    """
+    HTTP 代理客户端连接的会话逻辑 (不涉及IO), 支持持久连接和同一连接上的多个请求.
+    生成器产出以下操作, 由服务引擎执行并通过 send() 返回结果:
+        ('client_recv',)              -> bytes (空表示客户端关闭)
+        ('client_send', data)
+        ('open', host, port)          -> 多读数据 bytes, 失败时为 None (引擎会先关闭旧的上游连接)
+        ('upstream_send', data)       -> 是否发送成功 (上游连接已断开时为 False)
+        ('upstream_recv',)            -> bytes (空表示上游关闭或连接已断开)
+        ('close_upstream',)
+        ('tunnel',)                   -> 双向透明转发直至结束
+    """
+    client = HttpParser()
+    client.feed(initial)
+    upstream = None             # 当前上游连接对应的 (主机, 端口)
+    response = None
+
+    while True:
+        try:
+            head = yield from _next_event(client, 'client_recv')
+        except HttpParseError:
+            yield ('client_send', error_response(400, 'Bad Request'))
+            return
+        if head is EOF:
+            return
+
+        if head.method == 'CONNECT':
+            try:
+                host, port = split_connect_target(head.target)
+            except ValueError:
+                yield ('client_send', error_response(400, 'Bad Request'))
+                return
+            leftover = yield ('open', host, port)
+            if leftover is None:
+                yield ('client_send', error_response(502, 'Bad Gateway'))
+                return
+            yield ('client_send', b'HTTP/1.1 200 Connection Established\r\n\r\n' + leftover)
+            pending = client.take_buffered()
+            if pending and not (yield ('upstream_send', pending)):
+                return
+            yield ('tunnel',)
+            return
+
+        target = parse_request_target(head)
+        if not target:
+            yield ('client_send', error_response(400, 'Bad Request'))
+            return
+        host, port, path = target
+        request_keep_alive = head.wants_keep_alive(head.version)
+
+        # 改写为 origin-form 并去掉逐跳代理头
+        if head.get('Connection') is None and head.get('Proxy-Connection') is not None:
+            head.headers.append(('Connection', head.get('Proxy-Connection')))
+        head.remove('Proxy-Connection', 'Proxy-Authorization')
+        if head.get('Host') is None:
+            head.headers.append(('Host', host if port == 80 else f"{host}:{port}"))
+        expect_continue = head.has_token('Expect', '100-continue')
+        if expect_continue:
+            head.remove('Expect')
+        head.start[1] = path
+
+        reused = upstream == (host, port)
+        if not reused:
+            leftover = yield ('open', host, port)
+            if leftover is None:
+                upstream = None
+                yield ('client_send', error_response(502, 'Bad Gateway'))
+                return
+            upstream = (host, port)
+            response = HttpParser(response=True)
+            response.feed(leftover)
+
+        request = head.to_bytes()
+        # 幂等请求缓存已发送的内容, 复用的连接失效时重发
+        replay = [request] if head.method in IDEMPOTENT_METHODS else None
+        replay_size = 0
+        sent = yield ('upstream_send', request)
+        if expect_continue:
+            yield ('client_send', b'HTTP/1.1 100 Continue\r\n\r\n')
+
+        # 转发请求体 (上游已断开时仍读完请求体, 以便重发或保持客户端连接的报文边界)
+        try:
+            while True:
+                event = yield from _next_event(client, 'client_recv')
+                if event is END:
+                    break
+                if replay is not None:
+                    replay_size += len(event)
+                    if replay_size > MAX_REPLAY_BODY:
+                        replay = None
+                    else:
+                        replay.append(event)
+                if sent:
+                    sent = yield ('upstream_send', event)
+        except HttpParseError:
+            return
+
+        # 转发响应
+        try:
+            while True:
+                event = EOF
+                if sent:
+                    response.request_method = head.method
+                    event = yield from _next_event(response, 'upstream_recv')
+                if event is not EOF or not reused or replay is None:
+                    break
+                # 复用的持久连接已被上游关闭且未收到任何响应: 在新连接上重发一次
+                reused = False
+                leftover = yield ('open', host, port)
+                if leftover is None:
+                    upstream = None
+                    yield ('client_send', error_response(502, 'Bad Gateway'))
+                    return
+                response = HttpParser(response=True)
+                response.feed(leftover)
+                for data in replay:
+                    sent = yield ('upstream_send', data)
+                    if not sent:
+                        break
+
+            while True:
+                if event is EOF:
+                    yield ('client_send', error_response(502, 'Bad Gateway'))
+                    return
+                if isinstance(event, HttpHead):
+                    yield ('client_send', event.raw + b'\r\n\r\n')
+                    if event.status == 101:
+                        # 协议升级 (如 WebSocket): 转为透明隧道
+                        pending = response.take_buffered()
+                        if pending:
+                            yield ('client_send', pending)
+                        yield ('tunnel',)
+                        return
+                    if 100 <= event.status < 200:
+                        response.next_event()   # 1xx 无报文体, 消费其 END 后继续读取最终响应
+                    else:
+                        response_head = event
+                        response_until_eof = response.until_eof
+                elif event is END:
+                    break
+                else:
+                    yield ('client_send', event)
+                event = yield from _next_event(response, 'upstream_recv')
+        except HttpParseError:
+            return
+
+        upstream_keep_alive = response_head.wants_keep_alive(response_head.start[0])
+        if not upstream_keep_alive or response_until_eof:
+            yield ('close_upstream',)
+            upstream = None
+        if not (request_keep_alive and upstream_keep_alive) or response_until_eof:
+            return
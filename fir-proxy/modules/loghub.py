@@ -0,0 +1,232 @@
+# modules/loghub.py
+
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from collections import deque
+
+# 日志级别
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+
+# 旧式文本日志的来源前缀, 如 "[Checker] ..."
+_PREFIX = re.compile(r'^\[([A-Za-z][\w ]*)\]\s*')
+
+
+def guess_level(message: str) -> int:
+    """按旧式文本日志的标记推断级别: 含 "[!]" 的为 WARNING, 其余为 INFO."""
+    return WARNING if '[!]' in message[:40] else INFO
+
+
+def classify(message: str):
+    """按旧式文本日志的 "[来源]" 前缀和 "[!]" 标记推断 (级别, 分类)."""
+    match = _PREFIX.match(message)
+    return guess_level(message), match.group(1).lower() if match else 'app'
+
+
+def emit(sink, level, category, message, **fields):
+    """
+    写入一条结构化日志.
+    sink 为 LogHub (或提供同样 log 方法的对象) 时保留级别、分类和附加字段;
+    只支持 put 的旧式 log_queue (如 queue.Queue) 只收到文本.
+    """
+    log = getattr(sink, 'log', None)
+    if callable(log):
+        log(level, category, message, **fields)
+    else:
+        sink.put(message)
+
+
+class _TokenBucket:
+    __slots__ = ('rate', 'burst', 'tokens', 'updated')
+
+    def __init__(self, rate, burst):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def allow(self, now) -> bool:
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+
+class LogHub:
+    """
+    结构化日志中心.
+    每条日志为字典 {seq, time, level, category, message, ...附加字段}, 保存在容量为 capacity 的环形缓冲区中,
+    可选同时追加到 JSONL 文件. 各分类可设置采样率 (只作用于 INFO 及以下) 和速率限制 (只作用于 WARNING 及以下),
+    被丢弃的条数记在该分类下一条日志的 dropped 字段中 (与写入方传入的 dropped 字段累加).
+    过滤设置可由 settings() 导出、configure() 应用, 供工作进程在转发日志之前先行过滤.
+    界面通过 since() 按序号拉取需要显示的日志, 不再逐条经过队列.
+    提供与 queue.Queue 相同的 put(message), 可直接作为旧式 log_queue 使用.
+    """
+    def __init__(self, capacity=5000, level=INFO, path=None, flush_interval=1.0):
+        self.level = level
+        self.flush_interval = flush_interval
+        self._buffer = deque(maxlen=capacity)
+        self._seq = 0
+        self._sampling = {}         # 分类 -> 采样率 (0, 1]
+        self._limits = {}           # 分类 -> _TokenBucket
+        self._dropped = {}          # 分类 -> 上一条日志之后被丢弃的条数
+        self._lock = threading.Lock()
+        self._file = open(path, 'a', encoding='utf-8', buffering=65536) if path else None
+        self._flushed = time.monotonic()
+        self.stats = {'accepted': 0, 'filtered': 0, 'sampled_out': 0, 'rate_limited': 0}
+
+    @property
+    def last_seq(self) -> int:
+        return self._seq
+
+    def set_level(self, level):
+        self.level = level
+
+    def set_sampling(self, category, rate):
+        """该分类的日志只保留约 rate 比例, rate >= 1 取消采样."""
+        with self._lock:
+            if rate >= 1:
+                self._sampling.pop(category, None)
+            else:
+                self._sampling[category] = max(0.0, rate)
+
+    def set_rate_limit(self, category, rate, burst=None):
+        """该分类每秒最多 rate 条 (允许 burst 条突发), rate 为 None 取消限制."""
+        with self._lock:
+            if rate is None:
+                self._limits.pop(category, None)
+            else:
+                self._limits[category] = _TokenBucket(rate, burst or max(1, rate))
+
+    def settings(self) -> dict:
+        """导出级别、采样率和速率限制 (可序列化)."""
+        with self._lock:
+            return {
+                'level': self.level,
+                'sampling': dict(self._sampling),
+                'limits': {category: (bucket.rate, bucket.burst) for category, bucket in self._limits.items()},
+            }
+
+    def configure(self, settings, share=1):
+        """应用 settings() 导出的设置; 多个写入方分摊同一限额时, 各自的速率限制为 1/share."""
+        with self._lock:
+            self.level = settings['level']
+            self._sampling = dict(settings['sampling'])
+            self._limits = {
+                category: _TokenBucket(rate / share, max(1, burst / share))
+                for category, (rate, burst) in settings['limits'].items()
+            }
+
+    def admit(self, level, category) -> bool:
+        """只做过滤不写入: 按级别、采样和速率限制判断是否保留一条日志, 丢弃的条数由 take_dropped 取出."""
+        if level < self.level:
+            self.stats['filtered'] += 1
+            return False
+        with self._lock:
+            return self._admit_locked(level, category)
+
+    def take_dropped(self, category) -> int:
+        with self._lock:
+            return self._dropped.pop(category, 0)
+
+    def _admit_locked(self, level, category):
+        if level < WARNING:
+            rate = self._sampling.get(category)
+            if rate is not None and random.random() >= rate:
+                self._drop(category, 'sampled_out')
+                return False
+        if level < ERROR:
+            bucket = self._limits.get(category)
+            if bucket is not None and not bucket.allow(time.monotonic()):
+                self._drop(category, 'rate_limited')
+                return False
+        return True
+
+    def log(self, level, category, message, **fields) -> bool:
+        """写入一条日志, 被级别、采样或速率限制过滤时返回 False."""
+        if level < self.level:
+            self.stats['filtered'] += 1
+            return False
+        with self._lock:
+            if not self._admit_locked(level, category):
+                return False
+            self._seq += 1
+            record = {'seq': self._seq, 'time': time.time(), 'level': level, 'category': category,
+                      'message': message}
+            if fields:
+                record.update(fields)
+            dropped = self._dropped.pop(category, 0) + (fields.get('dropped') or 0)
+            if dropped:
+                record['dropped'] = dropped
+            self._buffer.append(record)
+            self.stats['accepted'] += 1
+            if self._file is not None:
+                self._write(record)
+        return True
+
+    def put(self, message):
+        """兼容旧式 log_queue: 按文本的 "[来源]" 前缀和 "[!]" 标记推断分类和级别."""
+        level, category = classify(message)
+        self.log(level, category, message)
+
+    def since(self, seq, min_level=DEBUG, limit=None) -> list:
+        """返回序号大于 seq 的日志 (按序号升序); 指定 limit 时只返回最新的 limit 条."""
+        with self._lock:
+            if not self._buffer:
+                return []
+            first = self._buffer[0]['seq']
+            start = max(0, seq - first + 1)
+            records = list(itertools.islice(self._buffer, start, None))
+        if min_level > DEBUG:
+            records = [record for record in records if record['level'] >= min_level]
+        if limit is not None and len(records) > limit:
+            records = records[-limit:]
+        return records
+
+    def flush(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.flush()
+                self._flushed = time.monotonic()
+
+    def close(self):
+        with self._lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+
+    def get_stats(self) -> dict:
+        with self._lock:
+            return dict(self.stats, buffered=len(self._buffer), last_seq=self._seq)
+
+    @staticmethod
+    def format(record) -> str:
+        """格式化为界面显示的一行文本."""
+        stamp = time.strftime('%H:%M:%S', time.localtime(record['time']))
+        dropped = record.get('dropped')
+        suffix = f" (另有 {dropped} 条同类日志被省略)" if dropped else ''
+        return f"[{stamp}] {record['message']}{suffix}"
+
+    def _drop(self, category, reason):
+        self._dropped[category] = self._dropped.get(category, 0) + 1
+        self.stats[reason] += 1
+
+    def _write(self, record):
+        entry = dict(record, level=LEVEL_NAMES.get(record['level'], record['level']))
+        try:
+            self._file.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+            now = time.monotonic()
+            if record['level'] >= WARNING or now - self._flushed >= self.flush_interval:
+                self._file.flush()
+                self._flushed = now
+        except OSError:
+            pass
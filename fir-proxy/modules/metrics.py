@@ -0,0 +1,239 @@
+# modules/metrics.py
+
+import bisect
+import http.server
+import math
+import threading
+
+# 默认的耗时直方图分桶 (秒)
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()) -> str:
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value) -> str:
+    if isinstance(value, float):
+        if math.isinf(value):
+            return '+Inf' if value > 0 else '-Inf'
+        return repr(value)
+    return str(value)
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help_text, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._values = {}           # 标签值元组 -> 数值
+        self._lock = threading.Lock()
+
+    def _check(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"指标 {self.name} 需要标签 {self.label_names}, 实际为 {labels}")
+
+    def snapshot(self):
+        """导出可序列化的 (类型, 说明, 标签名, 分桶, 数值) 元组."""
+        with self._lock:
+            return self.kind, self.help, self.label_names, None, dict(self._values)
+
+
+class Counter(_Metric):
+    """只增不减的计数器."""
+    kind = 'counter'
+
+    def inc(self, amount=1, labels=()):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+
+class Gauge(_Metric):
+    """可增可减的当前值."""
+    kind = 'gauge'
+
+    def inc(self, amount=1, labels=()):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def dec(self, amount=1, labels=()):
+        self.inc(-amount, labels)
+
+    def set(self, value, labels=()):
+        self._check(labels)
+        with self._lock:
+            self._values[labels] = value
+
+
+class Histogram(_Metric):
+    """按固定分桶统计观测值的分布."""
+    kind = 'histogram'
+
+    def __init__(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, labels=()):
+        self._check(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                # [各分桶计数 (最后一个为 +Inf), 总和, 次数]
+                entry = self._values[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def snapshot(self):
+        with self._lock:
+            values = {labels: (tuple(counts), total, count) for labels, (counts, total, count) in self._values.items()}
+        return self.kind, self.help, self.label_names, self.buckets, values
+
+
+def _merge(snapshots):
+    """合并多个注册表的快照 (如多个工作进程), 同名指标按标签相加."""
+    merged = {}
+    for snapshot in snapshots:
+        for name, (kind, help_text, label_names, buckets, values) in snapshot.items():
+            if name not in merged:
+                merged[name] = (kind, help_text, label_names, buckets, dict(values))
+                continue
+            target = merged[name][4]
+            for labels, value in values.items():
+                previous = target.get(labels)
+                if previous is None:
+                    target[labels] = value
+                elif kind == 'histogram':
+                    target[labels] = (
+                        tuple(a + b for a, b in zip(previous[0], value[0])),
+                        previous[1] + value[1], previous[2] + value[2],
+                    )
+                else:
+                    target[labels] = previous + value
+    return merged
+
+
+class MetricsRegistry:
+    """
+    指标注册表.
+    各模块通过 counter/gauge/histogram 注册指标 (同名重复注册返回已有指标), render() 输出 Prometheus 文本格式.
+    """
+    def __init__(self):
+        self._metrics = {}
+        self._sources = []
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, help_text, labels, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = cls(name, help_text, labels, **kwargs)
+            elif not isinstance(metric, cls) or metric.label_names != tuple(labels):
+                raise ValueError(f"指标 {name} 已以不同的类型或标签注册")
+            return metric
+
+    def counter(self, name, help_text, labels=()) -> Counter:
+        return self._register(Counter, name, help_text, labels)
+
+    def gauge(self, name, help_text, labels=()) -> Gauge:
+        return self._register(Gauge, name, help_text, labels)
+
+    def histogram(self, name, help_text, labels=(), buckets=DEFAULT_BUCKETS) -> Histogram:
+        return self._register(Histogram, name, help_text, labels, buckets=buckets)
+
+    def add_source(self, source):
+        """添加外部快照来源 (返回快照列表的函数), 如其他进程上报的指标."""
+        self._sources.append(source)
+
+    def snapshot(self) -> dict:
+        """导出本注册表所有指标的快照 (可序列化)."""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self) -> str:
+        snapshots = [self.snapshot()]
+        for source in self._sources:
+            snapshots.extend(source())
+        lines = []
+        for name, (kind, help_text, label_names, buckets, values) in sorted(_merge(snapshots).items()):
+            lines.append(f"# HELP {name} {help_text}")
+            lines.append(f"# TYPE {name} {kind}")
+            for labels, value in sorted(values.items()):
+                if kind != 'histogram':
+                    lines.append(f"{name}{_format_labels(label_names, labels)} {_format_value(value)}")
+                    continue
+                counts, total, count = value
+                cumulative = 0
+                for bound, bucket_count in zip(buckets + (float('inf'),), counts):
+                    cumulative += bucket_count
+                    le = (('le', _format_value(float(bound))),)
+                    lines.append(f"{name}_bucket{_format_labels(label_names, labels, le)} {cumulative}")
+                lines.append(f"{name}_sum{_format_labels(label_names, labels)} {_format_value(total)}")
+                lines.append(f"{name}_count{_format_labels(label_names, labels)} {count}")
+        return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    """在本地端口以 HTTP 提供 /metrics 指标接口."""
+    def __init__(self, registry, host='127.0.0.1', port=1802, log_queue=None):
+        self._registry = registry
+        self._host = host
+        self._port = port
+        self._log_queue = log_queue
+        self._server = None
+        self._thread = None
+
+    def log(self, message):
+        if self._log_queue:
+            self._log_queue.put(f"[Metrics] {message}")
+
+    def start(self):
+        if self._server:
+            return
+        registry = self._registry
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?', 1)[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        try:
+            self._server = http.server.ThreadingHTTPServer((self._host, self._port), Handler)
+        except OSError as e:
+            self.log(f"[!] 启动指标接口失败: {e}")
+            return
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        self.log(f"指标接口已启动于 http://{self._host}:{self._port}/metrics")
+
+    def stop(self):
+        if not self._server:
+            return
+        self._server.shutdown()
+        self._server.server_close()
+        self._thread.join()
+        self._server = self._thread = None
@@ -0,0 +1,182 @@
+# modules/pool.py
+
+import math
+import socket
+import threading
+import time
+from collections import defaultdict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+from .upstream import connect_proxy, run_handshake, socks5_greeting
+
+
+def is_socket_alive(sock) -> bool:
+    """检查空闲连接是否仍然可用 (未被对端关闭且没有意外数据)."""
+    try:
+        sock.setblocking(False)
+        try:
+            sock.recv(1, socket.MSG_PEEK)
+            return False
+        except BlockingIOError:
+            return True
+        finally:
+            sock.setblocking(True)
+    except OSError:
+        return False
+
+
+class UpstreamPool:
+    """
+    上游代理的预建连接池.
+    为每个上游代理预先完成TCP连接 (SOCKS5还会完成方法协商),
+    新隧道只需发送最后的 CONNECT 请求. 池大小根据最近的取用频率自动调整.
+    """
+    def __init__(self, max_idle=8, idle_ttl=30, connect_timeout=10, demand_window=10, interval=1.0):
+        self.max_idle = max_idle
+        self.idle_ttl = idle_ttl
+        self.connect_timeout = connect_timeout
+        self.demand_window = demand_window
+        self.interval = interval
+
+        self._idle = defaultdict(deque)             # (地址, 协议) -> deque[(socket, 创建时间)]
+        self._demand = defaultdict(deque)           # (地址, 协议) -> deque[取用时间]
+        self._pending = defaultdict(int)            # (地址, 协议) -> 正在建立的连接数
+        self._connect_latency = {}                  # 地址 -> 连接耗时EWMA
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+        self._wakeup = threading.Event()
+        self._thread = None
+        self._executor = None
+        self.stats = {'hits': 0, 'misses': 0, 'expired': 0, 'created': 0, 'failed': 0}
+
+    def start(self):
+        """启动后台补充线程."""
+        if self.max_idle <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._stop_event.clear()
+        self._wakeup.clear()
+        self._executor = ThreadPoolExecutor(max_workers=16)
+        self._thread = threading.Thread(target=self._maintain_loop, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """停止后台线程并关闭所有空闲连接."""
+        self._stop_event.set()
+        self._wakeup.set()
+        if self._thread and self._thread.is_alive():
+            self._thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+        with self._lock:
+            for entries in self._idle.values():
+                for sock, _ in entries:
+                    sock.close()
+            self._idle.clear()
+            self._demand.clear()
+            self._pending.clear()
+
+    def take(self, address: str, protocol: str):
+        """
+        取出一个可用的预建连接, 返回 (socket, 是否已完成SOCKS5协商).
+        池中无可用连接时返回 None, 由调用方自行建立连接.
+        """
+        key = (address, protocol)
+        now = time.monotonic()
+        with self._lock:
+            if self.max_idle <= 0:
+                return None
+            self._demand[key].append(now)
+            # 每次取用后立即唤醒后台线程补充连接
+            self._wakeup.set()
+            entries = self._idle.get(key)
+            while entries:
+                sock, created = entries.popleft()
+                if now - created < self.idle_ttl and is_socket_alive(sock):
+                    self.stats['hits'] += 1
+                    return sock, protocol == 'SOCKS5'
+                self.stats['expired'] += 1
+                sock.close()
+            self.stats['misses'] += 1
+            return None
+
+    def discard(self, address: str):
+        """关闭并丢弃指定上游的所有空闲连接."""
+        with self._lock:
+            for key in [k for k in self._idle if k[0] == address]:
+                for sock, _ in self._idle.pop(key):
+                    sock.close()
+            for key in [k for k in self._demand if k[0] == address]:
+                del self._demand[key]
+
+    def record_connect_latency(self, address: str, seconds: float):
+        """记录一次连接上游的耗时, 用于估算池大小."""
+        previous = self._connect_latency.get(address)
+        self._connect_latency[address] = seconds if previous is None else previous * 0.7 + seconds * 0.3
+
+    def idle_count(self, address=None) -> int:
+        with self._lock:
+            return sum(len(v) for k, v in self._idle.items() if address is None or k[0] == address)
+
+    def _target_size(self, key, now):
+        demand = self._demand[key]
+        while demand and now - demand[0] > self.demand_window:
+            demand.popleft()
+        if not demand:
+            return 0
+        # Little定律: 覆盖一个连接耗时内的预期需求量
+        rate = len(demand) / self.demand_window
+        latency = self._connect_latency.get(key[0], 1.0)
+        return min(self.max_idle, math.ceil(rate * latency) + 1)
+
+    def _maintain_loop(self):
+        while True:
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            if self._stop_event.is_set():
+                break
+            now = time.monotonic()
+            to_create = []
+            with self._lock:
+                for key in list(self._demand):
+                    entries = self._idle[key]
+                    while entries and now - entries[0][1] >= self.idle_ttl:
+                        entries.popleft()[0].close()
+                        self.stats['expired'] += 1
+                    missing = self._target_size(key, now) - len(entries) - self._pending[key]
+                    if missing > 0:
+                        self._pending[key] += missing
+                        to_create.extend([key] * missing)
+                    if not self._demand[key] and not entries:
+                        del self._demand[key]
+                        self._idle.pop(key, None)
+            for key in to_create:
+                try:
+                    self._executor.submit(self._create, key)
+                except RuntimeError:
+                    break
+
+    def _create(self, key):
+        address, protocol = key
+        sock = None
+        try:
+            start = time.monotonic()
+            sock = connect_proxy(address, self.connect_timeout)
+            if protocol == 'SOCKS5':
+                sock.settimeout(self.connect_timeout)
+                run_handshake(sock, socks5_greeting())
+                sock.settimeout(None)
+            self.record_connect_latency(address, time.monotonic() - start)
+        except Exception:
+            if sock:
+                sock.close()
+            sock = None
+        with self._lock:
+            self._pending[key] = max(0, self._pending[key] - 1)
+            if sock is None:
+                self.stats['failed'] += 1
+            elif self._stop_event.is_set() or key not in self._demand:
+                sock.close()
+            else:
+                self._idle[key].append((sock, time.monotonic()))
+                self.stats['created'] += 1
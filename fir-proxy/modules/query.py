@@ -0,0 +1,200 @@
+# modules/query.py
+
+import heapq
+import itertools
+from bisect import bisect_left, bisect_right
+from operator import itemgetter
+
+# 匿名度从低到高; 未知的匿名度等级为 -1
+ANONYMITY_LEVELS = ('Transparent', 'Anonymous', 'Elite')
+# 延迟分桶的上界 (毫秒, 不含), 最后一个桶为更高延迟及没有延迟的代理; 查询的延迟上限恰为某个上界时无需逐个比较.
+# 延迟上限与 rotator.is_premium 一致, 也不含边界 (延迟 < max_latency_ms)
+LATENCY_BUCKETS_MS = (100, 200, 300, 500, 750, 1000, 1500, 2000, 3000, 5000, 10000)
+
+_first = itemgetter(0)
+
+
+def anonymity_level(anonymity) -> int:
+    try:
+        return ANONYMITY_LEVELS.index(anonymity)
+    except ValueError:
+        return -1
+
+
+def _latency_ms(proxy_info) -> float:
+    latency = proxy_info.get('latency')
+    return float('inf') if latency is None else latency * 1000
+
+
+def _sort_key(proxy_info) -> float:
+    # 按分数降序
+    return -(proxy_info.get('score') or 0.0)
+
+
+class _Cell:
+    """
+    同一组 (地区, 协议, 匿名度, 延迟桶) 的代理, keys 与 records 平行, 按分数降序.
+    dirty 时未排序; stale 时分数已被原地修改, keys 需按记录重新计算.
+    """
+    __slots__ = ('keys', 'records', 'dirty', 'stale')
+
+    def __init__(self):
+        self.keys = []
+        self.records = []
+        self.dirty = False
+        self.stale = False
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, key, proxy_info, defer):
+        if defer or self.dirty:
+            self.keys.append(key)
+            self.records.append(proxy_info)
+            self.dirty = True
+            return
+        index = bisect_right(self.keys, key)
+        self.keys.insert(index, key)
+        self.records.insert(index, proxy_info)
+
+    def discard(self, key, proxy_info):
+        keys, records = self.keys, self.records
+        index = -1
+        if not self.dirty:
+            index = bisect_left(keys, key)
+            while index < len(keys) and keys[index] == key and records[index] is not proxy_info:
+                index += 1
+            if index >= len(keys) or records[index] is not proxy_info:
+                index = -1
+        if index < 0:
+            # 未排序 (或分数已被原地修改) 时线性查找
+            index = next((i for i, p in enumerate(records) if p is proxy_info), -1)
+            if index < 0:
+                return
+        del keys[index]
+        del records[index]
+
+    def sort(self):
+        if not self.dirty:
+            return
+        records = self.records
+        keys = [_sort_key(p) for p in records] if self.stale else self.keys
+        order = sorted(range(len(records)), key=keys.__getitem__)
+        self.keys = [keys[i] for i in order]
+        self.records = [records[i] for i in order]
+        self.dirty = self.stale = False
+
+
+class QueryIndex:
+    """
+    代理池的多维查询索引.
+    代理按 (地区, 协议, 匿名度等级, 延迟桶) 分入单元, 单元内按分数降序; 地区和协议另各有 "不限" (None) 的单元
+    (与轮换器的 _View 相同), 每个代理属于 4 个单元. 任一条件组合只需按匿名度和延迟桶选出不超过
+    len(ANONYMITY_LEVELS) + 1 乘以桶数的单元, 多路归并取前 limit 个, 只有边界延迟桶内的代理需要逐个比较.
+    单个增删为 O(log n) 查找加列表插入; 批量操作 (defer=True) 只追加并标记单元, 由 sort() 一次排序,
+    查询遇到未排序的单元时先排序. 调用方负责加锁.
+    """
+    def __init__(self):
+        # (地区, 协议) -> {(匿名度等级, 延迟桶): 单元}, 查询时按前两维直接定位
+        self._groups = {}
+
+    @staticmethod
+    def _coords(proxy_info):
+        region = proxy_info.get('location', 'Unknown')
+        protocol = (proxy_info.get('protocol') or '').upper()
+        return (anonymity_level(proxy_info.get('anonymity')),
+                bisect_right(LATENCY_BUCKETS_MS, _latency_ms(proxy_info))), region, protocol
+
+    def add(self, proxy_info, defer=False):
+        coords, region, protocol = self._coords(proxy_info)
+        key = _sort_key(proxy_info)
+        for group in ((region, protocol), (region, None), (None, protocol), (None, None)):
+            cells = self._groups.get(group)
+            if cells is None:
+                cells = self._groups[group] = {}
+            cell = cells.get(coords)
+            if cell is None:
+                cell = cells[coords] = _Cell()
+            cell.add(key, proxy_info, defer)
+
+    def discard(self, proxy_info):
+        """移除代理; 需在修改代理的地区、协议、匿名度、延迟或分数之前调用."""
+        coords, region, protocol = self._coords(proxy_info)
+        key = _sort_key(proxy_info)
+        for group in ((region, protocol), (region, None), (None, protocol), (None, None)):
+            cells = self._groups.get(group)
+            cell = cells.get(coords) if cells is not None else None
+            if cell is None:
+                continue
+            cell.discard(key, proxy_info)
+            if not cell:
+                del cells[coords]
+                if not cells:
+                    del self._groups[group]
+
+    def rescored(self, proxy_info):
+        """代理的分数已被原地修改: 标记其所在单元待排序."""
+        coords, region, protocol = self._coords(proxy_info)
+        for group in ((region, protocol), (region, None), (None, protocol), (None, None)):
+            cell = self._groups[group][coords]
+            cell.dirty = cell.stale = True
+
+    def sort(self):
+        """排序全部待排序的单元 (批量操作之后调用)."""
+        for cells in self._groups.values():
+            for cell in cells.values():
+                cell.sort()
+
+    def clear(self):
+        self._groups.clear()
+
+    def query(self, region=None, protocol=None, min_anonymity=None, max_latency_ms=None, limit=None,
+              order_by='score') -> list:
+        """
+        按条件查询, 返回代理列表; 只返回延迟低于 max_latency_ms 的代理.
+        order_by 为 'score' 时按分数降序, 为 None 时不保证顺序 (取满 limit 个即停止).
+        """
+        if order_by not in ('score', None):
+            raise ValueError(f"不支持的排序字段: {order_by}")
+        if limit is not None and limit <= 0:
+            return []
+        cells = self._groups.get((None if region in (None, "All") else region,
+                                  protocol.upper() if protocol else None))
+        if not cells:
+            return []
+        min_level = -1 if min_anonymity is None else anonymity_level(min_anonymity)
+        if min_anonymity is not None and min_level < 0:
+            raise ValueError(f"未知的匿名度: {min_anonymity}")
+        # 边界桶: 桶内可能有延迟不低于 max_latency_ms 的代理, 需逐个比较 (上限恰为桶的上界时除外)
+        boundary = exact = None
+        if max_latency_ms is not None:
+            boundary = bisect_left(LATENCY_BUCKETS_MS, max_latency_ms)
+            exact = boundary < len(LATENCY_BUCKETS_MS) and LATENCY_BUCKETS_MS[boundary] == max_latency_ms
+        full, partial = [], []
+        for (level, bucket), cell in cells.items():
+            if level < min_level or (boundary is not None and bucket > boundary):
+                continue
+            if order_by is not None:
+                cell.sort()
+            (partial if bucket == boundary and not exact else full).append(cell)
+
+        def matches(p):
+            return _latency_ms(p) < max_latency_ms
+
+        if order_by is None:
+            records = itertools.chain(itertools.chain.from_iterable(cell.records for cell in full),
+                                      (p for cell in partial for p in cell.records if matches(p)))
+            return list(records if limit is None else itertools.islice(records, limit))
+        if not full and not partial:
+            return []
+        streams = [zip(cell.keys, cell.records) for cell in full]
+        streams.extend(((key, p) for key, p in zip(cell.keys, cell.records) if matches(p)) for cell in partial)
+        merged = streams[0] if len(streams) == 1 else heapq.merge(*streams, key=_first)
+        if limit is None:
+            return [p for _, p in merged]
+        result = []
+        for _, p in merged:
+            result.append(p)
+            if len(result) >= limit:
+                break
+        return result
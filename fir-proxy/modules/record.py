@@ -0,0 +1,165 @@
+# modules/record.py
+
+import socket
+import struct
+import sys
+
+# 代理记录的固定字段, 其余字段存放在 _extra 字典中; checked 为最近一次验证的时间戳
+FIELDS = ('proxy', 'protocol', 'status', 'latency', 'speed', 'anonymity', 'location', 'score', 'checked')
+_FIELD_SET = frozenset(FIELDS)
+# 取值种类很少的字符串字段, 驻留后所有记录共用同一个字符串对象
+_INTERNED = frozenset(('protocol', 'status', 'anonymity', 'location'))
+
+
+def pack_ip(host: str):
+    """IPv4 地址转为 32 位整数, 不是 IPv4 地址时返回 None."""
+    try:
+        return struct.unpack('!I', socket.inet_aton(host))[0] if host.count('.') == 3 else None
+    except OSError:
+        return None
+
+
+def unpack_ip(ip: int) -> str:
+    return socket.inet_ntoa(struct.pack('!I', ip))
+
+
+class ProxyRecord:
+    """
+    紧凑的代理记录, 替代每个代理一个 dict.
+    固定字段存放在 __slots__ 中 (未设置的字段与 dict 中不存在的键等价), 协议、匿名度、地区等字符串驻留共用;
+    提供 get/[]/update/keys/items 等 dict 接口, 现有按键访问的代码无需修改.
+    地址字符串同时是轮换器各索引的键, 只保存一份; 需要整数形式时由 packed_ip 按需计算.
+    """
+    __slots__ = FIELDS + ('_extra',)
+
+    def __init__(self, fields=(), **kwargs):
+        self._extra = None
+        self.update(fields, **kwargs)
+
+    @classmethod
+    def coerce(cls, proxy_info):
+        """dict 转为 ProxyRecord, 已是 ProxyRecord 时原样返回."""
+        return proxy_info if isinstance(proxy_info, cls) else cls(proxy_info)
+
+    @classmethod
+    def from_row(cls, row):
+        """按 FIELDS 顺序的取值 (如数据库中的一行) 创建记录, 值为 None 的字段视为不存在."""
+        record = cls.__new__(cls)
+        record._extra = None
+        for name, value in zip(FIELDS, row):
+            if value is not None:
+                setattr(record, name, sys.intern(value) if name in _INTERNED and type(value) is str else value)
+        return record
+
+    @classmethod
+    def from_packed(cls, ip: int, port: int, **fields):
+        return cls(fields, proxy=f"{unpack_ip(ip)}:{port}")
+
+    @property
+    def host(self) -> str:
+        return self.proxy.rpartition(':')[0]
+
+    @property
+    def port(self) -> int:
+        return int(self.proxy.rpartition(':')[2])
+
+    @property
+    def packed_ip(self):
+        """IPv4 地址的 32 位整数形式, 不是 IPv4 地址时为 None."""
+        return pack_ip(self.host)
+
+    def __getitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                return getattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        if self._extra is not None and key in self._extra:
+            return self._extra[key]
+        raise KeyError(key)
+
+    def __setitem__(self, key, value):
+        if key in _FIELD_SET:
+            if key in _INTERNED and type(value) is str:
+                value = sys.intern(value)
+            setattr(self, key, value)
+        elif self._extra is None:
+            self._extra = {key: value}
+        else:
+            self._extra[key] = value
+
+    def __delitem__(self, key):
+        if key in _FIELD_SET:
+            try:
+                delattr(self, key)
+            except AttributeError:
+                raise KeyError(key) from None
+        elif self._extra is not None and key in self._extra:
+            del self._extra[key]
+        else:
+            raise KeyError(key)
+
+    def __contains__(self, key):
+        if key in _FIELD_SET:
+            return hasattr(self, key)
+        return self._extra is not None and key in self._extra
+
+    def get(self, key, default=None):
+        if key in _FIELD_SET:
+            return getattr(self, key, default)
+        if self._extra is not None:
+            return self._extra.get(key, default)
+        return default
+
+    def keys(self):
+        keys = [name for name in FIELDS if hasattr(self, name)]
+        if self._extra:
+            keys.extend(self._extra)
+        return keys
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.keys())
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def update(self, fields=(), **kwargs):
+        if hasattr(fields, 'keys'):
+            for key in fields.keys():
+                self[key] = fields[key]
+        else:
+            for key, value in fields:
+                self[key] = value
+        for key, value in kwargs.items():
+            self[key] = value
+
+    def copy(self):
+        return ProxyRecord(self)
+
+    def to_dict(self) -> dict:
+        return dict(self.items())
+
+    def __getstate__(self):
+        # 按位记录已设置的字段, pickle 结果比 dict 更小
+        present, values = 0, []
+        for bit, name in enumerate(FIELDS):
+            value = getattr(self, name, None)
+            if value is not None or hasattr(self, name):
+                present |= 1 << bit
+            values.append(value)
+        return present, tuple(values), self._extra
+
+    def __setstate__(self, state):
+        present, values, self._extra = state
+        for bit, (name, value) in enumerate(zip(FIELDS, values)):
+            if present >> bit & 1:
+                setattr(self, name, value)
+
+    def __repr__(self):
+        return f"ProxyRecord({self.to_dict()!r})"
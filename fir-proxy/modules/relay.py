@@ -0,0 +1,187 @@
+# modules/relay.py
+
+import asyncio
+import os
+import select
+import time
+
+# 转发模式:
+#   copy   - recv() 后 sendall(), 每个数据块都会分配新的 bytes 对象
+#   buffer - recv_into() 预分配的 memoryview, 不再分配新对象
+#   splice - 通过管道在内核中直接搬运数据 (仅 Linux)
+#   auto   - splice 可用时使用 splice, 否则使用 buffer
+RELAY_MODES = ('auto', 'splice', 'buffer', 'copy')
+
+SPLICE_AVAILABLE = hasattr(os, 'splice')
+CHUNK_SIZE = 65536
+PIPE_SIZE = 1 << 20
+
+
+def resolve_mode(mode: str) -> str:
+    """将配置的转发模式解析为实际使用的模式."""
+    if mode not in RELAY_MODES:
+        raise ValueError(f"未知的转发模式: {mode}")
+    if mode == 'auto':
+        return 'splice' if SPLICE_AVAILABLE else 'buffer'
+    if mode == 'splice' and not SPLICE_AVAILABLE:
+        return 'buffer'
+    return mode
+
+
+def _open_pipe():
+    read_fd, write_fd = os.pipe()
+    try:
+        import fcntl
+        fcntl.fcntl(write_fd, getattr(fcntl, 'F_SETPIPE_SZ', 1031), PIPE_SIZE)
+    except (ImportError, OSError):
+        pass
+    return read_fd, write_fd
+
+
+# --- 阻塞模式 (线程引擎) ---
+
+def relay_blocking(sock1, sock2, mode='auto', is_running=lambda: True, idle_timeout=5):
+    """
+    在两个阻塞socket间双向转发数据, 任一方关闭或空闲超时后返回.
+    返回 (从 sock1 读取的字节数, 从 sock2 读取的字节数).
+    """
+    mode = resolve_mode(mode)
+    pipe = _open_pipe() if mode == 'splice' else None
+    buffer = memoryview(bytearray(CHUNK_SIZE)) if mode == 'buffer' else None
+    fds = {sock1: sock2, sock2: sock1}
+    counts = {sock1: 0, sock2: 0}
+    try:
+        while is_running():
+            readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], idle_timeout)
+            if exceptional or not readable:
+                break
+            for sock in readable:
+                other_sock = fds[sock]
+                if mode == 'splice':
+                    received = os.splice(sock.fileno(), pipe[1], CHUNK_SIZE,
+                                         flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                    if not received:
+                        return counts[sock1], counts[sock2]
+                    counts[sock] += received
+                    while received:
+                        received -= os.splice(pipe[0], other_sock.fileno(), received, flags=os.SPLICE_F_MOVE)
+                elif mode == 'buffer':
+                    received = sock.recv_into(buffer)
+                    if not received:
+                        return counts[sock1], counts[sock2]
+                    counts[sock] += received
+                    other_sock.sendall(buffer[:received])
+                else:
+                    data = sock.recv(CHUNK_SIZE)
+                    if not data:
+                        return counts[sock1], counts[sock2]
+                    counts[sock] += len(data)
+                    other_sock.sendall(data)
+    except (ConnectionResetError, BrokenPipeError, OSError, select.error):
+        pass
+    finally:
+        if pipe:
+            os.close(pipe[0])
+            os.close(pipe[1])
+    return counts[sock1], counts[sock2]
+
+
+# --- 异步模式 (asyncio 引擎) ---
+
+async def _wait_fd(loop, fd, writable=False):
+    future = loop.create_future()
+
+    def _ready():
+        if not future.done():
+            future.set_result(None)
+
+    if writable:
+        loop.add_writer(fd, _ready)
+    else:
+        loop.add_reader(fd, _ready)
+    try:
+        await future
+    finally:
+        if writable:
+            loop.remove_writer(fd)
+        else:
+            loop.remove_reader(fd)
+
+
+async def _pump_copy(loop, src, dst, touch):
+    while True:
+        data = await loop.sock_recv(src, CHUNK_SIZE)
+        if not data:
+            return
+        touch(len(data))
+        await loop.sock_sendall(dst, data)
+
+
+async def _pump_buffer(loop, src, dst, touch):
+    buffer = memoryview(bytearray(CHUNK_SIZE))
+    while True:
+        received = await loop.sock_recv_into(src, buffer)
+        if not received:
+            return
+        touch(received)
+        await loop.sock_sendall(dst, buffer[:received])
+
+
+async def _pump_splice(loop, src, dst, touch):
+    read_fd, write_fd = _open_pipe()
+    src_fd, dst_fd = src.fileno(), dst.fileno()
+    try:
+        while True:
+            try:
+                received = os.splice(src_fd, write_fd, CHUNK_SIZE,
+                                     flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+            except BlockingIOError:
+                await _wait_fd(loop, src_fd)
+                continue
+            if not received:
+                return
+            touch(received)
+            while received:
+                try:
+                    received -= os.splice(read_fd, dst_fd, received,
+                                          flags=os.SPLICE_F_MOVE | os.SPLICE_F_NONBLOCK)
+                except BlockingIOError:
+                    await _wait_fd(loop, dst_fd, writable=True)
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+_PUMPS = {'copy': _pump_copy, 'buffer': _pump_buffer, 'splice': _pump_splice}
+
+
+async def relay_async(loop, sock1, sock2, mode='auto', idle_timeout=5):
+    """
+    在两个非阻塞socket间双向转发数据, 任一方关闭或两个方向均空闲超时后返回.
+    返回 (从 sock1 读取的字节数, 从 sock2 读取的字节数).
+    """
+    pump = _PUMPS[resolve_mode(mode)]
+    last_activity = time.monotonic()
+    counts = [0, 0]
+
+    def tracker(index):
+        def touch(size):
+            nonlocal last_activity
+            last_activity = time.monotonic()
+            counts[index] += size
+        return touch
+
+    tasks = [
+        loop.create_task(pump(loop, sock1, sock2, tracker(0))),
+        loop.create_task(pump(loop, sock2, sock1, tracker(1))),
+    ]
+    try:
+        while True:
+            done, _ = await asyncio.wait(tasks, timeout=idle_timeout, return_when=asyncio.FIRST_COMPLETED)
+            if done or time.monotonic() - last_activity >= idle_timeout:
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+    return counts[0], counts[1]
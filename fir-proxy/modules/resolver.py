@@ -0,0 +1,270 @@
+# modules/resolver.py
+
+import asyncio
+import ipaddress
+import random
+import socket
+import struct
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from .metrics import MetricsRegistry
+
+# 域名解析方式:
+#   remote - 域名原样交给上游代理解析 (不在本机产生DNS查询)
+#   local  - 在本机解析后以IP连接目标, 结果按记录的TTL缓存
+DNS_MODES = ('remote', 'local')
+
+QTYPE_A = 1
+QTYPE_AAAA = 28
+
+
+class DnsError(Exception):
+    """域名解析失败."""
+
+
+def is_ip_address(host: str) -> bool:
+    try:
+        ipaddress.ip_address(host)
+        return True
+    except ValueError:
+        return False
+
+
+def _system_nameservers():
+    """读取 /etc/resolv.conf 中的DNS服务器 (Windows 等系统上为空, 仅使用 getaddrinfo)."""
+    servers = []
+    try:
+        with open('/etc/resolv.conf', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                parts = line.split()
+                if len(parts) >= 2 and parts[0] == 'nameserver':
+                    servers.append(parts[1].split('%', 1)[0])
+    except OSError:
+        pass
+    return servers
+
+
+def _system_hosts():
+    """读取 /etc/hosts, 返回 {域名: [地址]} (IPv4 在前)."""
+    hosts = {}
+    try:
+        with open('/etc/hosts', encoding='utf-8', errors='ignore') as f:
+            for line in f:
+                parts = line.split('#', 1)[0].split()
+                if len(parts) < 2 or not is_ip_address(parts[0]):
+                    continue
+                for name in parts[1:]:
+                    addresses = hosts.setdefault(name.lower(), [])
+                    if parts[0] not in addresses:
+                        addresses.append(parts[0])
+    except OSError:
+        pass
+    for addresses in hosts.values():
+        addresses.sort(key=lambda address: ':' in address)
+    return hosts
+
+
+def _build_query(query_id, host, qtype):
+    labels = [label for label in host.encode('idna').split(b'.') if label]
+    qname = b''.join(bytes([len(label)]) + label for label in labels) + b'\x00'
+    return struct.pack('!HHHHHH', query_id, 0x0100, 1, 0, 0, 0) + qname + struct.pack('!HH', qtype, 1)
+
+
+def _skip_name(data, offset):
+    while True:
+        length = data[offset]
+        if length == 0:
+            return offset + 1
+        if length & 0xC0 == 0xC0:
+            return offset + 2
+        offset += length + 1
+
+
+def _parse_response(data, query_id, qtype):
+    """解析DNS应答, 返回 (rcode, 地址列表, 最小TTL)."""
+    if len(data) < 12:
+        raise DnsError("DNS应答过短")
+    response_id, flags, qdcount, ancount, _, _ = struct.unpack('!HHHHHH', data[:12])
+    if response_id != query_id:
+        raise DnsError("DNS应答ID不匹配")
+    if flags & 0x0200:
+        raise DnsError("DNS应答被截断")
+    offset = 12
+    for _ in range(qdcount):
+        offset = _skip_name(data, offset) + 4
+    addresses = []
+    ttl = None
+    for _ in range(ancount):
+        offset = _skip_name(data, offset)
+        rtype, _, rttl, rdlength = struct.unpack('!HHIH', data[offset:offset + 10])
+        offset += 10
+        rdata = data[offset:offset + rdlength]
+        offset += rdlength
+        # CNAME 链上任一记录过期都需要重新解析
+        ttl = rttl if ttl is None else min(ttl, rttl)
+        if rtype == qtype == QTYPE_A and rdlength == 4:
+            addresses.append(socket.inet_ntoa(rdata))
+        elif rtype == qtype == QTYPE_AAAA and rdlength == 16:
+            addresses.append(socket.inet_ntop(socket.AF_INET6, rdata))
+    return flags & 0x000F, addresses, ttl
+
+
+def query_dns(nameserver, host, qtype=QTYPE_A, timeout=2.0):
+    """向指定DNS服务器发送一次UDP查询, 返回 (rcode, 地址列表, TTL)."""
+    query_id = random.getrandbits(16)
+    family = socket.AF_INET6 if ':' in nameserver else socket.AF_INET
+    with socket.socket(family, socket.SOCK_DGRAM) as sock:
+        sock.settimeout(timeout)
+        sock.connect((nameserver, 53))
+        sock.send(_build_query(query_id, host, qtype))
+        deadline = time.monotonic() + timeout
+        while True:
+            sock.settimeout(max(0.01, deadline - time.monotonic()))
+            data = sock.recv(4096)
+            try:
+                return _parse_response(data, query_id, qtype)
+            except DnsError:
+                # 忽略ID不匹配的迟到应答, 其他错误直接抛出
+                if len(data) >= 2 and struct.unpack('!H', data[:2])[0] != query_id:
+                    continue
+                raise
+
+
+class DnsResolver:
+    """
+    带缓存的本地域名解析.
+    先查 hosts 文件, 再直接查询系统DNS服务器以获得记录的TTL; DNS服务器明确答复域名不存在 (NXDOMAIN) 或没有地址记录时
+    即为最终结果, 只有全部服务器超时或出错 (SERVFAIL 等) 以及没有DNS服务器时才退回 getaddrinfo.
+    hosts 文件和 getaddrinfo 的结果按 default_ttl 缓存, 解析失败的结果按 negative_ttl 缓存; 同一域名的并发查询只执行一次.
+    """
+    def __init__(self, default_ttl=60, negative_ttl=10, max_ttl=3600, max_entries=4096, timeout=2.0,
+                 metrics=None):
+        self.default_ttl = default_ttl
+        self.negative_ttl = negative_ttl
+        self.max_ttl = max_ttl
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self._nameservers = _system_nameservers()
+        self._hosts = _system_hosts()
+        self._cache = OrderedDict()     # 域名 -> (地址列表或 None, 过期时间)
+        self._inflight = {}             # 域名 -> Future
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=8)
+
+        registry = metrics if metrics is not None else MetricsRegistry()
+        self._m_lookups = registry.counter('fir_proxy_dns_lookups_total', '本地域名解析请求结果', ('result',))
+        self._m_duration = registry.histogram('fir_proxy_dns_resolve_seconds', '本地域名解析耗时 (未命中缓存时)')
+
+    def resolve(self, host: str) -> str:
+        """阻塞地解析域名, 返回一个IP地址; 失败时抛出 DnsError."""
+        cached = self._cached(host)
+        if cached is not None:
+            return self._pick(host, cached)
+        return self._pick(host, self._lookup_future(host).result())
+
+    async def resolve_async(self, host: str) -> str:
+        """在事件循环中解析域名, 返回一个IP地址; 失败时抛出 DnsError."""
+        cached = self._cached(host)
+        if cached is not None:
+            return self._pick(host, cached)
+        return self._pick(host, await asyncio.wrap_future(self._lookup_future(host)))
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _pick(self, host, addresses):
+        if not addresses:
+            raise DnsError(f"无法解析域名 {host}")
+        return addresses[0] if len(addresses) == 1 else random.choice(addresses)
+
+    def _cached(self, host):
+        """返回缓存的地址列表 (解析失败的缓存为空列表), 未命中返回 None."""
+        host = host.lower()
+        with self._lock:
+            entry = self._cache.get(host)
+            if entry is None:
+                return None
+            addresses, expires = entry
+            if expires <= time.monotonic():
+                del self._cache[host]
+                return None
+            self._cache.move_to_end(host)
+        self._m_lookups.inc(labels=('hit' if addresses else 'negative_hit',))
+        return addresses
+
+    def _lookup_future(self, host):
+        """返回该域名进行中的查询, 没有时发起新查询 (single-flight)."""
+        host = host.lower()
+        with self._lock:
+            future = self._inflight.get(host)
+            if future is not None:
+                self._m_lookups.inc(labels=('shared',))
+                return future
+            future = self._inflight[host] = Future()
+        self._m_lookups.inc(labels=('miss',))
+        try:
+            self._executor.submit(self._run_lookup, host, future)
+        except RuntimeError:
+            # 解析器已关闭
+            self._finish(host, future, [], 0)
+        return future
+
+    def _run_lookup(self, host, future):
+        start = time.monotonic()
+        try:
+            addresses, ttl = self._lookup(host)
+        except Exception:
+            addresses, ttl = [], self.negative_ttl
+        self._m_duration.observe(time.monotonic() - start)
+        self._finish(host, future, addresses, ttl)
+
+    def _finish(self, host, future, addresses, ttl):
+        with self._lock:
+            self._inflight.pop(host, None)
+            if ttl > 0:
+                self._cache[host] = (addresses, time.monotonic() + min(ttl, self.max_ttl))
+                self._cache.move_to_end(host)
+                while len(self._cache) > self.max_entries:
+                    self._cache.popitem(last=False)
+        if not addresses:
+            self._m_lookups.inc(labels=('failed',))
+        future.set_result(addresses)
+
+    def _lookup(self, host):
+        """返回 (地址列表, TTL), 地址列表为空表示解析失败."""
+        addresses = self._hosts.get(host)
+        if addresses:
+            return list(addresses), self.default_ttl
+        for nameserver in self._nameservers:
+            try:
+                for qtype in (QTYPE_A, QTYPE_AAAA):
+                    rcode, addresses, ttl = query_dns(nameserver, host, qtype, self.timeout)
+                    if rcode == 0 and addresses:
+                        return addresses, ttl
+                    if rcode == 3:
+                        # NXDOMAIN: 域名不存在, 无需再查 AAAA 或退回系统解析
+                        return [], self.negative_ttl
+                    if rcode != 0:
+                        # SERVFAIL 等错误, 换下一个服务器
+                        raise DnsError(f"DNS错误码 {rcode}")
+                # A 和 AAAA 均没有记录
+                return [], self.negative_ttl
+            except (OSError, DnsError, IndexError, struct.error):
+                continue
+        # 没有DNS服务器或全部超时、出错时交给系统解析
+        try:
+            infos = socket.getaddrinfo(host, None, proto=socket.IPPROTO_TCP)
+        except (socket.gaierror, UnicodeError):
+            return [], self.negative_ttl
+        addresses = []
+        for family, _, _, _, sockaddr in sorted(infos, key=lambda info: info[0] != socket.AF_INET):
+            if sockaddr[0] not in addresses:
+                addresses.append(sockaddr[0])
+        return addresses, self.default_ttl
@@ -1,134 +1,799 @@
 # modules/rotator.py
 
+import itertools
 import threading
-from collections import defaultdict
+import time
+
+from .health import DEMOTE_THRESHOLD, HealthTracker
+from .query import QueryIndex
+from .record import ProxyRecord
+from .strategies import RoundRobin, make_strategy
+
+# 优质代理: 验证延迟低于该值 (秒)
+PREMIUM_LATENCY = 2.0
+
+# add_many 每批持有锁处理的代理数, 批间释放锁, 避免大批导入长时间阻塞选择代理的连接
+ADD_BATCH = 1024
+
+# 没有新观测时健康系数随成功率恢复而变化, 每隔该秒数把恢复中的代理的系数重新计入选择策略的权重
+HEALTH_REFRESH_INTERVAL = 10.0
+
+
+def is_premium(proxy_info: dict) -> bool:
+    return proxy_info.get('latency', float('inf')) < PREMIUM_LATENCY
+
+
+def _swap_remove(items, positions, proxy_address):
+    """O(1) 删除: 用列表末尾的元素填补被删除的位置."""
+    index = positions.pop(proxy_address)
+    last = items.pop()
+    if index < len(items):
+        items[index] = last
+        positions[last.get('proxy')] = index
+
+
+class _View:
+    """
+    一组筛选条件 (地区, 是否优质, 协议) 下的代理子集.
+    删除时只留下空位, 其余代理的位置和轮询游标不变; 空位过多时压缩, 游标随之平移, 轮询顺序保持不变.
+    states 保存各选择策略在该子集上的状态, 随成员变化增量维护, 压缩后按需重建.
+    成员变化和选择 (轮询游标、策略状态) 持有子集自己的 lock, 选择代理时不获取轮换器的锁;
+    成员每次变化后递增 generation, frozen 缓存某一代的成员元组.
+    """
+    __slots__ = ('items', 'positions', 'size', 'cursor', 'states', 'generation', 'frozen', 'lock')
+
+    def __init__(self):
+        self.items = []
+        self.positions = {}
+        self.size = 0
+        self.cursor = -1        # 上一次轮询到的位置
+        self.states = {}        # 策略名 -> 策略状态
+        self.generation = 0
+        self.frozen = None      # (generation, 成员元组)
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return self.size
+
+    def add(self, proxy_info):
+        with self.lock:
+            index = len(self.items)
+            self.positions[proxy_info.get('proxy')] = index
+            self.items.append(proxy_info)
+            self.size += 1
+            for state in self.states.values():
+                state.added(index, proxy_info)
+            self.generation += 1
+
+    def remove(self, proxy_address):
+        with self.lock:
+            self._remove(proxy_address)
+
+    def _remove(self, proxy_address):
+        index = self.positions.pop(proxy_address, None)
+        if index is None:
+            return
+        proxy_info = self.items[index]
+        self.items[index] = None
+        self.size -= 1
+        for state in self.states.values():
+            state.removed(index, proxy_info)
+        if self.items[-1] is None:
+            while self.items and self.items[-1] is None:
+                self.items.pop()
+            for state in self.states.values():
+                state.truncate(len(self.items))
+        if len(self.items) > 2 * self.size + 16:
+            self._compact()
+        self.generation += 1
+
+    def touch(self, proxy_address):
+        """代理信息 (如分数) 变化后更新策略状态."""
+        with self.lock:
+            index = self.positions.get(proxy_address)
+            if index is not None:
+                for state in self.states.values():
+                    state.updated(index, self.items[index])
+
+    def state(self, strategy, factor):
+        """返回策略在该子集上的状态, 首次使用时创建 (factor 为健康系数函数). 调用方需持有 self.lock."""
+        if strategy.name not in self.states:
+            state = strategy.new_state(self, factor)
+            if state is None:
+                return None
+            self.states[strategy.name] = state
+        return self.states[strategy.name]
+
+    def _compact(self):
+        items = []
+        cursor = -1
+        for index, proxy_info in enumerate(self.items):
+            if proxy_info is None:
+                continue
+            if index <= self.cursor:
+                cursor = len(items)
+            items.append(proxy_info)
+        self.items = items
+        self.positions = {p.get('proxy'): index for index, p in enumerate(items)}
+        self.cursor = cursor
+        self.states.clear()
+
+    def next(self):
+        """按顺序轮询下一个代理, 为空时返回 None. 调用方需持有 self.lock."""
+        if not self.size:
+            return None
+        count = len(self.items)
+        index = self.cursor
+        while True:
+            index = (index + 1) % count
+            proxy_info = self.items[index]
+            if proxy_info is not None:
+                self.cursor = index
+                return proxy_info
+
+    def members(self) -> list:
+        return [p for p in self.items if p is not None]
+
+    def frozen_members(self) -> tuple:
+        """返回不可变的成员元组, 成员未变化时复用缓存."""
+        frozen = self.frozen
+        if frozen is not None and frozen[0] == self.generation:
+            return frozen[1]
+        with self.lock:
+            frozen = self.frozen
+            if frozen is None or frozen[0] != self.generation:
+                frozen = self.frozen = (self.generation, tuple(p for p in self.items if p is not None))
+            return frozen[1]
+
+
+class _ReadState:
+    """
+    读取方使用的不可变状态, 写入方每次修改后 (持有锁) 整体替换 ProxyRotator._read.
+    读取方只需读取一次属性, 无需加锁, 也不会看到修改到一半的状态.
+    """
+    __slots__ = ('version', 'current', 'selection', 'total', 'regions')
+
+    def __init__(self, version, current, selection, total, regions):
+        self.version = version
+        self.current = current
+        self.selection = selection
+        self.total = total
+        self.regions = regions      # 是否优质 -> {地区: 代理数}
+
+
+def _view_keys(proxy_info):
+    """代理所属的全部子集: (地区, 是否优质, 协议), 地区 "All" 和协议 None 表示不限."""
+    regions = ("All", proxy_info.get('location', 'Unknown'))
+    qualities = (False, True) if is_premium(proxy_info) else (False,)
+    protocols = (None, (proxy_info.get('protocol') or '').upper())
+    return [(region, premium, protocol) for region in regions for premium in qualities for protocol in protocols]
+
+
+def _index_proxy(proxy_info, proxies, by_address, positions, views):
+    """把代理 (转为 ProxyRecord) 加入列表和各索引, 返回加入的记录; 地址已存在时返回 None."""
+    proxy_address = proxy_info.get('proxy')
+    if proxy_address in by_address:
+        return None
+    proxy_info = ProxyRecord.coerce(proxy_info)
+    by_address[proxy_address] = proxy_info
+    positions[proxy_address] = len(proxies)
+    proxies.append(proxy_info)
+    for key in _view_keys(proxy_info):
+        view = views.get(key)
+        if view is None:
+            view = views[key] = _View()
+        view.add(proxy_info)
+    return proxy_info
+
 
 class ProxyRotator:
-    """代理轮换器."""
+    """
+    代理轮换器.
+    写入 (增删改、轮换) 持有 self.lock, 修改完成后发布新的 _ReadState; 当前代理、计数、按地址查找和候选列表等
+    读取操作不获取锁 (RCU 式), 代理服务的每个连接不会等待批量导入或重新验证.
+    """
     def __init__(self):
         self.all_proxies = []
-        self.proxies_by_country = defaultdict(list)
-        self.indices = defaultdict(lambda: -1)
+        # 地址 -> 代理信息, 以及代理在 all_proxies 中的位置, 使增删查均为 O(1)
+        self._by_address = {}
+        self._positions = {}
+        # (地区, 是否优质, 协议) -> _View, 随增删和 update_proxy 增量维护, 轮询和计数无需重新筛选
+        self._views = {}
+        # query 使用的多维索引, 首次查询时建立, 之后随增删改增量维护 (工作进程等不查询的轮换器没有该开销)
+        self._query = None
+        # get_next_proxy 使用的选择策略
+        self._strategy = RoundRobin()
         self.current_proxy = None
+        self.selection = ("All", False)
+        self.version = 0    # 每次修改代理列表或当前代理时递增, 用于判断快照是否过期
         self.lock = threading.Lock()
+        self._listeners = []
+        self._usage_listeners = []
+        # 代理服务上报的实际连接结果, 用于在验证之间动态调整代理的排序
+        self.health = HealthTracker()
+        # 各地区的代理数 (是否优质 -> {地区: 数量}), 随增删增量维护
+        self._region_counts = {False: {}, True: {}}
+        self._health_refresh_at = 0.0
+        self._publish()
+
+    def _publish(self):
+        """发布新的只读状态. 调用方需持有锁 (初始化时除外)."""
+        self._read = _ReadState(
+            self.version, self.current_proxy, self.selection, len(self.all_proxies),
+            {premium: dict(counts) for premium, counts in self._region_counts.items()},
+        )
+
+    def _count_locked(self, proxy_info, delta):
+        region = proxy_info.get('location', 'Unknown')
+        for premium in ((False, True) if is_premium(proxy_info) else (False,)):
+            counts = self._region_counts[premium]
+            count = counts.get(region, 0) + delta
+            if count:
+                counts[region] = count
+            else:
+                counts.pop(region, None)
+
+    def subscribe(self, callback):
+        """
+        订阅代理变化事件, callback(event, proxy_address) 在锁外调用.
+        事件: 'added' (新增代理), 'updated' (update_proxy 更新了代理信息或 update_scores 更新了分数),
+        'removed' (代理被移除), 'cleared' (代理列表被清空, 地址为 None).
+        load_snapshot 整体替换代理列表时只发出 'removed'.
+        """
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        try:
+            self._listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def _notify(self, event, proxy_address=None):
+        for callback in list(self._listeners):
+            callback(event, proxy_address)
+
+    def subscribe_usage(self, callback):
+        """
+        订阅经各代理转发的用量, callback(proxy_address, requests, failures, nbytes) 在上报的线程中调用,
+        回调需尽快返回 (代理服务的连接线程或事件循环会等待它).
+        """
+        self._usage_listeners.append(callback)
+
+    def unsubscribe_usage(self, callback):
+        try:
+            self._usage_listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def record_usage(self, proxy_address: str, requests=0, failures=0, nbytes=0):
+        """通知用量订阅者 (不影响健康度), 由 report_* 调用."""
+        for callback in list(self._usage_listeners):
+            callback(proxy_address, requests, failures, nbytes)
 
     def clear(self):
         """清空所有代理."""
         with self.lock:
             self.all_proxies = []
-            self.proxies_by_country.clear()
-            self.indices.clear()
+            self._by_address.clear()
+            self._positions.clear()
+            self._views.clear()
+            self._region_counts = {False: {}, True: {}}
+            self._query = None
             self.current_proxy = None
+            self.version += 1
+            self._publish()
+        self.health.clear()
+        self._notify('cleared')
             
     def add_proxy(self, proxy_info: dict):
-        """添加一个代理."""
+        """添加一个代理 (dict 或 ProxyRecord, 以 ProxyRecord 保存), 地址已存在时忽略."""
         with self.lock:
-            proxy_address = proxy_info.get('proxy')
-            if any(p.get('proxy') == proxy_address for p in self.all_proxies):
-                return 
+            added = self._add_locked(proxy_info)
+            if added:
+                self.version += 1
+                self._publish()
+        if added:
+            self._notify('added', proxy_info.get('proxy'))
 
-            self.all_proxies.append(proxy_info)
-            country = proxy_info.get('location', 'Unknown')
-            self.proxies_by_country[country].append(proxy_info)
+    def add_many(self, proxies) -> int:
+        """批量添加代理 (每 ADD_BATCH 个获取一次锁), 返回实际新增的数量."""
+        proxies = iter(proxies)
+        added = 0
+        while True:
+            batch = list(itertools.islice(proxies, ADD_BATCH))
+            if not batch:
+                return added
+            with self.lock:
+                # 整批导入时查询索引只追加, 待下次查询时一次排序
+                defer = len(batch) >= ADD_BATCH
+                batch = [proxy_info for proxy_info in batch if self._add_locked(proxy_info, defer)]
+                if batch:
+                    self.version += 1
+                    self._publish()
+            for proxy_info in batch:
+                self._notify('added', proxy_info.get('proxy'))
+            added += len(batch)
 
     def remove_proxy(self, proxy_address: str):
         """通过地址删除代理."""
         with self.lock:
-            proxy_to_remove = None
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    proxy_to_remove = p_info
-                    break
-            
-            if proxy_to_remove:
-                self.all_proxies.remove(proxy_to_remove)
-                
-                country = proxy_to_remove.get('location', 'Unknown')
-                if country in self.proxies_by_country:
-                    try:
-                        self.proxies_by_country[country].remove(proxy_to_remove)
-                        if not self.proxies_by_country[country]:
-                            del self.proxies_by_country[country]
-                    except ValueError:
-                        pass
-                
-                if self.current_proxy == proxy_to_remove:
-                    self.current_proxy = None
-                return True
+            removed = self._remove_locked(proxy_address)
+            if removed:
+                self.version += 1
+                self._publish()
+        if removed:
+            self.health.forget(proxy_address)
+            self._notify('removed', proxy_address)
+        return removed
+
+    def remove_many(self, proxy_addresses) -> list:
+        """批量删除代理 (只获取一次锁), 返回实际删除的地址."""
+        with self.lock:
+            removed = [address for address in proxy_addresses if self._remove_locked(address)]
+            if removed:
+                self.version += 1
+                self._publish()
+        for proxy_address in removed:
+            self.health.forget(proxy_address)
+            self._notify('removed', proxy_address)
+        return removed
+
+    def get_proxy(self, proxy_address: str):
+        """通过地址查找代理, 不存在时返回 None (无锁: 单次字典读取是原子的)."""
+        return self._by_address.get(proxy_address)
+
+    def update_proxy(self, proxy_address: str, fields: dict):
+        """
+        更新代理信息 (如重新验证后的延迟、分数、地区), 并同步调整其所属的子集.
+        返回更新后的代理信息, 代理不存在时返回 None.
+        """
+        fields = {key: value for key, value in fields.items() if key != 'proxy'}
+        with self.lock:
+            proxy_info = self._by_address.get(proxy_address)
+            if proxy_info is None:
+                return None
+            old_keys = _view_keys(proxy_info)
+            self._count_locked(proxy_info, -1)
+            if self._query is not None:
+                self._query.discard(proxy_info)
+            proxy_info.update(fields)
+            if self._query is not None:
+                self._query.add(proxy_info)
+            self._count_locked(proxy_info, 1)
+            new_keys = _view_keys(proxy_info)
+            for key in old_keys:
+                if key not in new_keys:
+                    self._unview_locked(key, proxy_address)
+                else:
+                    self._views[key].touch(proxy_address)
+            for key in new_keys:
+                if key not in old_keys:
+                    view = self._views.get(key)
+                    if view is None:
+                        view = self._views[key] = _View()
+                    view.add(proxy_info)
+            self.version += 1
+            self._publish()
+        self._notify('updated', proxy_address)
+        return proxy_info
+
+    def update_scores(self, scores: dict) -> int:
+        """
+        批量更新代理分数 (如 ScoringEngine.rescore 的输出), 每 ADD_BATCH 个获取一次锁, 返回分数有变化的数量.
+        每批释放锁之后为分数有变化的代理发出 'updated' 事件 (供 PoolStore 等持久化).
+        """
+        items = iter(scores.items())
+        updated = 0
+        while True:
+            batch = list(itertools.islice(items, ADD_BATCH))
+            if not batch:
+                return updated
+            changed = []
+            with self.lock:
+                for proxy_address, score in batch:
+                    proxy_info = self._by_address.get(proxy_address)
+                    if proxy_info is None or proxy_info.get('score') == score:
+                        continue
+                    proxy_info['score'] = score
+                    for key in _view_keys(proxy_info):
+                        self._views[key].touch(proxy_address)
+                    if self._query is not None:
+                        self._query.rescored(proxy_info)
+                    changed.append(proxy_address)
+                if changed:
+                    self.version += 1
+                    self._publish()
+            for proxy_address in changed:
+                self._notify('updated', proxy_address)
+            updated += len(changed)
+
+    def _add_locked(self, proxy_info, defer=False):
+        record = _index_proxy(proxy_info, self.all_proxies, self._by_address, self._positions, self._views)
+        if record is None:
+            return False
+        self._count_locked(record, 1)
+        if self._query is not None:
+            self._query.add(record, defer)
+        return True
+
+    def _remove_locked(self, proxy_address):
+        proxy_to_remove = self._by_address.pop(proxy_address, None)
+        if proxy_to_remove is None:
             return False
+        _swap_remove(self.all_proxies, self._positions, proxy_address)
+        self._count_locked(proxy_to_remove, -1)
+        if self._query is not None:
+            self._query.discard(proxy_to_remove)
+        for key in _view_keys(proxy_to_remove):
+            self._unview_locked(key, proxy_address)
+        if self.current_proxy is proxy_to_remove:
+            self.current_proxy = None
+        return True
+
+    def _unview_locked(self, key, proxy_address):
+        view = self._views.get(key)
+        if view is not None:
+            view.remove(proxy_address)
+            if not view:
+                del self._views[key]
 
     def get_working_proxies_count(self) -> int:
         """获取可用代理总数."""
-        with self.lock:
-            return len(self.all_proxies)
+        return self._read.total
 
     def get_available_regions_with_counts(self, premium_only=False) -> dict:
         """获取各区域的代理数量."""
+        return dict(self._read.regions[bool(premium_only)])
+
+    def _view_locked(self, region, premium_only, protocol=None, fallback=False):
+        """
+        返回符合筛选条件的子集 (可能为 None).
+        fallback 时区域不存在则退回全部代理 (界面的筛选条件); 调用方明确指定的区域不存在时返回 None.
+        只有单次字典读取, 无需持有轮换器的锁; 子集自身的读写由其 lock 保护.
+        """
+        views = self._views
+        if fallback and region != "All" and (region, False, None) not in views:
+            # 若区域不存在, 则从全部代理中选
+            region = "All"
+        return views.get((region, bool(premium_only), protocol.upper() if protocol else None))
+
+    def set_selection(self, region="All", premium_only=False):
+        """设置当前的区域/质量筛选条件."""
         with self.lock:
-            # 统一逻辑
-            counts = {}
-            for region, proxies in self.proxies_by_country.items():
-                if not proxies:
-                    continue
-                
-                if premium_only:
-                    # 统计优质代理
-                    count = sum(1 for p in proxies if p.get('latency', float('inf')) * 1000 < 2000)
-                    if count > 0:
-                        counts[region] = count
-                else:
-                    counts[region] = len(proxies)
-            return counts
+            if self.selection != (region, premium_only):
+                self.selection = (region, premium_only)
+                self.version += 1
+                self._publish()
 
+    def get_selection(self):
+        """获取当前的区域/质量筛选条件."""
+        return self._read.selection
 
-    def get_next_proxy(self, region="All", premium_only=False):
-        """获取下一个代理."""
+    def get_candidates(self, region=None, premium_only=None, protocol=None) -> list:
+        """
+        获取符合筛选条件的全部代理, 区域/质量未指定时使用当前筛选条件.
+        明确指定的区域不存在时返回空列表; 当前筛选条件中的区域不存在时退回全部代理.
+        """
+        selection = self._read.selection
+        fallback = region is None
+        if region is None:
+            region = selection[0]
+        if premium_only is None:
+            premium_only = selection[1]
+        view = self._view_locked(region, premium_only, protocol, fallback)
+        return list(view.frozen_members()) if view is not None else []
+
+    def count(self, region="All", premium_only=False, protocol=None) -> int:
+        """符合筛选条件的代理数量."""
+        view = self._view_locked(region, premium_only, protocol)
+        return len(view) if view is not None else 0
+
+    def query(self, region=None, protocol=None, min_anonymity=None, max_latency_ms=None, limit=None,
+              order_by='score') -> list:
+        """
+        按地区、协议、最低匿名度 ('Transparent' < 'Anonymous' < 'Elite') 和延迟上限 (毫秒, 不含) 查询代理,
+        未指定的条件不限; order_by 为 'score' 时按分数降序, 为 None 时不排序. 返回最多 limit 个代理.
+        由 QueryIndex 提供, 与 get_candidates 不同, 不存在的地区返回空列表. 查询持有锁.
+        """
         with self.lock:
-            source_list = []
-            region_key = region
-            
-            if region == "All":
-                source_list = self.all_proxies
-            elif region in self.proxies_by_country:
-                source_list = self.proxies_by_country[region]
-            else: 
-                # 若区域不存在, 则从全部代理中选
-                source_list = self.all_proxies
-                region_key = "All"
-
-            # 筛选列表
-            if premium_only:
-                target_list = [
-                    p for p in source_list 
-                    if p.get('latency', float('inf')) * 1000 < 2000
-                ]
-            else:
-                target_list = source_list
+            if self._query is None:
+                self._query = QueryIndex()
+                for proxy_info in self.all_proxies:
+                    self._query.add(proxy_info, defer=True)
+            return self._query.query(region, protocol, min_anonymity, max_latency_ms, limit, order_by)
 
-            if not target_list:
-                self.current_proxy = None
-                return None
+    def set_strategy(self, strategy):
+        """设置 get_next_proxy 的选择策略 (名称或 SelectionStrategy 实例), 默认为轮询."""
+        strategy = make_strategy(strategy)
+        with self.lock:
+            self._strategy = strategy
 
-            # 用独立的键保存索引
-            index_key = f"{region_key}_{'premium' if premium_only else 'all'}"
-            
-            current_idx = self.indices.get(index_key, -1)
-            next_idx = (current_idx + 1) % len(target_list)
-            self.indices[index_key] = next_idx
-            
-            self.current_proxy = target_list[next_idx]
+    def get_next_proxy(self, region="All", premium_only=False):
+        """按选择策略获取下一个代理, 每组筛选条件各自保存轮询进度."""
+        with self.lock:
+            self.selection = (region, premium_only)
+            self.current_proxy = self._select(self._view_locked(region, premium_only, fallback=True),
+                                              self._strategy)
+            self.version += 1
+            self._publish()
             return self.current_proxy
 
+    def select(self, region=None, premium_only=None, protocol=None, exclude=(), allow=None, strategy=None,
+               load=None):
+        """
+        按策略为一个连接选择代理 (不改变当前代理), 无可用代理时返回 None.
+        exclude 为需跳过的地址, allow 为可选的地址过滤函数, load(地址) 为活动连接数 (供 p2c 使用).
+        根据实际流量降级的代理只在没有其他代理可选时使用. 明确指定的区域不存在时返回 None, 不退回全部代理.
+        不获取轮换器的锁: 筛选条件取自已发布的只读状态, 只有所选子集的 lock 在选择期间被持有.
+        """
+        strategy = self._strategy if strategy is None else make_strategy(strategy)
+        selection = self._read.selection
+        fallback = region is None
+        if region is None:
+            region = selection[0]
+        if premium_only is None:
+            premium_only = selection[1]
+        return self._select(self._view_locked(region, premium_only, protocol, fallback), strategy,
+                            exclude, allow, load)
+
+    def _select(self, view, strategy, exclude=(), allow=None, load=None):
+        if view is None:
+            return None
+
+        def usable(p):
+            address = p.get('proxy')
+            return address not in exclude and (allow is None or allow(address))
+
+        def healthy(p):
+            return usable(p) and self.health.factor(p.get('proxy')) >= DEMOTE_THRESHOLD
+
+        load = load or (lambda address: 0)
+        with view.lock:
+            state = view.state(strategy, self.health.factor)
+            return strategy.pick(view, state, healthy, load) or strategy.pick(view, state, usable, load)
+
     def get_current_proxy(self):
         """获取当前代理."""
-        with self.lock:
-            return self.current_proxy
+        return self._read.current
 
     def set_current_proxy_by_address(self, proxy_address: str):
         """通过地址设置当前代理."""
         with self.lock:
-            for p_info in self.all_proxies:
-                if p_info.get('proxy') == proxy_address:
-                    self.current_proxy = p_info
-                    return p_info
-            return None
\ No newline at end of file
+            p_info = self._by_address.get(proxy_address)
+            if p_info is not None:
+                self.current_proxy = p_info
+                self.version += 1
+                self._publish()
+            return p_info
+
+    def report_success(self, proxy_address: str, latency=None):
+        """上报一次经该代理成功建立的连接, latency 为握手耗时 (秒)."""
+        self.health.record_success(proxy_address, latency)
+        self._health_changed(proxy_address)
+        if self._usage_listeners:
+            self.record_usage(proxy_address, requests=1)
+
+    def report_failure(self, proxy_address: str):
+        """上报一次经该代理连接失败."""
+        self.health.record_failure(proxy_address)
+        self._health_changed(proxy_address)
+        if self._usage_listeners:
+            self.record_usage(proxy_address, failures=1)
+
+    def report_throughput(self, proxy_address: str, nbytes: int, seconds: float):
+        """上报一条隧道的下行字节数和持续时间."""
+        self.health.record_throughput(proxy_address, nbytes, seconds)
+        self._health_changed(proxy_address)
+
+    def _health_changed(self, proxy_address):
+        """
+        健康系数变化后更新代理所在子集的策略状态 (加权和排序按分数乘以健康系数计算).
+        只修改子集, 不获取轮换器的锁; 顺带定期刷新恢复中的代理 (其系数随时间变化, 但可能没有新的观测).
+        """
+        self._touch(proxy_address)
+        now = time.monotonic()
+        if now >= self._health_refresh_at:
+            self._health_refresh_at = now + HEALTH_REFRESH_INTERVAL
+            for address in self.health.recovering():
+                if address != proxy_address:
+                    self._touch(address)
+
+    def _touch(self, proxy_address):
+        proxy_info = self._by_address.get(proxy_address)
+        if proxy_info is None:
+            return
+        for key in _view_keys(proxy_info):
+            view = self._views.get(key)
+            if view is not None:
+                view.touch(proxy_address)
+
+    def report_transfer(self, proxy_address: str, nbytes: int):
+        """上报一条隧道转发的总字节数 (双向), 供按流量轮换使用."""
+        if self._usage_listeners:
+            self.record_usage(proxy_address, nbytes=nbytes)
+
+    def health_factor(self, proxy_address: str) -> float:
+        """根据实际流量得到的健康系数 (0, 1], 没有观测数据时为 1."""
+        return self.health.factor(proxy_address)
+
+    def effective_score(self, proxy_info: dict) -> float:
+        """验证时得到的分数按健康系数折算后的实时分数."""
+        return proxy_info.get('score', 0) * self.health.factor(proxy_info.get('proxy'))
+
+    def snapshot(self) -> dict:
+        """导出代理列表及轮换状态的快照 (可序列化), 供其他进程中的轮换器加载."""
+        with self.lock:
+            return {
+                'version': self.version,
+                'proxies': [p.copy() for p in self.all_proxies],
+                'current': self.current_proxy.get('proxy') if self.current_proxy else None,
+                'selection': self.selection,
+            }
+
+    def load_snapshot(self, snapshot: dict):
+        """用快照整体替换代理列表及轮换状态."""
+        proxies, by_address, positions, views = [], {}, {}, {}
+        for p_info in snapshot['proxies']:
+            _index_proxy(p_info, proxies, by_address, positions, views)
+        current = by_address.get(snapshot['current'])
+        region_counts = {False: {}, True: {}}
+        for (region, premium, protocol), view in views.items():
+            if region != "All" and protocol is None:
+                region_counts[premium][region] = len(view)
+        with self.lock:
+            removed = self._by_address.keys() - by_address.keys()
+            # 保留各子集的轮询进度
+            for key, view in views.items():
+                old = self._views.get(key)
+                if old is None:
+                    continue
+                with old.lock:
+                    if 0 <= old.cursor < len(old.items) and old.items[old.cursor] is not None:
+                        view.cursor = view.positions.get(old.items[old.cursor].get('proxy'), -1)
+            self.all_proxies = proxies
+            self._by_address = by_address
+            self._positions = positions
+            self._views = views
+            self._region_counts = region_counts
+            self._query = None
+            self.current_proxy = current
+            self.selection = tuple(snapshot['selection'])
+            self.version = snapshot['version']
+            self._publish()
+        for proxy_address in removed:
+            self.health.forget(proxy_address)
+            self._notify('removed', proxy_address)
+
+
+class RotationScheduler:
+    """
+    后台轮换调度: 在独立线程中轮换轮换器的当前代理, 不依赖界面的事件循环.
+    触发条件 (均可选, None 或 0 表示不启用):
+        interval    距上次轮换的秒数
+        requests    经当前代理成功建立的连接数
+        nbytes      经当前代理转发的字节数
+        failures    经当前代理连接失败的次数
+    用量来自代理服务上报给轮换器的连接结果 (见 ProxyRotator.subscribe_usage), 每次轮换后清零.
+    轮换后以 callback(proxy_info, reason) 通知订阅者, reason 为 'interval'、'requests'、'bytes'、'failures'
+    或 'manual'; 没有可用代理时 proxy_info 为 None. 回调在调度线程 (或调用 rotate_now 的线程) 中执行.
+    region/premium_only 为 None 时沿用轮换器当前的筛选条件.
+    """
+    def __init__(self, rotator, interval=None, requests=None, nbytes=None, failures=None, region=None,
+                 premium_only=None):
+        self._rotator = rotator
+        self._lock = threading.Lock()
+        self._rotate_lock = threading.Lock()
+        self._listeners = []
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+        self._pending = None        # 用量达到阈值时等待调度线程处理的轮换原因
+        self._requests = self._failures = self._bytes = 0
+        self._deadline = None
+        self.interval = self.requests = self.nbytes = self.failures = None
+        self.region = self.premium_only = None
+        self.configure(interval=interval, requests=requests, nbytes=nbytes, failures=failures, region=region,
+                       premium_only=premium_only)
+
+    def configure(self, **options):
+        """修改触发条件或筛选条件 (参数同构造函数), 运行中修改立即生效; 修改 interval 时从现在重新计时."""
+        for name, value in options.items():
+            if name not in ('interval', 'requests', 'nbytes', 'failures', 'region', 'premium_only'):
+                raise TypeError(f"未知的轮换选项: {name}")
+            if name in ('interval', 'requests', 'nbytes', 'failures'):
+                if value is not None and value < 0:
+                    raise ValueError(f"{name} 不能为负数")
+                value = value or None
+            setattr(self, name, value)
+        if 'interval' in options:
+            with self._lock:
+                self._deadline = time.monotonic() + self.interval if self.interval else None
+        self._wake.set()
+
+    @property
+    def running(self) -> bool:
+        return self._thread is not None
+
+    def subscribe(self, callback):
+        self._listeners.append(callback)
+
+    def unsubscribe(self, callback):
+        try:
+            self._listeners.remove(callback)
+        except ValueError:
+            pass
+
+    def start(self):
+        if self._thread is not None:
+            return
+        # 每次启动使用新的停止标志, 在回调中 stop 后立即 start 时旧线程仍会退出
+        self._stop = threading.Event()
+        self._reset()
+        self._rotator.subscribe_usage(self._on_usage)
+        self._thread = threading.Thread(target=self._run, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        thread, self._thread = self._thread, None
+        if thread is None:
+            return
+        self._rotator.unsubscribe_usage(self._on_usage)
+        self._stop.set()
+        self._wake.set()
+        if thread is not threading.current_thread():
+            thread.join()
+
+    def rotate_now(self, reason='manual'):
+        """立即轮换, 返回新的当前代理."""
+        with self._rotate_lock:
+            region, premium_only = self._rotator.get_selection()
+            proxy_info = self._rotator.get_next_proxy(
+                region if self.region is None else self.region,
+                premium_only if self.premium_only is None else self.premium_only,
+            )
+            self._reset()
+        for callback in list(self._listeners):
+            callback(proxy_info, reason)
+        return proxy_info
+
+    def _reset(self):
+        with self._lock:
+            self._requests = self._failures = self._bytes = 0
+            self._pending = None
+            self._deadline = time.monotonic() + self.interval if self.interval else None
+
+    def _on_usage(self, proxy_address, requests, failures, nbytes):
+        current = self._rotator.get_current_proxy()
+        if current is None or current.get('proxy') != proxy_address:
+            return
+        with self._lock:
+            self._requests += requests
+            self._failures += failures
+            self._bytes += nbytes
+            if self._pending is not None:
+                return
+            if self.failures and self._failures >= self.failures:
+                self._pending = 'failures'
+            elif self.requests and self._requests >= self.requests:
+                self._pending = 'requests'
+            elif self.nbytes and self._bytes >= self.nbytes:
+                self._pending = 'bytes'
+            else:
+                return
+        # 轮换在调度线程中进行, 上报的连接线程不等待
+        self._wake.set()
+
+    def _run(self, stop):
+        while not stop.is_set():
+            with self._lock:
+                deadline = self._deadline
+            self._wake.wait(None if deadline is None else max(deadline - time.monotonic(), 0))
+            if stop.is_set():
+                break
+            self._wake.clear()
+            with self._lock:
+                reason = self._pending
+                if reason is None and self._deadline is not None and time.monotonic() >= self._deadline:
+                    reason = 'interval'
+            if reason is not None:
+                self.rotate_now(reason)
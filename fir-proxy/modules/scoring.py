@@ -0,0 +1,240 @@
+# modules/scoring.py
+
+import math
+import threading
+import time
+
+try:
+    import numpy as np
+except ImportError:     # 没有 numpy 时使用逐个计算的纯 Python 实现, 结果相同
+    np = None
+
+# 匿名度加分
+ANONYMITY_BONUS = {'Elite': 50, 'Anonymous': 20}
+# 延迟下限 (秒), 避免除零
+MIN_LATENCY = 0.001
+
+
+def base_score(latency, speed, anonymity) -> float:
+    """单次验证结果的分数: 1/延迟*50 + 速度*10 + 匿名度加分."""
+    score = 0.0
+    if latency != float('inf'):
+        score += (1 / max(latency, MIN_LATENCY)) * 50
+    score += (speed or 0) * 10
+    return score + ANONYMITY_BONUS.get(anonymity, 0)
+
+
+class ScoringEngine:
+    """
+    基于历史验证结果的代理评分.
+    每个代理保留最近 window 次验证样本, 样本权重按 half_life 秒半衰; 分数为
+        加权成功率 * (50 / (延迟均值 + k*延迟标准差) + 10 * max(速度均值 - k*速度标准差, 0) + 匿名度加分),
+    k 为 variance_weight; 再乘以 0.5 ** (最近一次验证距今 / stale_half_life), 长时间未重新验证的代理逐渐排到后面.
+    刚验证且只有一个样本时与 base_score 相同.
+    样本按 (代理, 样本序号) 存放在二维数组中, rescore 用 numpy 一次计算全部代理的分数.
+    """
+    def __init__(self, window=8, half_life=6 * 3600, stale_half_life=24 * 3600, variance_weight=1.0, min_change=0.01):
+        self.window = window
+        self.half_life = half_life
+        self.stale_half_life = stale_half_life
+        self.variance_weight = variance_weight
+        self.min_change = min_change        # 分数相对变化小于该值时 rescore 不再输出
+        self._rows = {}                     # 地址 -> 行号
+        self._addresses = []                # 行号 -> 地址 (空闲行为 None)
+        self._free = []
+        self._capacity = 0
+        self._next = []                     # 每行下一个写入的样本位置
+        # 样本 (行 x window, 空样本的时间为 -inf) 和每行的匿名度加分、上次输出的分数 (NaN 表示未输出)、是否在用;
+        # 有 numpy 时为数组, 否则为列表
+        self._times = self._latency = self._speed = self._ok = None
+        self._bonus = self._applied = self._active = None
+        self._lock = threading.Lock()
+        self._grow(1024)
+
+    def _grow(self, capacity):
+        extra = capacity - self._capacity
+        arrays = (  # 属性名, 初始值, 是否每个样本一列
+            ('_times', -math.inf, True), ('_latency', 0.0, True), ('_speed', 0.0, True), ('_ok', 0.0, True),
+            ('_bonus', 0.0, False), ('_applied', math.nan, False), ('_active', False, False),
+        )
+        for name, value, per_sample in arrays:
+            old = getattr(self, name)
+            if np is not None:
+                block = np.full((extra, self.window) if per_sample else extra, value,
+                                dtype=bool if value is False else np.float64)
+                setattr(self, name, block if old is None else np.concatenate((old, block)))
+            else:
+                if old is None:
+                    old = []
+                    setattr(self, name, old)
+                old.extend(([value] * self.window for _ in range(extra)) if per_sample else [value] * extra)
+        self._addresses.extend([None] * extra)
+        self._next.extend([0] * extra)
+        self._free.extend(range(capacity - 1, self._capacity - 1, -1))
+        self._capacity = capacity
+
+    def _row(self, address):
+        row = self._rows.get(address)
+        if row is None:
+            if not self._free:
+                self._grow(self._capacity * 2)
+            row = self._rows[address] = self._free.pop()
+            self._addresses[row] = address
+            self._active[row] = True
+        return row
+
+    def observe(self, address, ok, latency=None, speed=None, anonymity=None, checked=None) -> float:
+        """记录一次验证结果, 返回该代理的最新分数."""
+        checked = checked if checked is not None else time.time()
+        with self._lock:
+            row = self._row(address)
+            slot = self._next[row]
+            self._next[row] = (slot + 1) % self.window
+            usable = ok and latency is not None and latency != float('inf')
+            self._times[row][slot] = checked
+            self._ok[row][slot] = 1.0 if usable else 0.0
+            self._latency[row][slot] = max(latency, MIN_LATENCY) if usable else 0.0
+            self._speed[row][slot] = (speed or 0.0) if usable else 0.0
+            if anonymity is not None:
+                self._bonus[row] = float(ANONYMITY_BONUS.get(anonymity, 0))
+            return float(self._score_row(row, time.time()))
+
+    def observe_result(self, result) -> float:
+        """记录验证器的一条结果 (dict 或 ProxyRecord), 返回分数."""
+        return self.observe(
+            result['proxy'], result.get('status') == 'Working', result.get('latency'), result.get('speed'),
+            result.get('anonymity'), result.get('checked'),
+        )
+
+    def seed(self, history: dict, anonymity=None):
+        """
+        从持久化的验证历史 {地址: [(时间, 状态, 延迟, 速度), ...]} 恢复样本.
+        anonymity 为可选的 地址 -> 匿名度 查询函数.
+        """
+        for address, entries in history.items():
+            level = anonymity(address) if anonymity is not None else None
+            for checked, status, latency, speed in entries[-self.window:]:
+                self.observe(address, status == 'Working', latency, speed, level, checked)
+
+    def forget(self, address):
+        with self._lock:
+            row = self._rows.pop(address, None)
+            if row is not None:
+                self._release(row)
+
+    def clear(self):
+        with self._lock:
+            for row in self._rows.values():
+                self._release(row)
+            self._rows.clear()
+
+    def _release(self, row):
+        self._addresses[row] = None
+        self._active[row] = False
+        self._applied[row] = math.nan
+        self._bonus[row] = 0.0
+        self._next[row] = 0
+        self._times[row][:] = [-math.inf] * self.window
+        self._ok[row][:] = [0.0] * self.window
+        self._free.append(row)
+
+    def attach(self, rotator):
+        """订阅轮换器: 代理被移除或清空时丢弃其样本."""
+        def on_event(event, address):
+            if event == 'removed':
+                self.forget(address)
+            elif event == 'cleared':
+                self.clear()
+        rotator.subscribe(on_event)
+
+    def score(self, address) -> float:
+        with self._lock:
+            row = self._rows.get(address)
+            return float(self._score_row(row, time.time())) if row is not None else 0.0
+
+    def _score_row(self, row, now):
+        weight_sum = ok_sum = lat_sum = spd_sum = 0.0
+        newest = -math.inf
+        samples = []
+        for checked, ok, latency, speed in zip(self._times[row], self._ok[row], self._latency[row], self._speed[row]):
+            if checked == -math.inf:    # 空样本
+                continue
+            newest = max(newest, checked)
+            weight = 0.5 ** (max(now - checked, 0.0) / self.half_life)
+            weight_sum += weight
+            if ok:
+                ok_sum += weight
+                lat_sum += weight * latency
+                spd_sum += weight * speed
+                samples.append((weight, latency, speed))
+        if not ok_sum:
+            return 0.0
+        lat_mean, spd_mean = lat_sum / ok_sum, spd_sum / ok_sum
+        lat_var = sum(w * (lat - lat_mean) ** 2 for w, lat, _ in samples) / ok_sum
+        spd_var = sum(w * (spd - spd_mean) ** 2 for w, _, spd in samples) / ok_sum
+        latency = max(lat_mean + self.variance_weight * math.sqrt(lat_var), MIN_LATENCY)
+        speed = max(spd_mean - self.variance_weight * math.sqrt(spd_var), 0.0)
+        freshness = 0.5 ** (max(now - newest, 0.0) / self.stale_half_life)
+        return ok_sum / weight_sum * freshness * (50 / latency + 10 * speed + self._bonus[row])
+
+    def _scores_numpy(self, now):
+        # 空样本的时间为 -inf, 权重为 0; 按行加权求和用 einsum, 加权方差按 E[x^2] - E[x]^2 计算, 减少临时数组
+        times = np.minimum(self._times, now)
+        weights = np.exp2((times - now) / self.half_life)
+        ok_weights = weights * self._ok
+        latency, speed = self._latency, self._speed
+        weight_sum = weights.sum(axis=1)
+        ok_sum = ok_weights.sum(axis=1)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            lat_mean = np.einsum('ij,ij->i', ok_weights, latency) / ok_sum
+            spd_mean = np.einsum('ij,ij->i', ok_weights, speed) / ok_sum
+            lat_var = np.maximum(np.einsum('ij,ij,ij->i', ok_weights, latency, latency) / ok_sum - lat_mean ** 2, 0.0)
+            spd_var = np.maximum(np.einsum('ij,ij,ij->i', ok_weights, speed, speed) / ok_sum - spd_mean ** 2, 0.0)
+            effective_latency = np.maximum(lat_mean + self.variance_weight * np.sqrt(lat_var), MIN_LATENCY)
+            effective_speed = np.maximum(spd_mean - self.variance_weight * np.sqrt(spd_var), 0.0)
+            freshness = np.exp2((times.max(axis=1) - now) / self.stale_half_life)
+            scores = ok_sum / weight_sum * freshness * (50 / effective_latency + 10 * effective_speed + self._bonus)
+        return np.where(ok_sum > 0, scores, 0.0)
+
+    def rescore(self, now=None, changed_only=True) -> dict:
+        """
+        按当前时间重新计算全部代理的分数, 返回 {地址: 分数}.
+        changed_only 时只返回与上次输出相比相对变化超过 min_change 的代理.
+        """
+        now = now if now is not None else time.time()
+        with self._lock:
+            if np is not None:
+                scores = self._scores_numpy(now)
+                changed = self._active.copy()
+                if changed_only:
+                    # 上次未输出 (NaN) 的比较结果为 False, 视为有变化
+                    changed &= ~(np.abs(scores - self._applied) <= self.min_change * np.abs(self._applied))
+                rows = np.flatnonzero(changed)
+                self._applied[rows] = scores[rows]
+                return dict(zip([self._addresses[row] for row in rows.tolist()], scores[rows].tolist()))
+            result = {}
+            for address, row in self._rows.items():
+                score, applied = self._score_row(row, now), self._applied[row]
+                if changed_only and abs(score - applied) <= self.min_change * abs(applied):
+                    continue
+                self._applied[row] = score
+                result[address] = score
+        return result
+
+    def rank(self, limit=None, now=None) -> list:
+        """按分数从高到低返回 [(地址, 分数)]."""
+        now = now if now is not None else time.time()
+        with self._lock:
+            if np is not None:
+                scores = self._scores_numpy(now)
+                rows = np.flatnonzero(self._active)
+                keys = -scores[rows]
+                if limit is not None and limit < len(rows):
+                    # 只对前 limit 个排序
+                    rows = rows[np.argpartition(keys, limit)[:limit]]
+                    keys = -scores[rows]
+                order = rows[np.argsort(keys, kind='stable')]
+                return [(self._addresses[row], float(scores[row])) for row in order.tolist()]
+            ranked = sorted(((address, self._score_row(row, now)) for address, row in self._rows.items()),
+                            key=lambda item: item[1], reverse=True)
+            return ranked[:limit] if limit is not None else ranked
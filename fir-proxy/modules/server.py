@@ -1,18 +1,80 @@
 # modules/server.py
 
+import queue
 import socket
 import threading
-import select
-import struct
-import socks 
-from urllib.parse import urlparse
+import time
+
+from .admission import ADMITTED, QUEUE_FULL, AdmissionLimiter
+from .affinity import AFFINITY_MODES, AffinityTable
+from .balancer import LoadBalancer
+from .breaker import CircuitBreaker
+from .httpproxy import error_response, http_proxy_session
+from .loghub import INFO, WARNING, emit, guess_level
+from .metrics import MetricsRegistry
+from .pool import UpstreamPool
+from .relay import relay_blocking, resolve_mode
+from .resolver import DNS_MODES, DnsError, DnsResolver, is_ip_address
+from .socks5 import (
+    CMD_CONNECT, CMD_UDP_ASSOCIATE, REP_COMMAND_NOT_SUPPORTED, REP_GENERAL_FAILURE, REP_SUCCEEDED,
+    Socks5Error, build_reply, relay_udp, run_socks5_handshake, socks5_handshake,
+)
+from .upstream import (
+    PROXY_TYPES, TargetUnreachable, connect_proxy, negotiate, run_handshake, socks5_udp_associate, split_address,
+)
+
+# 超出并发上限时发给客户端的拒绝响应
+REJECT_REPLIES = {
+    'http': error_response(503, 'Service Unavailable'),
+    'socks5': b"\x05\xff",     # 无可用的认证方法, 客户端会立即放弃
+}
+
 
 class ProxyServer:
     """HTTP/SOCKS5 代理服务."""
-    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue):
+    CONNECT_TIMEOUT = 10
+    KEEPALIVE_TIMEOUT = 60
+    THROUGHPUT_MIN_BYTES = 64 * 1024     # 下行少于该字节数的隧道不计入速率 (主要是空闲时间)
+
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue,
+                 relay_mode='auto', pool_size=8, balance=None, connect_deadline=15, max_attempts=3,
+                 race=1, reuse_port=False, metrics=None, max_tunnels=2048, max_pending_connects=256,
+                 queue_size=1024, queue_timeout=5.0, backlog=1024, socks5_auth=None,
+                 affinity=None, affinity_ttl=600, affinity_size=10000, dns_mode='remote'):
         self._rotator = rotator
         self._log_queue = log_queue
         self._running = False
+        self._relay_mode = resolve_mode(relay_mode)
+        self._pool = UpstreamPool(max_idle=pool_size, connect_timeout=self.CONNECT_TIMEOUT)
+        self._balancer = LoadBalancer(rotator)
+        self._balance = None
+        self.set_balance(balance)
+        self._breaker = CircuitBreaker()
+        self._connect_deadline = connect_deadline
+        self._max_attempts = max_attempts
+        self._race = max(1, race)
+        self._race_stats = {'races': 0, 'wins_by_rank': {}, 'cancelled': 0, 'all_failed': 0}
+        self._stats_lock = threading.Lock()
+        # 多进程模式下各进程以 SO_REUSEPORT 绑定同一端口, 由内核分配新连接
+        self._reuse_port = reuse_port
+        self._backlog = backlog
+        # 准入控制: 客户端连接 (每个连接同一时刻至多一条隧道) 和正在建立的上游连接, 0 表示不限制
+        self._tunnel_limiter = AdmissionLimiter(max_tunnels, queue_size, queue_timeout)
+        self._connect_limiter = AdmissionLimiter(max_pending_connects, queue_size, queue_timeout)
+        # SOCKS5 用户名/密码 {账号: 密码}, None 表示不要求认证
+        self._socks5_auth = socks5_auth
+        # 会话亲和: 同一客户端/用户名/目标主机在 affinity_ttl 内固定使用同一上游代理, None 表示关闭
+        if affinity is not None and affinity not in AFFINITY_MODES:
+            raise ValueError(f"未知的会话亲和模式: {affinity}")
+        self._affinity_mode = affinity
+        self._affinity = AffinityTable(max_entries=affinity_size, ttl=affinity_ttl)
+        rotator.subscribe(self._on_rotator_event)
+        self._init_metrics(metrics if metrics is not None else MetricsRegistry())
+        # 目标域名的解析方式, local 时在本机解析并缓存, 上游只收到IP
+        if dns_mode not in DNS_MODES:
+            raise ValueError(f"未知的域名解析方式: {dns_mode}")
+        self._dns_mode = dns_mode
+        self._resolver = DnsResolver(metrics=self._metrics)
 
         self._http_host = http_host
         self._http_port = http_port
@@ -24,14 +86,109 @@ class ProxyServer:
         self._socks5_server_socket = None
         self._socks5_thread = None
 
-    def log(self, message):
-        self._log_queue.put(f"[Server] {message}")
+    def log(self, message, level=None, category='server', **fields):
+        """写入日志; 每个连接都会产生的日志使用单独的分类, 以便日志中心对其采样和限速."""
+        if level is None:
+            level = guess_level(message)
+        emit(self._log_queue, level, category, f"[Server] {message}", **fields)
+
+    def _init_metrics(self, registry):
+        self._metrics = registry
+        self._m_clients = registry.counter(
+            'fir_proxy_client_connections_total', '接受的客户端连接数', ('listener',))
+        self._m_active = registry.gauge('fir_proxy_active_tunnels', '当前活动的上游隧道数')
+        self._m_upstream = registry.counter(
+            'fir_proxy_upstream_connects_total', '经各上游代理建立隧道的结果', ('upstream', 'result'))
+        self._m_bytes = registry.counter(
+            'fir_proxy_upstream_bytes_total', '经各上游代理转发的字节数', ('upstream', 'direction'))
+        self._m_connect = registry.histogram(
+            'fir_proxy_upstream_connect_seconds', '与上游代理建立TCP连接的耗时', ('protocol',))
+        self._m_handshake = registry.histogram(
+            'fir_proxy_upstream_handshake_seconds', '与上游代理完成协议握手的耗时', ('protocol',))
+        self._m_rejected = registry.counter(
+            'fir_proxy_admission_rejected_total', '因超出并发上限被拒绝的请求数', ('stage', 'reason'))
+        self._m_affinity = registry.counter('fir_proxy_affinity_lookups_total', '会话亲和表查询结果', ('result',))
+
+    def _record_tunnel(self, addr, sent, received, duration):
+        """隧道结束时记录字节数并上报给轮换器, 传输量足够时同时上报下行速率."""
+        self._record_bytes(addr, sent, received)
+        if addr:
+            self._rotator.report_transfer(addr, sent + received)
+        if addr and received >= self.THROUGHPUT_MIN_BYTES:
+            self._rotator.report_throughput(addr, received, duration)
+
+    def _record_bytes(self, addr, sent, received):
+        """记录经上游转发的字节数 (sent: 客户端->上游, received: 上游->客户端)."""
+        if not addr:
+            return
+        if sent:
+            self._m_bytes.inc(sent, (addr, 'sent'))
+        if received:
+            self._m_bytes.inc(received, (addr, 'received'))
+
+    def set_balance(self, strategy=None):
+        """
+        设置负载均衡策略.
+        None 表示所有连接都使用轮换器的当前代理, 否则按连接在全部可用代理间分配.
+        """
+        if strategy is not None:
+            self._balancer.set_strategy(strategy)
+        self._balance = strategy
+
+    def get_stats(self) -> dict:
+        """导出服务运行统计."""
+        with self._stats_lock:
+            race_stats = dict(self._race_stats, wins_by_rank=dict(self._race_stats['wins_by_rank']))
+        return {
+            'active_connections': self._balancer.active_connections(),
+            'open_circuits': self._breaker.open_circuits(),
+            'pool': dict(self._pool.stats),
+            'race': race_stats,
+            'admission': {
+                'tunnels': self._tunnel_limiter.get_stats(),
+                'connects': self._connect_limiter.get_stats(),
+            },
+            'affinity': dict(self._affinity.stats, entries=len(self._affinity)),
+        }
+
+    def _on_rotator_event(self, event, proxy_address):
+        """代理从轮换器中移除时, 清理与之相关的亲和条目、空闲连接和熔断状态."""
+        if event == 'cleared':
+            self._affinity.clear()
+        elif event == 'removed':
+            self._affinity.forget_upstream(proxy_address)
+            self._pool.discard(proxy_address)
+            self._breaker.forget(proxy_address)
+
+    def _affinity_key(self, client_address, target_host, username=None, route=None):
+        """按配置的亲和模式生成亲和键, 未启用时返回 None."""
+        mode = self._affinity_mode
+        if mode is None:
+            return None
+        if mode == 'user' and username:
+            return ('user', username)
+        # 路由条件不同的请求不能共用同一上游
+        route = tuple(sorted(route.items())) if route else None
+        if mode == 'target':
+            return ('target', target_host.lower(), route)
+        return ('client', client_address, route)
+
+    def _sticky_upstream(self, affinity_key):
+        """返回亲和的上游代理 (地址, 协议), 无记录或该代理已熔断时返回 None."""
+        if affinity_key is None:
+            return None
+        upstream = self._affinity.get(affinity_key)
+        if upstream and not self._breaker.allow(upstream[0]):
+            upstream = None
+        self._m_affinity.inc(labels=('hit' if upstream else 'miss',))
+        return upstream
 
     def start_all(self):
         """启动HTTP和SOCKS5服务."""
         if self._running:
             return
         self._running = True
+        self._pool.start()
 
         self._http_thread = threading.Thread(target=self._run_http_server, daemon=True)
         self._http_thread.start()
@@ -46,26 +203,42 @@ class ProxyServer:
         self._running = False
         
         # 关闭服务端口以中断accept()
-        if self._http_server_socket:
-            self._http_server_socket.close()
-        if self._socks5_server_socket:
-            self._socks5_server_socket.close()
+        for server_socket in (self._http_server_socket, self._socks5_server_socket):
+            if server_socket:
+                try:
+                    # Linux下仅close()无法唤醒阻塞中的accept()
+                    server_socket.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+                server_socket.close()
 
         # 等待线程结束
         if self._http_thread and self._http_thread.is_alive():
             self._http_thread.join()
         if self._socks5_thread and self._socks5_thread.is_alive():
             self._socks5_thread.join()
-            
+
+        self._pool.close()
         self.log("所有代理服务已停止。")
 
+    def _create_listener(self, host, port):
+        """创建监听socket."""
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        try:
+            server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if self._reuse_port:
+                server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            server_socket.bind((host, port))
+            server_socket.listen(self._backlog)
+        except Exception:
+            server_socket.close()
+            raise
+        return server_socket
+
     def _run_http_server(self):
         """HTTP服务主循环."""
         try:
-            self._http_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._http_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._http_server_socket.bind((self._http_host, self._http_port))
-            self._http_server_socket.listen(20)
+            self._http_server_socket = self._create_listener(self._http_host, self._http_port)
             self.log(f"HTTP 代理服务接口已启动于 {self._http_host}:{self._http_port}")
         except Exception as e:
             self.log(f"[!] 启动 HTTP 服务失败: {e}")
@@ -74,7 +247,14 @@ class ProxyServer:
         while self._running:
             try:
                 client_socket, _ = self._http_server_socket.accept()
-                handler = threading.Thread(target=self._handle_http_client, args=(client_socket,), daemon=True)
+                self._m_clients.inc(labels=('http',))
+                if self._tunnel_limiter.saturated():
+                    # 并发和等待队列均已满, 不再创建线程, 直接拒绝
+                    self._reject_client(client_socket, 'http', QUEUE_FULL)
+                    continue
+                handler = threading.Thread(
+                    target=self._admit_client, args=(self._handle_http_client, client_socket, 'http'), daemon=True
+                )
                 handler.start()
             except OSError:
                 # 关闭socket时会产生OSError, 正常退出
@@ -84,10 +264,7 @@ class ProxyServer:
     def _run_socks5_server(self):
         """SOCKS5服务主循环."""
         try:
-            self._socks5_server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self._socks5_server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self._socks5_server_socket.bind((self._socks5_host, self._socks5_port))
-            self._socks5_server_socket.listen(20)
+            self._socks5_server_socket = self._create_listener(self._socks5_host, self._socks5_port)
             self.log(f"SOCKS5 代理服务接口已启动于 {self._socks5_host}:{self._socks5_port}")
         except Exception as e:
             self.log(f"[!] 启动 SOCKS5 服务失败: {e}")
@@ -96,17 +273,65 @@ class ProxyServer:
         while self._running:
             try:
                 client_socket, _ = self._socks5_server_socket.accept()
-                handler = threading.Thread(target=self._handle_socks5_client, args=(client_socket,), daemon=True)
+                self._m_clients.inc(labels=('socks5',))
+                if self._tunnel_limiter.saturated():
+                    # 并发和等待队列均已满, 不再创建线程, 直接拒绝
+                    self._reject_client(client_socket, 'socks5', QUEUE_FULL)
+                    continue
+                handler = threading.Thread(
+                    target=self._admit_client, args=(self._handle_socks5_client, client_socket, 'socks5'), daemon=True
+                )
                 handler.start()
             except OSError:
                 break
         self.log("SOCKS5 代理服务循环已退出。")
-        
-    def _get_upstream_connection(self, target_host, target_port):
-        """通过上游代理连接目标."""
-        upstream_proxy_info = self._rotator.get_current_proxy()
+
+    def _admit_client(self, handler, client_socket, listener):
+        """在准入控制下处理客户端连接, 超出并发上限时排队等待, 队列满或超时则拒绝."""
+        result = self._tunnel_limiter.acquire()
+        if result != ADMITTED:
+            self._reject_client(client_socket, listener, result)
+            return
+        try:
+            handler(client_socket)
+        finally:
+            self._tunnel_limiter.release()
+
+    def _reject_client(self, client_socket, listener, reason):
+        """以对应协议的方式快速拒绝客户端, 不等待对端."""
+        self._m_rejected.inc(labels=('client', reason))
+        try:
+            client_socket.setblocking(False)
+            client_socket.send(REJECT_REPLIES[listener])
+        except OSError:
+            pass
+        finally:
+            client_socket.close()
+
+    def _select_upstream(self, exclude=(), route=None):
+        """
+        选择上游代理, 返回 (地址, 协议) 或 None. exclude 为本次已尝试过的代理.
+        route 为客户端指定的路由 (如 SOCKS5 用户名中的地区), 指定时在符合条件的代理间负载均衡, 不使用全局当前代理.
+        路由只受自身参数约束: 指定的地区没有代理时不退回其他地区, 未要求优质时不受界面的优质筛选影响.
+        """
+        if self._balance or route:
+            region = premium_only = None
+            if route:
+                region = route.get('region', "All")
+                premium_only = route.get('premium_only', False)
+            upstream_proxy_info = self._balancer.pick(
+                exclude, allow=self._breaker.allow, region=region, premium_only=premium_only,
+            )
+        else:
+            upstream_proxy_info = self._rotator.get_current_proxy()
+            if (not upstream_proxy_info or upstream_proxy_info.get('proxy') in exclude
+                    or not self._breaker.allow(upstream_proxy_info.get('proxy'))):
+                upstream_proxy_info = self._failover_candidate(exclude)
         if not upstream_proxy_info:
-            self.log("[!] 代理池为空，无法转发请求。")
+            if not exclude and route:
+                self.log(f"[!] 没有符合路由 {route} 的可用代理，拒绝请求。")
+            elif not exclude:
+                self.log("[!] 代理池为空或所有代理均已熔断，无法转发请求。")
             return None
 
         # 安全地获取代理信息
@@ -117,114 +342,387 @@ class ProxyServer:
             self.log(f"[!] 代理信息格式不正确: {upstream_proxy_info}")
             return None
 
-        upstream_addr, upstream_port_str = addr.split(':')
-        
-        proxy_type_map = {'HTTP': socks.HTTP, 'SOCKS4': socks.SOCKS4, 'SOCKS5': socks.SOCKS5}
-        upstream_protocol = proxy_type_map.get(proto.upper())
-
-        if not upstream_protocol:
+        if proto.upper() not in PROXY_TYPES:
             self.log(f"[!] 不支持的上游代理协议: {proto}")
             return None
-        
-        remote_socket = socks.socksocket()
-        try:
-            remote_socket.set_proxy(proxy_type=upstream_protocol, addr=upstream_addr, port=int(upstream_port_str))
-            remote_socket.connect((target_host, target_port))
-            self.log(f"通过 {addr} 连接到 {target_host}:{target_port}")
-            return remote_socket
-        except Exception as e:
-            self.log(f"[!] 上游代理 {addr} 错误: {e}")
-            remote_socket.close()
-            return None
+        return addr, proto.upper()
 
-    def _handle_http_client(self, client_socket):
-        """处理HTTP客户端请求."""
-        remote_socket = None
+    def _failover_candidate(self, exclude):
+        """当前代理不可用时, 选择实时分数最高的未熔断候选代理."""
+        candidates = [
+            p for p in self._rotator.get_candidates()
+            if p.get('proxy') not in exclude and self._breaker.allow(p.get('proxy'))
+        ]
+        return max(candidates, key=self._rotator.effective_score, default=None)
+
+    def _on_connect_success(self, addr, target_host, target_port, latency=None):
+        """经 addr 的连接将被实际使用: 每个客户端请求只调用一次 (竞速中只有胜出者), 握手耗时计入健康度."""
+        self._rotator.report_success(addr, latency)
+        self._breaker.record_success(addr)
+        self._balancer.acquire(addr)
+        self._m_upstream.inc(labels=(addr, 'accepted'))
+        self._m_active.inc()
+        self.log(f"通过 {addr} 连接到 {target_host}:{target_port}", INFO, 'tunnel',
+                 upstream=addr, target=f"{target_host}:{target_port}")
+
+    def _on_connect_failure(self, addr, error):
+        self.log(f"[!] 上游代理 {addr} 错误: {error}", WARNING, 'upstream', upstream=addr)
+        self._rotator.report_failure(addr)
+        self._m_upstream.inc(labels=(addr, 'failed'))
+        backoff = self._breaker.record_failure(addr)
+        if backoff:
+            self._pool.discard(addr)
+            self.log(f"[!] 上游代理 {addr} 连续失败, 熔断 {backoff:.0f} 秒。")
+
+    def _open_tunnel(self, addr, proto, target_host, target_port, timeout):
+        """经指定上游建立隧道, 优先使用连接池中的预建连接."""
+        return self._open_upstream(addr, proto, timeout, lambda greeted: negotiate(proto, target_host, target_port, greeted))
+
+    def _open_upstream(self, addr, proto, timeout, make_steps):
+        """连接上游并执行 make_steps(greeted) 返回的握手步骤, 返回 (socket, 握手结果, 握手耗时)."""
+        pooled = self._pool.take(addr, proto)
+        if pooled:
+            remote_socket, greeted = pooled
+        else:
+            start = time.monotonic()
+            remote_socket, greeted = connect_proxy(addr, timeout), False
+            elapsed = time.monotonic() - start
+            self._pool.record_connect_latency(addr, elapsed)
+            self._m_connect.observe(elapsed, (proto,))
         try:
-            request_data = client_socket.recv(8192)
-            if not request_data:
-                return
+            remote_socket.settimeout(timeout)
+            start = time.monotonic()
+            result = run_handshake(remote_socket, make_steps(greeted))
+            elapsed = time.monotonic() - start
+            self._m_handshake.observe(elapsed, (proto,))
+            remote_socket.settimeout(None)
+        except BaseException:
+            remote_socket.close()
+            raise
+        return remote_socket, result, elapsed
 
-            first_line = request_data.split(b'\r\n')[0].decode('utf-8', 'ignore')
-            method, url, _ = first_line.split()
+    def _next_batch(self, tried, size, route=None, affinity_key=None):
+        """
+        为下一轮连接选择至多 size 个尚未尝试过的上游代理.
+        第一轮优先且只尝试亲和的上游, 避免竞速连接更换出口IP.
+        """
+        if not tried:
+            sticky = self._sticky_upstream(affinity_key)
+            if sticky and self._breaker.acquire(sticky[0]):
+                return [sticky]
+        batch = []
+        exclude = list(tried)
+        while len(batch) < size:
+            upstream = self._select_upstream(exclude=exclude, route=route)
+            if not upstream:
+                break
+            exclude.append(upstream[0])
+            # 半开的代理已被其他连接占用试探时跳过
+            if self._breaker.acquire(upstream[0]):
+                batch.append(upstream)
+        return batch
 
-            if method == 'CONNECT':
-                target_host, target_port_str = url.split(':')
-                target_port = int(target_port_str)
+    def _record_race(self, winner_rank=None, cancelled=0):
+        with self._stats_lock:
+            stats = self._race_stats
+            stats['races'] += 1
+            stats['cancelled'] += cancelled
+            if winner_rank is None:
+                stats['all_failed'] += 1
             else:
-                parsed_url = urlparse(url)
-                target_host = parsed_url.hostname
-                target_port = parsed_url.port or 80
+                stats['wins_by_rank'][winner_rank] = stats['wins_by_rank'].get(winner_rank, 0) + 1
 
-            remote_socket = self._get_upstream_connection(target_host, target_port)
-            if not remote_socket:
-                return
+    def _race_tunnels(self, batch, target_host, target_port, timeout):
+        """
+        同时经多个上游建立隧道, 保留最先完成握手的一个, 其余在完成后立即关闭.
+        返回 (上游地址, socket, 多读数据, 握手耗时) 或 None.
+        """
+        results = queue.Queue()
+        lock = threading.Lock()
+        state = {'winner': None}
 
-            if method == 'CONNECT':
-                client_socket.sendall(b'HTTP/1.1 200 Connection Established\r\n\r\n')
+        def attempt(rank, addr, proto):
+            try:
+                tunnel = self._open_tunnel(addr, proto, target_host, target_port, timeout)
+            except Exception as e:
+                if not isinstance(e, TargetUnreachable):
+                    self._on_connect_failure(addr, e)
+                results.put((rank, addr, None, e))
+                return
+            with lock:
+                lost = state['winner'] is not None
+                if not lost:
+                    state['winner'] = rank
+            if lost:
+                tunnel[0].close()
             else:
-                remote_socket.sendall(request_data)
+                results.put((rank, addr, tunnel, None))
+
+        for rank, (addr, proto) in enumerate(batch):
+            threading.Thread(target=attempt, args=(rank, addr, proto), daemon=True).start()
 
-            self._forward_data(client_socket, remote_socket)
+        target_error = None
+        failed = 0
+        deadline = time.monotonic() + timeout + 1
+        for _ in batch:
+            try:
+                rank, addr, tunnel, error = results.get(timeout=max(0, deadline - time.monotonic()))
+            except queue.Empty:
+                break
+            if tunnel:
+                self._record_race(rank, len(batch) - 1 - failed)
+                return (addr,) + tunnel
+            failed += 1
+            if isinstance(error, TargetUnreachable):
+                target_error = error
+
+        with lock:
+            late_winner = state['winner']
+            if late_winner is None:
+                state['winner'] = -1
+        if late_winner is not None:
+            # 放弃等待的同时恰好有代理握手成功
+            while True:
+                rank, addr, tunnel, _ = results.get()
+                if tunnel:
+                    self._record_race(rank, len(batch) - 1 - failed)
+                    return (addr,) + tunnel
+                failed += 1
+        self._record_race(None)
+        if target_error:
+            raise target_error
+        return None
+
+    def _get_upstream_connection(self, target_host, target_port, route=None, affinity_key=None):
+        """
+        通过上游代理连接目标, 返回 (socket, 多读数据, 上游地址) 或 None.
+        正在建立的上游连接数超出上限时先排队等待.
+        """
+        if self._dns_mode == 'local' and not is_ip_address(target_host):
+            try:
+                target_host = self._resolver.resolve(target_host)
+            except DnsError as e:
+                self.log(f"[!] {e}", WARNING, 'tunnel', target=f"{target_host}:{target_port}")
+                return None
+        deadline = time.monotonic() + self._connect_deadline
+        result = self._connect_limiter.acquire(min(self._connect_limiter.queue_timeout, self._connect_deadline))
+        if result != ADMITTED:
+            self._m_rejected.inc(labels=('connect', result))
+            return None
+        try:
+            return self._try_upstreams(target_host, target_port, deadline, route, affinity_key)
+        finally:
+            self._connect_limiter.release()
+
+    def _try_upstreams(self, target_host, target_port, deadline, route=None, affinity_key=None):
+        """失败时在 deadline 前依次尝试其他候选代理; race > 1 时每轮同时尝试多个代理."""
+        limit = max(self._max_attempts, self._race)
+        tried = []
+        while len(tried) < limit:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            batch = self._next_batch(tried, min(self._race, limit - len(tried)), route, affinity_key)
+            if not batch:
+                break
+            tried.extend(addr for addr, _ in batch)
+            timeout = min(self.CONNECT_TIMEOUT, remaining)
+            try:
+                if len(batch) == 1:
+                    addr, proto = batch[0]
+                    try:
+                        remote_socket, leftover, latency = self._open_tunnel(
+                            addr, proto, target_host, target_port, timeout
+                        )
+                    except TargetUnreachable:
+                        raise
+                    except Exception as e:
+                        self._on_connect_failure(addr, e)
+                        continue
+                else:
+                    winner = self._race_tunnels(batch, target_host, target_port, timeout)
+                    if not winner:
+                        continue
+                    addr, remote_socket, leftover, latency = winner
+            except TargetUnreachable as e:
+                self.log(f"[!] 目标 {target_host}:{target_port} 不可达: {e}", WARNING, 'tunnel',
+                         target=f"{target_host}:{target_port}")
+                return None
+            self._on_connect_success(addr, target_host, target_port, latency)
+            if affinity_key is not None:
+                self._affinity.set(affinity_key, (addr, dict(batch)[addr]))
+            return remote_socket, leftover, addr
+        if tried:
+            self.log(f"[!] 已尝试 {len(tried)} 个上游代理, 均无法连接 {target_host}:{target_port}", WARNING,
+                     'tunnel', target=f"{target_host}:{target_port}")
+        return None
+
+    def _release_upstream(self, addr):
+        """隧道关闭后释放上游代理的活动连接计数."""
+        self._balancer.release(addr)
+        self._m_active.dec()
+
+    def _handle_http_client(self, client_socket):
+        """处理HTTP客户端连接, 支持持久连接上的多个请求."""
+        remote_socket = upstream_addr = None
+        session = http_proxy_session()
+        reply = None
+        try:
+            client_address = client_socket.getpeername()[0]
+            client_socket.settimeout(self.KEEPALIVE_TIMEOUT)
+            while True:
+                op = session.send(reply)
+                reply = None
+                kind = op[0]
+                if kind == 'client_recv':
+                    reply = client_socket.recv(65536)
+                elif kind == 'client_send':
+                    client_socket.sendall(op[1])
+                elif kind == 'upstream_recv':
+                    # 连接被上游重置时视为关闭, 由会话决定是否在新连接上重发
+                    try:
+                        reply = remote_socket.recv(65536)
+                    except ConnectionError:
+                        reply = b''
+                    self._record_bytes(upstream_addr, 0, len(reply))
+                elif kind == 'upstream_send':
+                    try:
+                        remote_socket.sendall(op[1])
+                        reply = True
+                    except ConnectionError:
+                        reply = False
+                    else:
+                        self._record_bytes(upstream_addr, len(op[1]), 0)
+                elif kind in ('open', 'close_upstream'):
+                    if remote_socket:
+                        remote_socket.close()
+                        self._release_upstream(upstream_addr)
+                        remote_socket = upstream_addr = None
+                    if kind == 'open':
+                        upstream = self._get_upstream_connection(
+                            op[1], op[2], affinity_key=self._affinity_key(client_address, op[1])
+                        )
+                        if upstream:
+                            remote_socket, reply, upstream_addr = upstream
+                            remote_socket.settimeout(self.KEEPALIVE_TIMEOUT)
+                else:
+                    # 隧道模式下由 select 控制超时
+                    client_socket.settimeout(None)
+                    remote_socket.settimeout(None)
+                    self._forward_data(client_socket, remote_socket, upstream_addr)
+        except StopIteration:
+            pass
         except Exception as e:
             # 忽略常见的连接断开错误
             if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
                  self.log(f"处理 HTTP 请求时出错: {e}")
         finally:
-            if remote_socket: remote_socket.close()
+            if remote_socket:
+                remote_socket.close()
+                self._release_upstream(upstream_addr)
             if client_socket: client_socket.close()
 
     def _handle_socks5_client(self, client_socket):
         """处理SOCKS5客户端请求."""
-        remote_socket = None
+        remote_socket = upstream_addr = None
         try:
-            data = client_socket.recv(2)
-            if not data or data[0] != 5: return
-            nmethods = data[1]
-            client_socket.recv(nmethods)
-            client_socket.sendall(b"\x05\x00")
-
-            data = client_socket.recv(4)
-            if not data or data[0] != 5 or data[1] != 1: return
-            
-            atyp = data[3]
-            if atyp == 1: # IPv4
-                addr = socket.inet_ntoa(client_socket.recv(4))
-            elif atyp == 3: # Domain
-                domain_len = client_socket.recv(1)[0]
-                addr = client_socket.recv(domain_len).decode('utf-8')
-            else:
-                # 暂不支持IPv6
+            client_socket.settimeout(self.CONNECT_TIMEOUT)
+            request = run_socks5_handshake(client_socket, socks5_handshake(self._socks5_auth))
+            if not request:
+                return
+            if request.command == CMD_UDP_ASSOCIATE:
+                self._udp_associate(client_socket, request)
+                return
+            if request.command != CMD_CONNECT:
+                client_socket.sendall(build_reply(REP_COMMAND_NOT_SUPPORTED))
                 return
-            
-            port = struct.unpack('!H', client_socket.recv(2))[0]
 
-            remote_socket = self._get_upstream_connection(addr, port)
-            if not remote_socket:
+            affinity_key = self._affinity_key(
+                client_socket.getpeername()[0], request.host, request.username, request.route
+            )
+            upstream = self._get_upstream_connection(request.host, request.port, request.route, affinity_key)
+            if not upstream:
+                client_socket.sendall(build_reply(REP_GENERAL_FAILURE))
                 return
+            remote_socket, leftover, upstream_addr = upstream
 
-            client_socket.sendall(b"\x05\x00\x00\x01\x00\x00\x00\x00\x00\x00")
+            client_socket.settimeout(None)
+            client_socket.sendall(build_reply(REP_SUCCEEDED))
+            if request.leftover:
+                remote_socket.sendall(request.leftover)
+                self._record_bytes(upstream_addr, len(request.leftover), 0)
+            if leftover:
+                client_socket.sendall(leftover)
 
-            self._forward_data(client_socket, remote_socket)
+            self._forward_data(client_socket, remote_socket, upstream_addr)
         except Exception as e:
-            if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError)):
+            if not isinstance(e, (ConnectionResetError, BrokenPipeError, OSError, Socks5Error)):
                 self.log(f"处理 SOCKS5 请求时出错: {e}")
         finally:
-            if remote_socket: remote_socket.close()
+            if remote_socket:
+                remote_socket.close()
+                self._release_upstream(upstream_addr)
             if client_socket: client_socket.close()
 
-    def _forward_data(self, sock1, sock2):
-        """双向转发数据."""
-        while self._running:
+    def _open_udp_association(self, route=None):
+        """
+        在支持UDP的SOCKS5上游代理上建立 UDP ASSOCIATE, 返回 (控制socket, UDP中继地址, 上游地址) 或 None.
+        HTTP/SOCKS4 上游无法转发UDP, 会被跳过.
+        """
+        tried = []
+        attempts = 0
+        while attempts < self._max_attempts:
+            upstream = self._select_upstream(exclude=tried, route=route)
+            if not upstream:
+                break
+            addr, proto = upstream
+            tried.append(addr)
+            if proto != 'SOCKS5' or not self._breaker.acquire(addr):
+                continue
+            attempts += 1
             try:
-                readable, _, exceptional = select.select([sock1, sock2], [], [sock1, sock2], 5)
-                if exceptional or not readable:
-                    break
-                for sock in readable:
-                    other_sock = sock2 if sock is sock1 else sock1
-                    data = sock.recv(8192)
-                    if not data:
-                        return
-                    other_sock.sendall(data)
-            except (ConnectionResetError, BrokenPipeError, OSError, select.error):
-                break
\ No newline at end of file
+                control, relay, latency = self._open_upstream(
+                    addr, proto, self.CONNECT_TIMEOUT, lambda greeted: socks5_udp_associate(greeted)
+                )
+            except Exception as e:
+                self._on_connect_failure(addr, e)
+                continue
+            relay_host, relay_port = relay
+            if relay_host in ('0.0.0.0', '::'):
+                # 上游未指定中继地址时使用代理本身的地址
+                relay_host = split_address(addr)[0]
+            self._on_connect_success(addr, 'UDP', relay_port, latency)
+            return control, (relay_host, relay_port), addr
+        self.log("[!] 没有可用的 SOCKS5 上游代理转发 UDP。")
+        return None
+
+    def _udp_associate(self, client_socket, request):
+        """处理 UDP ASSOCIATE: 经 SOCKS5 上游代理中继数据报, 直至控制连接关闭."""
+        association = self._open_udp_association(request.route)
+        if not association:
+            client_socket.sendall(build_reply(REP_GENERAL_FAILURE))
+            return
+        control, relay, upstream_addr = association
+        local_host = client_socket.getsockname()[0]
+        client_udp = socket.socket(socket.AF_INET6 if ':' in local_host else socket.AF_INET, socket.SOCK_DGRAM)
+        upstream_udp = socket.socket(socket.AF_INET6 if ':' in relay[0] else socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            client_udp.bind((local_host, 0))
+            client_socket.sendall(build_reply(REP_SUCCEEDED, local_host, client_udp.getsockname()[1]))
+            client_socket.settimeout(None)
+            sent, received = relay_udp(
+                [client_socket, control], client_udp, upstream_udp, relay,
+                client_socket.getpeername()[0], request.port, lambda: self._running,
+            )
+            self._record_bytes(upstream_addr, sent, received)
+        finally:
+            client_udp.close()
+            upstream_udp.close()
+            control.close()
+            self._release_upstream(upstream_addr)
+
+    def _forward_data(self, client_socket, remote_socket, upstream_addr=None):
+        """双向转发数据."""
+        start = time.monotonic()
+        sent, received = relay_blocking(client_socket, remote_socket, self._relay_mode, lambda: self._running)
+        self._record_tunnel(upstream_addr, sent, received, time.monotonic() - start)
\ No newline at end of file
@@ -0,0 +1,208 @@
+# modules/socks5.py
+
+import select
+import socket
+import struct
+
+from .upstream import pack_socks5_address
+
+# 认证方法
+METHOD_NO_AUTH = 0x00
+METHOD_USERPASS = 0x02
+METHOD_NOT_ACCEPTABLE = 0xFF
+
+# 请求命令
+CMD_CONNECT = 0x01
+CMD_BIND = 0x02
+CMD_UDP_ASSOCIATE = 0x03
+
+# 应答码
+REP_SUCCEEDED = 0x00
+REP_GENERAL_FAILURE = 0x01
+REP_HOST_UNREACHABLE = 0x04
+REP_COMMAND_NOT_SUPPORTED = 0x07
+REP_ADDRESS_NOT_SUPPORTED = 0x08
+
+RECV_SIZE = 4096
+
+
+class Socks5Error(Exception):
+    """SOCKS5 客户端握手格式错误."""
+
+
+class Socks5Request:
+    """客户端完成握手后的 SOCKS5 请求."""
+    def __init__(self, command, host, port, username=None, route=None, leftover=b''):
+        self.command = command
+        self.host = host
+        self.port = port
+        self.username = username
+        self.route = route          # 由用户名解析出的路由参数, 无则为 None
+        self.leftover = leftover    # 客户端紧随请求发送的数据
+
+
+def parse_username(username: str):
+    """
+    解析用户名中的路由参数, 返回 (账号, 路由字典或 None).
+    用户名以 '-' 分隔, 如 'alice-region-US-premium':
+        region-<地区>  只使用该地区的代理
+        premium        只使用优质代理
+    第一个路由参数之前的部分为账号名, 无法识别的参数将被忽略.
+    """
+    parts = username.split('-')
+    account = []
+    route = {}
+    index = 0
+    while index < len(parts):
+        part = parts[index].lower()
+        if part == 'region' and index + 1 < len(parts):
+            region = parts[index + 1]
+            if region.lower() == 'all':
+                region = 'All'
+            elif len(region) == 2:
+                region = region.upper()
+            route['region'] = region
+            index += 2
+            continue
+        if part == 'premium':
+            route['premium_only'] = True
+        elif not route:
+            account.append(parts[index])
+        index += 1
+    return '-'.join(account), route or None
+
+
+def build_reply(code, host='0.0.0.0', port=0) -> bytes:
+    return b'\x05' + bytes([code, 0]) + pack_socks5_address(host, port)
+
+
+def socks5_handshake(credentials=None):
+    """
+    SOCKS5 服务端握手 (RFC 1928 / RFC 1929), 不涉及IO.
+    生成器产出 ('recv',) -> bytes (空表示客户端关闭) 和 ('send', data) 操作,
+    所有读取共用一个缓冲区, 客户端一次发送的多个报文只需一次 recv.
+    credentials 为 {账号: 密码}, 为 None 时不要求认证, 但客户端提供的用户名仍用于路由.
+    握手成功返回 Socks5Request; 已向客户端回复拒绝时返回 None.
+    """
+    buffer = bytearray()
+
+    def read(size):
+        while len(buffer) < size:
+            data = yield ('recv',)
+            if not data:
+                raise Socks5Error("客户端在握手期间关闭了连接")
+            buffer.extend(data)
+        chunk = bytes(buffer[:size])
+        del buffer[:size]
+        return chunk
+
+    version, nmethods = yield from read(2)
+    if version != 5:
+        raise Socks5Error(f"不支持的SOCKS版本: {version}")
+    methods = yield from read(nmethods)
+    # 客户端提供用户名时优先使用, 以便按用户名路由
+    if METHOD_USERPASS in methods:
+        method = METHOD_USERPASS
+    elif credentials is None and METHOD_NO_AUTH in methods:
+        method = METHOD_NO_AUTH
+    else:
+        yield ('send', bytes([5, METHOD_NOT_ACCEPTABLE]))
+        return None
+    yield ('send', bytes([5, method]))
+
+    username = route = None
+    if method == METHOD_USERPASS:
+        version, length = yield from read(2)
+        if version != 1:
+            raise Socks5Error(f"不支持的认证协议版本: {version}")
+        username = (yield from read(length)).decode('utf-8', 'replace')
+        length = (yield from read(1))[0]
+        password = (yield from read(length)).decode('utf-8', 'replace')
+        account, route = parse_username(username)
+        if credentials is not None and credentials.get(account) != password:
+            yield ('send', b'\x01\x01')
+            return None
+        yield ('send', b'\x01\x00')
+
+    version, command, _, atyp = yield from read(4)
+    if version != 5:
+        raise Socks5Error(f"不支持的SOCKS版本: {version}")
+    if atyp == 1:
+        host = socket.inet_ntoa((yield from read(4)))
+    elif atyp == 3:
+        length = (yield from read(1))[0]
+        host = (yield from read(length)).decode('utf-8')
+    elif atyp == 4:
+        host = socket.inet_ntop(socket.AF_INET6, (yield from read(16)))
+    else:
+        yield ('send', build_reply(REP_ADDRESS_NOT_SUPPORTED))
+        return None
+    port = struct.unpack('!H', (yield from read(2)))[0]
+    return Socks5Request(command, host, port, username, route, bytes(buffer))
+
+
+def run_socks5_handshake(sock, steps):
+    """在阻塞socket上执行服务端握手."""
+    reply = None
+    try:
+        while True:
+            op = steps.send(reply)
+            if op[0] == 'recv':
+                reply = sock.recv(RECV_SIZE)
+            else:
+                sock.sendall(op[1])
+                reply = None
+    except StopIteration as stop:
+        return stop.value
+
+
+async def run_socks5_handshake_async(loop, sock, steps):
+    """在非阻塞socket上通过事件循环执行服务端握手."""
+    reply = None
+    try:
+        while True:
+            op = steps.send(reply)
+            if op[0] == 'recv':
+                reply = await loop.sock_recv(sock, RECV_SIZE)
+            else:
+                await loop.sock_sendall(sock, op[1])
+                reply = None
+    except StopIteration as stop:
+        return stop.value
+
+
+def relay_udp(control_sockets, client_udp, upstream_udp, upstream_relay, client_host, client_port=0,
+              is_running=lambda: True):
+    """
+    在客户端和上游代理的UDP中继之间转发数据报, 任一控制连接关闭时返回.
+    客户端与上游使用相同的 SOCKS5 UDP 报头格式, 数据报原样转发; 不支持分片 (FRAG != 0 的数据报被丢弃).
+    只接受来自 client_host (及 client_port, 非0时) 的数据报.
+    返回 (发往上游的字节数, 发回客户端的字节数).
+    """
+    client_addr = (client_host, client_port) if client_port else None
+    sent = received = 0
+    sockets = list(control_sockets) + [client_udp, upstream_udp]
+    try:
+        while is_running():
+            readable, _, _ = select.select(sockets, [], [], 1.0)
+            for sock in readable:
+                if sock is client_udp:
+                    data, addr = client_udp.recvfrom(65535)
+                    if addr[0] != client_host or (client_addr and addr != client_addr):
+                        continue
+                    if len(data) < 4 or data[2] != 0:
+                        continue
+                    client_addr = addr
+                    upstream_udp.sendto(data, upstream_relay)
+                    sent += len(data)
+                elif sock is upstream_udp:
+                    data, addr = upstream_udp.recvfrom(65535)
+                    if client_addr and addr[0] == upstream_relay[0]:
+                        client_udp.sendto(data, client_addr)
+                        received += len(data)
+                elif not sock.recv(RECV_SIZE):
+                    # 控制连接关闭, 关联结束
+                    return sent, received
+    except OSError:
+        pass
+    return sent, received
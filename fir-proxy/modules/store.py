@@ -0,0 +1,185 @@
+# modules/store.py
+
+import sqlite3
+import threading
+import time
+
+from .record import FIELDS, ProxyRecord
+
+# 持久化的代理字段 (ProxyRecord 的固定字段, 顺序相同)
+COLUMNS = FIELDS
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS proxies (
+    proxy TEXT PRIMARY KEY, protocol TEXT, status TEXT, latency REAL, speed REAL,
+    anonymity TEXT, location TEXT, score REAL, checked REAL
+);
+CREATE TABLE IF NOT EXISTS history (
+    proxy TEXT NOT NULL, checked REAL NOT NULL, status TEXT, latency REAL, speed REAL,
+    UNIQUE (proxy, checked)
+);
+"""
+
+
+def is_stale(proxy_info, max_age, now=None) -> bool:
+    """最近一次验证早于 max_age 秒前 (或从未记录验证时间) 的代理需要重新验证."""
+    checked = proxy_info.get('checked')
+    return checked is None or (now if now is not None else time.time()) - checked >= max_age
+
+
+def stale_proxies(proxies, max_age) -> list:
+    now = time.time()
+    return [p for p in proxies if is_stale(p, max_age, now)]
+
+
+class PoolStore:
+    """
+    代理池的 SQLite 持久化.
+    attach() 把上次保存的代理加载到轮换器 (启动后立即可用), 之后订阅轮换器的变化事件,
+    由后台线程每 flush_interval 秒 (或积累 batch_size 条变化时) 批量写入. 每次验证结果 (按 checked 区分)
+    在事件发生时记下, 另写入 history 表, 每个代理保留最近 history_limit 条.
+    """
+    def __init__(self, path, log_queue=None, flush_interval=1.0, batch_size=2000, history_limit=20):
+        self.path = path
+        self.log_queue = log_queue
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.history_limit = history_limit
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=NORMAL')
+        self._conn.executescript(_SCHEMA)
+        self._db_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._pending = {}          # 地址 -> 代理信息, None 表示已删除
+        self._history = []          # (地址, 验证时间, 状态, 延迟, 速度)
+        self._cleared = False
+        self._loading = None        # 正在加载的线程, 加载产生的事件无需写回
+        self._rotator = None
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def log(self, message):
+        if self.log_queue is not None:
+            self.log_queue.put(f"[Store] {message}")
+
+    def load(self) -> list:
+        """读取保存的全部代理."""
+        with self._db_lock:
+            rows = self._conn.execute(f"SELECT {', '.join(COLUMNS)} FROM proxies").fetchall()
+        return [ProxyRecord.from_row(row) for row in rows]
+
+    def load_history(self, proxy_address=None) -> dict:
+        """读取验证历史, 返回 {地址: [(时间, 状态, 延迟, 速度), ...]} (按时间升序)."""
+        query = "SELECT proxy, checked, status, latency, speed FROM history"
+        params = ()
+        if proxy_address is not None:
+            query += " WHERE proxy = ?"
+            params = (proxy_address,)
+        history = {}
+        with self._db_lock:
+            for address, *entry in self._conn.execute(query + " ORDER BY proxy, checked", params):
+                history.setdefault(address, []).append(tuple(entry))
+        return history
+
+    def attach(self, rotator) -> int:
+        """把保存的代理加载到轮换器, 并开始增量保存轮换器的变化. 返回加载的代理数."""
+        start = time.monotonic()
+        records = self.load()
+        self._loading = threading.get_ident()
+        try:
+            restored = rotator.add_many(records)
+        finally:
+            self._loading = None
+        self._rotator = rotator
+        rotator.subscribe(self._on_event)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._flush_loop, daemon=True)
+            self._thread.start()
+        if restored:
+            self.log(f"已从 {self.path} 恢复 {restored} 个代理, 耗时 {(time.monotonic() - start) * 1000:.0f} ms。")
+        return restored
+
+    def close(self):
+        """写入剩余的变化并关闭数据库."""
+        if self._rotator is not None:
+            self._rotator.unsubscribe(self._on_event)
+        self._stop.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join()
+        self.flush()
+        with self._db_lock:
+            self._conn.close()
+
+    def _on_event(self, event, proxy_address):
+        if self._loading == threading.get_ident():
+            return
+        with self._lock:
+            if event == 'cleared':
+                self._pending.clear()
+                self._history.clear()
+                self._cleared = True
+            elif event == 'removed':
+                self._pending[proxy_address] = None
+            else:
+                proxy_info = self._pending[proxy_address] = self._rotator.get_proxy(proxy_address)
+                if proxy_info is not None and proxy_info.get('checked') is not None:
+                    self._history.append((proxy_address, proxy_info.get('checked'), proxy_info.get('status'),
+                                          proxy_info.get('latency'), proxy_info.get('speed')))
+            pending = len(self._pending)
+        if pending >= self.batch_size:
+            self._wake.set()
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def flush(self):
+        """把积累的变化写入数据库."""
+        with self._lock:
+            pending, self._pending = self._pending, {}
+            history, self._history = self._history, []
+            cleared, self._cleared = self._cleared, False
+        if not pending and not cleared:
+            return
+        # 同一批中已删除的代理不再保留历史
+        history = [entry for entry in history if pending.get(entry[0], True) is not None]
+        rows, deleted = [], []
+        for address, proxy_info in pending.items():
+            if proxy_info is None:
+                deleted.append((address,))
+            else:
+                rows.append(tuple(proxy_info.get(name) for name in COLUMNS))
+        try:
+            with self._db_lock, self._conn:
+                if cleared:
+                    self._conn.execute("DELETE FROM proxies")
+                    self._conn.execute("DELETE FROM history")
+                self._conn.executemany("DELETE FROM proxies WHERE proxy = ?", deleted)
+                self._conn.executemany("DELETE FROM history WHERE proxy = ?", deleted)
+                self._conn.executemany(
+                    f"INSERT OR REPLACE INTO proxies ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                    rows)
+                self._conn.executemany("INSERT OR IGNORE INTO history VALUES (?, ?, ?, ?, ?)", history)
+                self._conn.executemany(
+                    "DELETE FROM history WHERE rowid IN (SELECT rowid FROM history WHERE proxy = ? "
+                    "ORDER BY checked DESC LIMIT -1 OFFSET ?)",
+                    ((address, self.history_limit) for address in {entry[0] for entry in history}))
+        except sqlite3.Error as e:
+            self.log(f"[!] 保存代理池失败: {e}")
+            self._requeue(pending, history, cleared)
+
+    def _requeue(self, pending, history, cleared):
+        """写入失败时把这批变化放回队列, 由下次 flush 重试; 期间产生的更新的变化优先."""
+        with self._lock:
+            if self._cleared:
+                # 失败之后代理池已被清空, 这批变化不再需要
+                return
+            for address, proxy_info in pending.items():
+                self._pending.setdefault(address, proxy_info)
+            self._history[:0] = history
+            self._cleared = cleared
@@ -0,0 +1,311 @@
+# modules/strategies.py
+
+import heapq
+import itertools
+import random
+
+# 抽样类策略在放弃并退回线性扫描之前的最大尝试次数
+MAX_TRIES = 8
+
+
+class SelectionStrategy:
+    """
+    代理选择策略.
+    轮换器的每个子集 (_View) 各自保存策略状态 (new_state 创建), 子集增删或更新代理、代理的健康系数变化时
+    通过状态的 added/removed/updated/truncate 增量维护, 使每次选择为 O(1) 或 O(log n).
+    new_state(view, factor) 中 factor(地址) 为代理按实际流量得到的健康系数, 按分数选择的策略以分数乘以该系数计算.
+    pick(view, state, accept, load) 返回一个满足 accept 的代理, 没有时返回 None;
+    load(地址) 为该代理当前的活动连接数.
+    """
+    name = None
+
+    def new_state(self, view, factor):
+        return None
+
+    def pick(self, view, state, accept, load):
+        raise NotImplementedError
+
+
+def _scan(view, accept, key=None):
+    """抽样失败时的退路: 线性扫描满足条件的代理, 指定 key 时取最小者."""
+    if key is None:
+        return next((p for p in view.items if p is not None and accept(p)), None)
+    return min((p for p in view.items if p is not None and accept(p)), key=key, default=None)
+
+
+def _sample(view):
+    """均匀随机取一个成员 (子集中的空位不超过约一半, 期望两次内命中)."""
+    items = view.items
+    for _ in range(MAX_TRIES):
+        proxy_info = items[random.randrange(len(items))]
+        if proxy_info is not None:
+            return proxy_info
+    return _scan(view, lambda p: True)
+
+
+class RoundRobin(SelectionStrategy):
+    """按加入顺序依次轮询."""
+    name = 'round_robin'
+
+    def pick(self, view, state, accept, load):
+        for _ in range(len(view.items)):
+            proxy_info = view.next()
+            if proxy_info is None or accept(proxy_info):
+                return proxy_info
+        return None
+
+
+class _Fenwick:
+    """树状数组: 维护各位置的权重, 支持 O(log n) 的单点修改和按前缀和查找."""
+    __slots__ = ('weights', 'tree', 'total')
+
+    def __init__(self, weights):
+        self.weights = list(weights)
+        n = len(self.weights)
+        self.tree = [0.0] * (n + 1)
+        for i in range(1, n + 1):
+            self.tree[i] += self.weights[i - 1]
+            parent = i + (i & -i)
+            if parent <= n:
+                self.tree[parent] += self.tree[i]
+        self.total = sum(self.weights)
+
+    def _prefix(self, count):
+        total = 0.0
+        while count > 0:
+            total += self.tree[count]
+            count -= count & -count
+        return total
+
+    def append(self, weight):
+        self.weights.append(weight)
+        n = len(self.weights)
+        self.tree.append(weight + self._prefix(n - 1) - self._prefix(n - (n & -n)))
+        self.total += weight
+
+    def set(self, index, weight):
+        delta = weight - self.weights[index]
+        if not delta:
+            return
+        self.weights[index] = weight
+        self.total += delta
+        i = index + 1
+        while i < len(self.tree):
+            self.tree[i] += delta
+            i += i & -i
+
+    def truncate(self, length):
+        # 被截掉的位置权重已经为 0, 直接丢弃即可
+        del self.weights[length:]
+        del self.tree[length + 1:]
+
+    def find(self, value):
+        """返回前缀和首次超过 value 的位置."""
+        position = 0
+        n = len(self.weights)
+        step = 1 << n.bit_length()
+        while step:
+            nxt = position + step
+            if nxt <= n and self.tree[nxt] <= value:
+                value -= self.tree[nxt]
+                position = nxt
+            step >>= 1
+        return min(position, n - 1)
+
+
+class _WeightState(_Fenwick):
+    """各位置的权重为 weight(代理)."""
+    __slots__ = ('weight',)
+
+    def __init__(self, view, weight):
+        self.weight = weight
+        super().__init__(0.0 if p is None else weight(p) for p in view.items)
+
+    def added(self, index, proxy_info):
+        self.append(self.weight(proxy_info))
+
+    def removed(self, index, proxy_info):
+        self.set(index, 0.0)
+
+    def updated(self, index, proxy_info):
+        self.set(index, self.weight(proxy_info))
+
+
+class ScoreWeighted(SelectionStrategy):
+    """按分数 (乘以健康系数) 加权随机, 分数越高被选中的概率越大."""
+    name = 'weighted'
+
+    @staticmethod
+    def weight(proxy_info):
+        return max(float(proxy_info.get('score', 0) or 0), 0.0)
+
+    def new_state(self, view, factor):
+        return _WeightState(view, lambda p: self.weight(p) * factor(p.get('proxy')))
+
+    def pick(self, view, state, accept, load):
+        if state.total <= 0:
+            # 所有分数都为 0 时退化为均匀随机
+            for _ in range(MAX_TRIES):
+                proxy_info = _sample(view)
+                if proxy_info is None or accept(proxy_info):
+                    return proxy_info
+            return _scan(view, accept)
+        for _ in range(MAX_TRIES):
+            proxy_info = view.items[state.find(random.random() * state.total)]
+            if proxy_info is not None and accept(proxy_info):
+                return proxy_info
+        return _scan(view, accept)
+
+
+class LatencyWeighted(ScoreWeighted):
+    """按验证延迟的倒数 (乘以健康系数) 加权随机, 延迟越低被选中的概率越大."""
+    name = 'latency'
+
+    @staticmethod
+    def weight(proxy_info):
+        latency = proxy_info.get('latency')
+        return 0.0 if latency is None else 1.0 / max(latency, 0.001)
+
+
+class PowerOfTwoChoices(SelectionStrategy):
+    """随机取两个代理, 选择活动连接较少的一个 (相同时取分数较高者)."""
+    name = 'p2c'
+
+    def pick(self, view, state, accept, load):
+        def rank(p):
+            return load(p.get('proxy')), -(p.get('score', 0) or 0)
+
+        for _ in range(MAX_TRIES):
+            choices = [p for p in (_sample(view), _sample(view)) if p is not None and accept(p)]
+            if choices:
+                return min(choices, key=rank)
+        return _scan(view, accept, key=rank)
+
+
+class _HeapState:
+    """
+    按 key(代理) 升序的最小堆, 更新时压入新条目, 与 keys 中当前值不符的条目即为过期条目, 遍历时跳过.
+    过期条目过多时整体重建.
+    """
+    __slots__ = ('heap', 'keys', 'key', 'counter')
+
+    def __init__(self, members, key):
+        self.key = key
+        self.counter = itertools.count()
+        self.keys = {p.get('proxy'): key(p) for p in members}
+        self.heap = [(value, next(self.counter), address) for address, value in self.keys.items()]
+        heapq.heapify(self.heap)
+
+    def added(self, index, proxy_info):
+        self._push(proxy_info)
+
+    def updated(self, index, proxy_info):
+        if self.keys.get(proxy_info.get('proxy')) != self.key(proxy_info):
+            self._push(proxy_info)
+
+    def removed(self, index, proxy_info):
+        self.keys.pop(proxy_info.get('proxy'), None)
+        self._prune()
+
+    def truncate(self, length):
+        pass
+
+    def _push(self, proxy_info):
+        address, value = proxy_info.get('proxy'), self.key(proxy_info)
+        self.keys[address] = value
+        heapq.heappush(self.heap, (value, next(self.counter), address))
+        self._prune()
+
+    def _prune(self):
+        if len(self.heap) > 2 * len(self.keys) + 64:
+            self.heap = [entry for entry in self.heap if self.keys.get(entry[2]) == entry[0]]
+            heapq.heapify(self.heap)
+
+    def ordered(self):
+        """按 key 升序依次给出 (key, 地址), 不修改堆; 取前 k 个为 O(k log k)."""
+        heap, keys = self.heap, self.keys
+        if not heap:
+            return
+        seen = set()
+        frontier = [(heap[0], 0)]
+        while frontier:
+            entry, index = heapq.heappop(frontier)
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heapq.heappush(frontier, (heap[child], child))
+            address = entry[2]
+            if keys.get(address) != entry[0] or address in seen:
+                continue        # 过期或重复的条目
+            seen.add(address)
+            yield entry[0], address
+
+
+class BestScore(SelectionStrategy):
+    """
+    优先选择分数 (乘以健康系数) 最高的代理.
+    在分数最高的 top 个可用代理中随机选择 (抖动), 避免所有连接同时涌向同一个代理.
+    """
+    name = 'best'
+    MAX_SCAN = 64
+
+    def __init__(self, top=3):
+        self.top = max(1, top)
+
+    def new_state(self, view, factor):
+        return _HeapState(view.members(), lambda p: -float(p.get('score', 0) or 0) * factor(p.get('proxy')))
+
+    def pick(self, view, state, accept, load):
+        chosen = []
+        for scanned, (_, address) in enumerate(state.ordered(), 1):
+            proxy_info = view.items[view.positions[address]]
+            if accept(proxy_info):
+                chosen.append(proxy_info)
+            if len(chosen) >= self.top or scanned >= self.MAX_SCAN:
+                break
+        if chosen:
+            return random.choice(chosen)
+        keys = state.keys
+        return _scan(view, accept, key=lambda p: keys.get(p.get('proxy'), 0.0))
+
+
+def _latency(proxy_info):
+    latency = proxy_info.get('latency')
+    return float('inf') if latency is None else latency
+
+
+class LeastConnections(SelectionStrategy):
+    """
+    选择活动连接最少的代理, 相同时取验证延迟最低者.
+    按延迟升序遍历子集, 遇到空闲的代理即返回; 有活动连接的代理不超过活动隧道数,
+    因此遍历的代理数与代理池大小无关.
+    """
+    name = 'least_conn'
+
+    def new_state(self, view, factor):
+        return _HeapState(view.members(), _latency)
+
+    def pick(self, view, state, accept, load):
+        best = fewest = None
+        for _, address in state.ordered():
+            proxy_info = view.items[view.positions[address]]
+            if not accept(proxy_info):
+                continue
+            active = load(address)
+            if not active:
+                return proxy_info
+            if best is None or active < fewest:
+                best, fewest = proxy_info, active
+        return best
+
+
+STRATEGIES = {cls.name: cls for cls in (RoundRobin, ScoreWeighted, LatencyWeighted, PowerOfTwoChoices, BestScore,
+                                        LeastConnections)}
+
+
+def make_strategy(strategy) -> SelectionStrategy:
+    """按名称创建策略, 已是策略实例时原样返回."""
+    if isinstance(strategy, SelectionStrategy):
+        return strategy
+    if strategy not in STRATEGIES:
+        raise ValueError(f"未知的选择策略: {strategy}")
+    return STRATEGIES[strategy]()
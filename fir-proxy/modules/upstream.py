@@ -0,0 +1,222 @@
+# modules/upstream.py
+
+import socket
+import struct
+import ipaddress
+
+PROXY_TYPES = ('HTTP', 'SOCKS4', 'SOCKS5')
+
+
+class UpstreamError(Exception):
+    """上游代理握手失败."""
+
+
+class TargetUnreachable(UpstreamError):
+    """上游代理可用, 但目标拒绝连接或不可达."""
+
+
+def split_address(address: str):
+    """将 'ip:port' 拆分为 (host, port)."""
+    host, _, port_str = address.rpartition(':')
+    return host.strip('[]'), int(port_str)
+
+
+def pack_socks5_address(host: str, port: int) -> bytes:
+    """编码 SOCKS5 地址字段 (ATYP + 地址 + 端口)."""
+    try:
+        ip = ipaddress.ip_address(host)
+    except ValueError:
+        encoded = host.encode('idna')
+        return b'\x03' + bytes([len(encoded)]) + encoded + struct.pack('!H', port)
+    if ip.version == 4:
+        return b'\x01' + ip.packed + struct.pack('!H', port)
+    return b'\x04' + ip.packed + struct.pack('!H', port)
+
+
+def socks5_greeting():
+    """SOCKS5 方法协商步骤 (无认证)."""
+    yield ('send', b'\x05\x01\x00')
+    reply = yield ('recv', 2)
+    if reply[0] != 5 or reply[1] != 0:
+        raise UpstreamError(f"SOCKS5 方法协商被拒绝: {reply!r}")
+
+
+_SOCKS5_COMMANDS = {1: 'CONNECT', 3: 'UDP ASSOCIATE'}
+
+
+def _socks5_command(command, host, port, greeted):
+    """发送 SOCKS5 请求并解析应答, 返回上游绑定的地址 (host, port)."""
+    if not greeted:
+        yield from socks5_greeting()
+    name = _SOCKS5_COMMANDS[command]
+    yield ('send', bytes([5, command, 0]) + pack_socks5_address(host, port))
+    head = yield ('recv', 4)
+    if head[0] != 5:
+        raise UpstreamError(f"SOCKS5 响应格式错误: {head!r}")
+    if head[1] in (3, 4, 5):
+        # 网络不可达 / 主机不可达 / 连接被拒绝: 由目标导致, 与上游代理本身无关
+        raise TargetUnreachable(f"SOCKS5 {name} 失败, 错误码 {head[1]}")
+    if head[1] != 0:
+        raise UpstreamError(f"SOCKS5 {name} 失败, 错误码 {head[1]}")
+    atyp = head[3]
+    if atyp == 1:
+        data = yield ('recv', 4 + 2)
+        bound_host = socket.inet_ntoa(data[:4])
+    elif atyp == 4:
+        data = yield ('recv', 16 + 2)
+        bound_host = socket.inet_ntop(socket.AF_INET6, data[:16])
+    elif atyp == 3:
+        length = yield ('recv', 1)
+        data = yield ('recv', length[0] + 2)
+        bound_host = data[:-2].decode('idna')
+    else:
+        raise UpstreamError(f"SOCKS5 未知地址类型: {atyp}")
+    return bound_host, struct.unpack('!H', data[-2:])[0]
+
+
+def _socks5_connect(host, port, greeted):
+    yield from _socks5_command(1, host, port, greeted)
+    return b''
+
+
+def socks5_udp_associate(greeted=False):
+    """SOCKS5 UDP ASSOCIATE 步骤, 返回上游的UDP中继地址 (host, port)."""
+    return (yield from _socks5_command(3, '0.0.0.0', 0, greeted))
+
+
+def _socks4_connect(host, port):
+    try:
+        packed_ip = socket.inet_aton(host)
+        domain = b''
+    except OSError:
+        # SOCKS4a: 由上游解析域名
+        packed_ip = b'\x00\x00\x00\x01'
+        domain = host.encode('idna') + b'\x00'
+    yield ('send', b'\x04\x01' + struct.pack('!H', port) + packed_ip + b'\x00' + domain)
+    reply = yield ('recv', 8)
+    if reply[1] != 0x5A:
+        raise UpstreamError(f"SOCKS4 CONNECT 失败, 错误码 {reply[1]}")
+    return b''
+
+
+def _http_connect(host, port):
+    target = f"[{host}]:{port}" if ':' in host else f"{host}:{port}"
+    yield ('send', f"CONNECT {target} HTTP/1.1\r\nHost: {target}\r\n\r\n".encode('ascii'))
+    buffer = b''
+    while b'\r\n\r\n' not in buffer:
+        if len(buffer) > 16384:
+            raise UpstreamError("HTTP CONNECT 响应头过长")
+        buffer += yield ('recv_some', 4096)
+    head, _, leftover = buffer.partition(b'\r\n\r\n')
+    status_line = head.split(b'\r\n', 1)[0].decode('latin-1')
+    parts = status_line.split()
+    if len(parts) < 2 or not parts[1].startswith('2'):
+        raise UpstreamError(f"HTTP CONNECT 失败: {status_line}")
+    return leftover
+
+
+def negotiate(protocol: str, host: str, port: int, greeted=False):
+    """
+    返回一个握手步骤生成器.
+    生成器产出 ('send', bytes) / ('recv', n) / ('recv_some', n) 操作,
+    由 run_handshake 或 run_handshake_async 驱动, 最终返回握手后多读到的数据.
+    """
+    protocol = protocol.upper()
+    if protocol == 'SOCKS5':
+        return _socks5_connect(host, port, greeted)
+    if protocol == 'SOCKS4':
+        return _socks4_connect(host, port)
+    if protocol == 'HTTP':
+        return _http_connect(host, port)
+    raise UpstreamError(f"不支持的上游代理协议: {protocol}")
+
+
+def _recv_exact(sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            raise UpstreamError("上游代理在握手期间关闭了连接")
+        data += chunk
+    return data
+
+
+def run_handshake(sock, steps):
+    """在阻塞socket上执行握手步骤."""
+    reply = None
+    try:
+        while True:
+            op, arg = steps.send(reply)
+            if op == 'send':
+                sock.sendall(arg)
+                reply = None
+            elif op == 'recv':
+                reply = _recv_exact(sock, arg)
+            else:
+                reply = sock.recv(arg)
+                if not reply:
+                    raise UpstreamError("上游代理在握手期间关闭了连接")
+    except StopIteration as stop:
+        return stop.value
+
+
+async def _recv_exact_async(loop, sock, size):
+    data = b''
+    while len(data) < size:
+        chunk = await loop.sock_recv(sock, size - len(data))
+        if not chunk:
+            raise UpstreamError("上游代理在握手期间关闭了连接")
+        data += chunk
+    return data
+
+
+async def run_handshake_async(loop, sock, steps):
+    """在非阻塞socket上通过事件循环执行握手步骤."""
+    reply = None
+    try:
+        while True:
+            op, arg = steps.send(reply)
+            if op == 'send':
+                await loop.sock_sendall(sock, arg)
+                reply = None
+            elif op == 'recv':
+                reply = await _recv_exact_async(loop, sock, arg)
+            else:
+                reply = await loop.sock_recv(sock, arg)
+                if not reply:
+                    raise UpstreamError("上游代理在握手期间关闭了连接")
+    except StopIteration as stop:
+        return stop.value
+
+
+def _socket_for(host):
+    family = socket.AF_INET6 if ':' in host else socket.AF_INET
+    return socket.socket(family, socket.SOCK_STREAM)
+
+
+def connect_proxy(proxy_address, timeout=10):
+    """阻塞方式建立到上游代理的TCP连接."""
+    proxy_host, proxy_port = split_address(proxy_address)
+    sock = _socket_for(proxy_host)
+    try:
+        sock.settimeout(timeout)
+        sock.connect((proxy_host, proxy_port))
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)
+        sock.settimeout(None)
+        return sock
+    except BaseException:
+        sock.close()
+        raise
+
+
+async def connect_proxy_async(loop, proxy_address):
+    """异步方式建立到上游代理的TCP连接, 返回非阻塞socket."""
+    proxy_host, proxy_port = split_address(proxy_address)
+    sock = _socket_for(proxy_host)
+    sock.setblocking(False)
+    try:
+        await loop.sock_connect(sock, (proxy_host, proxy_port))
+        return sock
+    except BaseException:
+        sock.close()
+        raise
@@ -0,0 +1,297 @@
+# modules/workers.py
+
+import multiprocessing
+import os
+import pickle
+import socket
+import threading
+
+from .async_server import AsyncProxyServer
+from .loghub import LogHub, classify, emit
+from .metrics import MetricsRegistry
+from .rotator import ProxyRotator
+
+REUSE_PORT_AVAILABLE = hasattr(socket, 'SO_REUSEPORT')
+
+
+class _WorkerLog:
+    """
+    把工作进程的日志转发到主进程的事件队列.
+    主进程的日志中心有过滤设置时, 先在本进程按相同的级别、采样率和速率限制 (按进程数分摊) 过滤,
+    被丢弃的日志不跨进程传递, 只把条数累加在该分类下一条转发的日志的 dropped 字段中.
+    """
+    def __init__(self, index, events, settings=None, share=1):
+        self._prefix = f"[Worker {index}] "
+        self._events = events
+        self._share = share
+        self._filter = None
+        self.configure(settings)
+
+    def configure(self, settings):
+        if settings is None:
+            self._filter = None
+            return
+        log_filter = LogHub(capacity=1)
+        log_filter.configure(settings, self._share)
+        self._filter = log_filter
+
+    def put(self, message):
+        message = self._prefix + message
+        level, category = classify(message)
+        self._forward(level, category, message, {})
+
+    def log(self, level, category, message, **fields):
+        self._forward(level, category, self._prefix + message, fields)
+
+    def _forward(self, level, category, message, fields):
+        log_filter = self._filter
+        if log_filter is not None:
+            if not log_filter.admit(level, category):
+                return
+            dropped = log_filter.take_dropped(category)
+            if dropped:
+                fields = dict(fields, dropped=dropped)
+        self._events.put(('record', level, category, message, fields))
+
+
+class _ReportingRotator(ProxyRotator):
+    """工作进程中的轮换器: 代理服务上报的连接结果照常计入本进程的健康度, 同时记下以便转发给主进程."""
+    def __init__(self):
+        super().__init__()
+        self._reports = []
+        self._reports_lock = threading.Lock()
+
+    def _keep(self, report):
+        with self._reports_lock:
+            self._reports.append(report)
+
+    def take_reports(self) -> list:
+        with self._reports_lock:
+            reports, self._reports = self._reports, []
+        return reports
+
+    def report_success(self, proxy_address, latency=None):
+        super().report_success(proxy_address, latency)
+        self._keep(('success', proxy_address, latency))
+
+    def report_failure(self, proxy_address):
+        super().report_failure(proxy_address)
+        self._keep(('failure', proxy_address))
+
+    def report_throughput(self, proxy_address, nbytes, seconds):
+        super().report_throughput(proxy_address, nbytes, seconds)
+        self._keep(('throughput', proxy_address, nbytes, seconds))
+
+    def report_transfer(self, proxy_address, nbytes):
+        super().report_transfer(proxy_address, nbytes)
+        self._keep(('transfer', proxy_address, nbytes))
+
+
+def _worker_main(index, server_kwargs, snapshot, balance, conn, events, stats_interval, log_settings, workers):
+    """工作进程入口: 以 SO_REUSEPORT 启动代理服务, 并从主进程接收轮换器快照."""
+    rotator = _ReportingRotator()
+    rotator.load_snapshot(snapshot)
+    metrics = MetricsRegistry()
+    log = _WorkerLog(index, events, log_settings, workers)
+    server = AsyncProxyServer(
+        rotator=rotator, log_queue=log, balance=balance, reuse_port=True,
+        metrics=metrics, **server_kwargs
+    )
+    server.start_all()
+    try:
+        while True:
+            if conn.poll(stats_interval):
+                message = conn.recv()
+                kind = message[0]
+                if kind == 'stop':
+                    break
+                if kind == 'snapshot':
+                    rotator.load_snapshot(pickle.loads(message[1]))
+                elif kind == 'balance':
+                    server.set_balance(message[1])
+                elif kind == 'logging':
+                    log.configure(message[1])
+            events.put(('stats', index, server.get_stats(), metrics.snapshot()))
+            # 连接结果随统计一起转发, 由主进程的轮换器计入健康度和用量
+            reports = rotator.take_reports()
+            if reports:
+                events.put(('reports', reports))
+    except (EOFError, OSError, KeyboardInterrupt):
+        # 主进程已退出
+        pass
+    finally:
+        server.stop_all()
+
+
+class MultiProcessProxyServer:
+    """
+    多进程代理服务.
+    启动多个工作进程, 各自以 SO_REUSEPORT 绑定相同的HTTP和SOCKS5端口并运行 AsyncProxyServer,
+    由内核在进程间分配新连接. 主进程中的轮换器仍是唯一的数据源, 其快照在版本变化时通过管道推送给各工作进程.
+    主进程的日志中心 (LogHub) 的过滤设置同样推送给工作进程, 日志在工作进程中过滤后才跨进程传递.
+    连接池、熔断器和负载均衡计数由各工作进程独立维护; 各进程的指标定期上报并在主进程的注册表中合并.
+    代理服务上报的连接结果 (成功、失败、速率、字节数) 每 STATS_INTERVAL 秒批量转发, 在主进程的轮换器上重放,
+    主进程的被动健康度、降级和按用量轮换因此反映全部工作进程的流量 (有相应的延迟). 各工作进程选择代理时的降级
+    只依据本进程的观测; 快照更新不会清除这些观测 (只丢弃已移除代理的数据).
+    """
+    SYNC_INTERVAL = 0.5         # 检查轮换器变化 (及日志过滤设置变化) 的间隔
+    STATS_INTERVAL = 1
+
+    def __init__(self, http_host, http_port, socks5_host, socks5_port, rotator, log_queue,
+                 workers=None, balance=None, metrics=None, **server_kwargs):
+        if not REUSE_PORT_AVAILABLE:
+            raise OSError("当前平台不支持 SO_REUSEPORT")
+        self._rotator = rotator
+        self._log_queue = log_queue
+        self._workers = workers or os.cpu_count() or 1
+        self._balance = balance
+        self._server_kwargs = dict(
+            server_kwargs, http_host=http_host, http_port=http_port,
+            socks5_host=socks5_host, socks5_port=socks5_port,
+        )
+        # spawn 方式避免在子进程中继承GUI等线程状态
+        self._context = multiprocessing.get_context('spawn')
+        self._processes = []
+        self._conns = []
+        self._events = None
+        self._running = False
+        self._stop_event = threading.Event()
+        self._sync_thread = None
+        self._events_thread = None
+        self._worker_stats = {}
+        self._worker_metrics = {}
+        self._conn_lock = threading.Lock()
+        if metrics is not None:
+            metrics.add_source(lambda: list(self._worker_metrics.values()))
+
+    def log(self, message):
+        self._log_queue.put(f"[Server] {message}")
+
+    def set_balance(self, strategy=None):
+        """设置负载均衡策略, 并同步到所有工作进程."""
+        self._balance = strategy
+        self._broadcast(('balance', strategy))
+
+    def get_stats(self) -> dict:
+        """导出各工作进程最近一次上报的运行统计."""
+        return {
+            'workers': {
+                index: stats for index, stats in self._worker_stats.items()
+                if index < len(self._processes) and self._processes[index].is_alive()
+            },
+        }
+
+    def start_all(self):
+        """启动所有工作进程."""
+        if self._running:
+            return
+        self._running = True
+        self._stop_event.clear()
+        self._worker_stats.clear()
+        self._worker_metrics.clear()
+        self._events = self._context.Queue()
+        snapshot = self._rotator.snapshot()
+        log_settings = self._log_settings()
+        for index in range(self._workers):
+            parent_conn, child_conn = self._context.Pipe()
+            process = self._context.Process(
+                target=_worker_main,
+                args=(index, self._server_kwargs, snapshot, self._balance, child_conn, self._events,
+                      self.STATS_INTERVAL, log_settings, self._workers),
+                daemon=True,
+            )
+            process.start()
+            child_conn.close()
+            self._processes.append(process)
+            self._conns.append(parent_conn)
+
+        self._events_thread = threading.Thread(target=self._events_loop, daemon=True)
+        self._events_thread.start()
+        self._sync_thread = threading.Thread(target=self._sync_loop, args=(snapshot['version'], log_settings),
+                                             daemon=True)
+        self._sync_thread.start()
+        self.log(f"已启动 {self._workers} 个代理工作进程 (SO_REUSEPORT)")
+
+    def stop_all(self):
+        """停止所有工作进程."""
+        if not self._running:
+            return
+        self._running = False
+        self._stop_event.set()
+        if self._sync_thread:
+            self._sync_thread.join()
+        self._broadcast(('stop',))
+        for process in self._processes:
+            process.join(10)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        with self._conn_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns = []
+        self._processes = []
+        self._worker_metrics.clear()
+        # 工作进程都已退出, 通知事件线程结束
+        self._events.put(None)
+        self._events_thread.join()
+        self.log("所有代理服务已停止。")
+
+    def _broadcast(self, message):
+        with self._conn_lock:
+            for conn in self._conns:
+                try:
+                    conn.send(message)
+                except OSError:
+                    # 工作进程已退出
+                    pass
+
+    def _log_settings(self):
+        """主进程日志中心的过滤设置, 旧式 log_queue 没有过滤设置时返回 None."""
+        settings = getattr(self._log_queue, 'settings', None)
+        return settings() if callable(settings) else None
+
+    def _sync_loop(self, version, log_settings):
+        """
+        轮换器的版本变化时向工作进程推送快照 (代理信息的修改都经由轮换器的方法, 均会递增版本),
+        日志过滤设置变化时推送新的设置.
+        """
+        while not self._stop_event.wait(self.SYNC_INTERVAL):
+            settings = self._log_settings()
+            if settings != log_settings:
+                log_settings = settings
+                self._broadcast(('logging', settings))
+            if self._rotator.version == version:
+                continue
+            snapshot = self._rotator.snapshot()
+            version = snapshot['version']
+            # 只序列化一次, 各进程共用
+            self._broadcast(('snapshot', pickle.dumps(snapshot, pickle.HIGHEST_PROTOCOL)))
+
+    def _events_loop(self):
+        """转发工作进程的日志并收集统计."""
+        while True:
+            try:
+                event = self._events.get()
+            except (EOFError, OSError):
+                break
+            if event is None:
+                break
+            if event[0] == 'record':
+                emit(self._log_queue, event[1], event[2], event[3], **event[4])
+            elif event[0] == 'stats':
+                self._worker_stats[event[1]] = event[2]
+                self._worker_metrics[event[1]] = event[3]
+            elif event[0] == 'reports':
+                for kind, *args in event[1]:
+                    getattr(self._rotator, 'report_' + kind)(*args)
+
+
+def create_proxy_server(workers=1, **kwargs):
+    """
+    创建代理服务: workers > 1 且平台支持 SO_REUSEPORT 时使用多进程模式,
+    否则退回单进程的 AsyncProxyServer.
+    """
+    if workers and workers > 1 and REUSE_PORT_AVAILABLE:
+        return MultiProcessProxyServer(workers=workers, **kwargs)
+    return AsyncProxyServer(**kwargs)